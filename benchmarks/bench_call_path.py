@@ -0,0 +1,69 @@
+"""
+Measure client-side overhead of a PyAria2 RPC call.
+
+By default the server proxy answers every call with a canned result without
+marshalling anything, so only the client path is timed: argument handling,
+token, proxy lookup. XML-RPC marshalling costs roughly ten times as much and
+its run-to-run noise would hide differences in that path; --marshal times it
+too, through a transport answering with a canned response. The "legacy" run
+calls the proxy the way PyAria2 did before its methods were generated from
+RPC_METHODS: a fresh attribute lookup and token string per call.
+
+    python benchmarks/bench_call_path.py --calls 1000000
+    python benchmarks/bench_call_path.py --calls 100000 --marshal
+"""
+
+import argparse
+import timeit
+
+import xmlrpc.client as xmlrpclib
+
+from pyaria2.pyaria2 import AriaServerSettings, PyAria2
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--calls", dest="calls", default=1000000, type=int)
+parser.add_argument("--marshal", dest="marshal", action="store_true",
+                    help="include XML-RPC marshalling of the request and response")
+args = parser.parse_args()
+
+RESULT = {"status": "active"}
+RESPONSE = xmlrpclib.dumps((RESULT,), methodresponse=True)
+
+
+class CannedTransport(xmlrpclib.Transport):
+    def request(self, host, handler, request_body, verbose=False):
+        parser, unmarshaller = self.getparser()
+        parser.feed(RESPONSE)
+        parser.close()
+        return unmarshaller.close()
+
+
+class CannedServerProxy(xmlrpclib.ServerProxy):
+    # Replaces the private method that marshals, sends and unmarshals a call
+    def _ServerProxy__request(self, methodname, params):
+        return RESULT
+
+
+client = PyAria2(AriaServerSettings(rpc_secret="secret"), start_server=False)
+if args.marshal:
+    client.server = xmlrpclib.ServerProxy(client.serverUri, transport=CannedTransport(), allow_none=True)
+else:
+    client.server = CannedServerProxy(client.serverUri, allow_none=True)
+
+
+def legacy():
+    if client.useSecret:
+        return client.server.aria2.tellStatus("token:" + client.rpcSecret, "2089b05ecca3d829", None)
+    else:
+        return client.server.aria2.tellStatus("2089b05ecca3d829", None)
+
+
+def generated():
+    return client.tellStatus("2089b05ecca3d829")
+
+
+assert legacy() == generated() == RESULT
+print("%s, %d calls" % ("with marshalling" if args.marshal else "client path only", args.calls))
+for name, func in (("legacy", legacy), ("generated", generated)):
+    elapsed = min(timeit.repeat(func, number=args.calls, repeat=5))
+    print("%-10s %6.2f us/call" % (name, elapsed / args.calls * 1e6))
@@ -0,0 +1,86 @@
+"""
+Compare preloading downloads through --input-file with pushing them over RPC.
+
+Both runs start a fresh aria2c on the given port and add paused downloads, so
+nothing is actually fetched; the time measured is from process start until the
+daemon reports every download as waiting.
+
+    python benchmarks/bench_input_file.py --count 100000
+"""
+
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+
+import xmlrpc.client as xmlrpclib
+
+from pyaria2.pyaria2 import AriaServerSettings, SERVER_URI_FORMAT
+from pyaria2.inputfile import compileInputFile
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--count", dest="count", default=10000, type=int)
+parser.add_argument("--port", dest="port", default=6899, type=int)
+parser.add_argument("--batch", dest="batch", default=1000, type=int,
+                    help="downloads per system.multicall in the RPC run, 1 disables multicall")
+args = parser.parse_args()
+
+
+def records():
+    for i in range(args.count):
+        yield ["http://example.invalid/file/%d" % i], {"pause": True}
+
+
+def wait_for_daemon(server):
+    while True:
+        try:
+            return server.aria2.getGlobalStat()
+        except (OSError, xmlrpclib.Fault):
+            time.sleep(0.05)
+
+
+def wait_for_downloads(server):
+    while int(wait_for_daemon(server)["numWaiting"]) < args.count:
+        time.sleep(0.05)
+
+
+def launch(settings):
+    argv = ["aria2c", "--enable-rpc"] + settings.construct_as_command_line().split()
+    return subprocess.Popen(argv, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def run(workdir, preload):
+    settings = AriaServerSettings(rpc_listen_port=args.port, dir=workdir,
+                                  max_download_result=args.count)
+    server = xmlrpclib.ServerProxy(SERVER_URI_FORMAT.format("localhost", args.port))
+    start = time.time()
+    if preload:
+        settings.input_file = os.path.join(workdir, "input.txt")
+        compileInputFile(records(), settings.input_file)
+    process = launch(settings)
+    try:
+        wait_for_daemon(server)
+        if not preload:
+            pending = []
+            for uris, options in records():
+                if args.batch <= 1:
+                    server.aria2.addUri(uris, options)
+                    continue
+                pending.append({"methodName": "aria2.addUri", "params": [uris, options]})
+                if len(pending) == args.batch:
+                    server.system.multicall(pending)
+                    pending = []
+            if pending:
+                server.system.multicall(pending)
+        wait_for_downloads(server)
+        return time.time() - start
+    finally:
+        process.terminate()
+        process.wait()
+
+
+for name, preload in (("input-file", True), ("rpc", False)):
+    with tempfile.TemporaryDirectory() as workdir:
+        elapsed = run(workdir, preload)
+    print("%-10s %8d downloads in %7.2fs (%9.0f/s)" % (name, args.count, elapsed, args.count / elapsed))
@@ -0,0 +1,64 @@
+"""
+Hashing throughput of the verification pipeline on large files.
+
+Creates --files files of --size MiB each, then hashes them with a plain
+read() loop in this process and with Verifier (memory-mapped reads in a
+process pool), computing every --algorithm in a single pass.
+
+    python benchmarks/bench_verify.py --files 4 --size 2048 --algorithm md5 --algorithm sha256
+"""
+
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+
+from pyaria2.verify import Verifier
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--files", dest="files", default=4, type=int)
+parser.add_argument("--size", dest="size", default=1024, type=int, help="MiB per file")
+parser.add_argument("--algorithm", dest="algorithms", action="append")
+parser.add_argument("--workers", dest="workers", default=None, type=int)
+parser.add_argument("--dir", dest="dir", default=None, help="where to create the files")
+args = parser.parse_args()
+algorithms = tuple(args.algorithms or ["sha256"])
+
+
+def create(path):
+    block = os.urandom(1024 * 1024)
+    with open(path, "wb") as fileobj:
+        for i in range(args.size):
+            fileobj.write(block)
+
+
+def naive(path):
+    hashers = [hashlib.new(algorithm) for algorithm in algorithms]
+    with open(path, "rb") as fileobj:
+        for chunk in iter(lambda: fileobj.read(1024 * 1024), b""):
+            for hasher in hashers:
+                hasher.update(chunk)
+    return [hasher.hexdigest() for hasher in hashers]
+
+
+with tempfile.TemporaryDirectory(dir=args.dir) as workdir:
+    paths = [os.path.join(workdir, "file%d" % i) for i in range(args.files)]
+    for path in paths:
+        create(path)
+    total = args.files * args.size
+
+    start = time.time()
+    manifest = dict((path, dict(zip(algorithms, naive(path)))) for path in paths)
+    elapsed = time.time() - start
+    print("read loop %8d MiB in %7.2fs (%7.1f MiB/s)" % (total, elapsed, total / elapsed))
+
+    verifier = Verifier(manifest, workers=args.workers)
+    results = [{"gid": "%016x" % (i + 1), "status": "complete", "files": [{"path": path}]}
+               for i, path in enumerate(paths)]
+    start = time.time()
+    verified = verifier.verify(results)
+    elapsed = time.time() - start
+    verifier.close()
+    assert all(result.ok for result in verified)
+    print("verifier  %8d MiB in %7.2fs (%7.1f MiB/s)" % (total, elapsed, total / elapsed))
@@ -0,0 +1,400 @@
+'''
+Disk-space-aware admission control for new downloads.
+
+aria2 only fails a download for lack of space (error 9) after it has spent
+bandwidth on it. AdmissionController reserves the expected size of every
+download on the filesystem it will be written to and holds new submissions
+client-side while those reservations would exceed the free space. A single
+DiskSpaceLedger can be shared by the controllers of several daemons writing
+to the same volumes.
+'''
+
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import threading
+import xml.etree.ElementTree as ElementTree
+
+from collections import deque
+from urllib.parse import urlsplit
+
+from .periodic import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLL_INTERVAL = 5
+
+FINISHED_STATUSES = frozenset(['complete', 'error', 'removed'])
+
+STATUS_KEYS = ['gid', 'status', 'totalLength', 'completedLength', 'files', 'followedBy']
+
+# URIs aria2 downloads as metadata before continuing with the payload under new GIDs
+METADATA_SUFFIXES = ('.torrent', '.metalink', '.meta4')
+
+
+def bdecode(data, index=0):
+    '''
+    Decode one bencoded value starting at index.
+
+    return: tuple (value, index after the value). Strings are returned as bytes.
+    '''
+    token = data[index:index + 1]
+    if token == b'i':
+        end = data.index(b'e', index)
+        return int(data[index + 1:end]), end + 1
+    if token == b'l':
+        index += 1
+        values = []
+        while data[index:index + 1] != b'e':
+            value, index = bdecode(data, index)
+            values.append(value)
+        return values, index + 1
+    if token == b'd':
+        index += 1
+        values = {}
+        while data[index:index + 1] != b'e':
+            key, index = bdecode(data, index)
+            values[key], index = bdecode(data, index)
+        return values, index + 1
+    if token.isdigit():
+        colon = data.index(b':', index)
+        start = colon + 1
+        end = start + int(data[index:colon])
+        return data[start:end], end
+    raise ValueError("Invalid bencoded data at offset %d" % index)
+
+
+def torrentLength(torrent):
+    '''
+    return: total size in bytes of the files described by a ".torrent" file.
+    '''
+    with open(torrent, 'rb') as torrentfile:
+        meta, _ = bdecode(torrentfile.read())
+    info = meta[b'info']
+    if b'files' in info:
+        return sum(entry[b'length'] for entry in info[b'files'])
+    return info[b'length']
+
+
+def metalinkLength(metalink):
+    '''
+    return: total size in bytes of the files of a Metalink (v3 or v4) document, 0 if unknown.
+    '''
+    total = 0
+    for element in ElementTree.parse(metalink).iter():
+        if element.tag == 'size' or element.tag.endswith('}size'):
+            total += int(element.text.strip())
+    return total
+
+
+def isMetadataUri(uri):
+    return uri.startswith('magnet:') or urlsplit(uri).path.lower().endswith(METADATA_SUFFIXES)
+
+
+def allocatedLength(files):
+    '''
+    Bytes already taken on disk by the selected files of a download, as
+    returned in the "files" key of tellStatus. Those no longer need a reservation.
+    '''
+    total = 0
+    for entry in files:
+        if entry.get('selected', 'true') != 'true' or not entry.get('path'):
+            continue
+        try:
+            stat = os.stat(entry['path'])
+        except OSError:
+            continue
+        on_disk = stat.st_blocks * 512 if hasattr(stat, 'st_blocks') else stat.st_size
+        total += min(on_disk, int(entry['length']))
+    return total
+
+
+class DiskSpaceLedger(object):
+    '''
+    Space reservations per filesystem.
+
+    margin: integer, bytes always kept free on every filesystem
+
+    A reservation of unknown size (0) is still only made while some space is
+    neither used nor reserved.
+    '''
+
+    def __init__(self, margin=0):
+        self.margin = margin
+        self._reservations = {}
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def filesystem(self, path):
+        '''
+        return: tuple (device id of the filesystem path would be created on, closest existing path).
+        '''
+        path = os.path.abspath(path)
+        while not os.path.exists(path):
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+        return os.stat(path).st_dev, path
+
+    def free(self, path):
+        stat = os.statvfs(path)
+        return stat.f_bavail * stat.f_frsize
+
+    def reserved(self, device):
+        with self._lock:
+            return sum(size for key, size in self._reservations.items() if self._devices[key] == device)
+
+    def available(self, path):
+        '''
+        return: free bytes on the filesystem of path not yet reserved.
+        '''
+        device, existing = self.filesystem(path)
+        return self.free(existing) - self.reserved(device) - self.margin
+
+    def reserve(self, key, path, size):
+        '''
+        Reserve size bytes for key if they fit.
+
+        return: True if the reservation was made.
+        '''
+        device, existing = self.filesystem(path)
+        free = self.free(existing)
+        with self._lock:
+            reserved = sum(held for other, held in self._reservations.items() if self._devices[other] == device)
+            if reserved + max(size, 1) + self.margin > free:
+                return False
+            self._reservations[key] = size
+            self._devices[key] = device
+        return True
+
+    def update(self, key, size):
+        with self._lock:
+            if key in self._reservations:
+                self._reservations[key] = max(0, size)
+
+    def release(self, key):
+        with self._lock:
+            self._reservations.pop(key, None)
+            self._devices.pop(key, None)
+
+
+class Submission(object):
+    '''
+    A download handed to an AdmissionController.
+
+    gids is empty while the download is held client-side. error is the
+    exception raised when a held download was finally submitted, as nobody
+    is there to catch it. awaitsFollowers is True for metadata downloads
+    (magnet links, URLs of .torrent and metalink files) until aria2
+    continues them under new GIDs.
+    '''
+
+    def __init__(self, method, args, size, directory, awaits_followers=False):
+        self.method = method
+        self.args = args
+        self.size = size
+        self.directory = directory
+        self.awaitsFollowers = awaits_followers
+        self.gids = []
+        self.error = None
+
+    @property
+    def gid(self):
+        return self.gids[0] if self.gids else None
+
+    @property
+    def held(self):
+        return not self.gids and self.error is None
+
+    def __repr__(self):
+        return '<Submission %s %s gids=%s size=%d>' % (self.method, self.directory, self.gids, self.size)
+
+
+class AdmissionController(PeriodicTask):
+    '''
+    Wraps addUri/addTorrent/addMetalink of a PyAria2 client with space reservations.
+
+    Sizes of torrents and metalinks are read from their metadata, the size of
+    a URI download can be passed in, or default_size is reserved until aria2
+    reports its totalLength. Every poll (see PeriodicTask) shrinks
+    reservations to the part not yet allocated on disk, releases finished
+    downloads and submits held ones that fit. The reservation of a metadata
+    download carries over to the GIDs aria2 continues it with (followedBy).
+    '''
+
+    def __init__(self, client, ledger=None, default_size=0, interval=DEFAULT_POLL_INTERVAL):
+        '''
+        :type client: PyAria2
+        :type ledger: DiskSpaceLedger
+        '''
+        super(AdmissionController, self).__init__(interval)
+        self.client = client
+        self.ledger = ledger or DiskSpaceLedger()
+        self.defaultSize = default_size
+        self.pending = deque()
+        self.admitted = {}
+        self._globalDir = None
+        self._lock = threading.RLock()
+
+    def addUri(self, uris, options=None, position=None, size=None):
+        '''
+        size: integer, expected size in bytes if known
+
+        return: Submission
+        '''
+        uris, options = self.client.fixUris(uris), self.client.fixOptions(options)
+        if size is None:
+            size = self.defaultSize
+        return self._admit(Submission('addUri', (uris, options, position), size, self._directory(options),
+                                      any(isMetadataUri(uri) for uri in uris)))
+
+    def addTorrent(self, torrent, uris=None, options=None, position=None, size=None):
+        '''
+        return: Submission
+        '''
+        options = self.client.fixOptions(options)
+        if size is None:
+            size = torrentLength(torrent)
+        return self._admit(Submission('addTorrent', (torrent, uris, options, position), size,
+                                      self._directory(options)))
+
+    def addMetalink(self, metalink, options=None, position=None, size=None):
+        '''
+        return: Submission
+        '''
+        options = self.client.fixOptions(options)
+        if size is None:
+            size = metalinkLength(metalink) or self.defaultSize
+        return self._admit(Submission('addMetalink', (metalink, options, position), size,
+                                      self._directory(options)))
+
+    def remove(self, gid):
+        result = self.client.remove(gid)
+        self.release(gid)
+        return result
+
+    def forceRemove(self, gid):
+        result = self.client.forceRemove(gid)
+        self.release(gid)
+        return result
+
+    def release(self, gid):
+        with self._lock:
+            submission = self.admitted.pop(gid, None)
+            if submission is None:
+                return
+            for other in submission.gids:
+                self.admitted.pop(other, None)
+            self.ledger.release(submission)
+        self._drain()
+
+    def runOnce(self):
+        self.poll()
+
+    def poll(self):
+        '''
+        Refresh reservations of admitted downloads and submit held ones that now fit.
+        '''
+        with self._lock:
+            gids = list(self.admitted)
+        if gids:
+            batch = self.client.batch()
+            for gid in gids:
+                batch.tellStatus(gid, STATUS_KEYS)
+            statuses = batch.execute()
+            remaining, finished, followed = {}, set(), {}
+            for gid, status in zip(gids, statuses):
+                if isinstance(status, dict) and status.get('followedBy'):
+                    followed[gid] = status['followedBy']
+                if not isinstance(status, dict) or status['status'] in FINISHED_STATUSES:
+                    # Faults mean aria2 forgot the download, e.g. after purgeDownloadResult
+                    finished.add(gid)
+                    remaining[gid] = 0
+                    continue
+                total = int(status['totalLength'])
+                if total:
+                    remaining[gid] = max(0, total - allocatedLength(status.get('files', [])))
+            with self._lock:
+                for gid, followers in followed.items():
+                    self._follow(gid, followers, gid in finished)
+                submissions = set(self.admitted.values())
+            for submission in submissions:
+                if all(gid in finished for gid in submission.gids):
+                    self.release(submission.gid)
+                elif not submission.awaitsFollowers and all(gid in remaining for gid in submission.gids):
+                    self.ledger.update(submission, sum(remaining[gid] for gid in submission.gids))
+        self._drain()
+
+    def _follow(self, gid, followers, finished):
+        '''
+        Move the reservation of a metadata download to the downloads aria2 continued it with.
+        '''
+        submission = self.admitted.get(gid)
+        if submission is None:
+            return
+        for follower in followers:
+            if follower not in submission.gids:
+                logger.debug("%s continues %r, keeping its reservation", follower, submission)
+                submission.gids.append(follower)
+                self.admitted[follower] = submission
+        submission.awaitsFollowers = False
+        if finished:
+            submission.gids.remove(gid)
+            del self.admitted[gid]
+
+    def _admit(self, submission):
+        device, existing = self.ledger.filesystem(submission.directory)
+        stat = os.statvfs(existing)
+        if submission.size > stat.f_blocks * stat.f_frsize:
+            raise ValueError("%r is larger than the filesystem it is written to" % submission)
+        with self._lock:
+            if self.pending or not self.ledger.reserve(submission, submission.directory, submission.size):
+                logger.info("Holding %r, not enough free space", submission)
+                self.pending.append(submission)
+                return submission
+        self._submit(submission)
+        return submission
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                if not self.pending:
+                    return
+                submission = self.pending[0]
+                if not self.ledger.reserve(submission, submission.directory, submission.size):
+                    return
+                self.pending.popleft()
+            try:
+                self._submit(submission)
+            except Exception as e:
+                logger.exception("Submitting held %r failed", submission)
+                submission.error = e
+
+    def _submit(self, submission):
+        try:
+            gids = getattr(self.client, submission.method)(*submission.args)
+        except Exception:
+            self.ledger.release(submission)
+            raise
+        if gids is None:
+            # Deduplicated by the client, nothing new to account for
+            self.ledger.release(submission)
+            return
+        submission.gids = gids if isinstance(gids, list) else [gids]
+        with self._lock:
+            if any(gid in self.admitted for gid in submission.gids):
+                # Deduplicated to a download which already holds a reservation
+                self.ledger.release(submission)
+                return
+            for gid in submission.gids:
+                self.admitted[gid] = submission
+
+    def _directory(self, options):
+        directory = options.get('dir')
+        if directory is None:
+            if self._globalDir is None:
+                self._globalDir = self.client.getGlobalOption()['dir']
+            directory = self._globalDir
+        return directory
@@ -0,0 +1,170 @@
+'''
+Bounded daemon memory through automatic purging of download results.
+
+aria2c keeps every completed, errored and removed download in memory until
+its result is removed, which makes long-running daemons grow and slows down
+tellStopped. RetentionPolicy pages through the oldest stopped results,
+stores them in a ResultArchive (a small SQLite file) and removes them from
+the daemon in batches, so "what happened to GID X" can still be answered.
+'''
+
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+import xmlrpc.client as xmlrpclib
+
+from .periodic import PeriodicTask
+from .pyaria2 import effectiveStatus
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_KEEP = 1000
+DEFAULT_PAGE_SIZE = 500
+DEFAULT_INTERVAL = 60
+
+RESULT_KEYS = ['gid', 'status', 'errorCode', 'errorMessage', 'totalLength', 'completedLength', 'dir',
+               'infoHash', 'files']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (
+    gid TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    errorCode INTEGER,
+    errorMessage TEXT,
+    totalLength INTEGER,
+    completedLength INTEGER,
+    dir TEXT,
+    infoHash TEXT,
+    files TEXT,
+    archived REAL NOT NULL
+)
+'''
+
+
+def packFiles(files):
+    # Only what is needed to find the data again, as compact JSON
+    return json.dumps([[entry.get('path', ''), int(entry.get('length', 0)), int(entry.get('completedLength', 0))]
+                       for entry in files], separators=(',', ':'))
+
+
+def unpackFiles(packed):
+    return [{'path': path, 'length': str(length), 'completedLength': str(completed)}
+            for path, length, completed in json.loads(packed or '[]')]
+
+
+class ResultArchive(object):
+    '''
+    SQLite store of download results, looked up by GID.
+
+    Results are returned in the shape tellStatus uses (string values). Downloads
+    removed with all of their data are stored as complete, see effectiveStatus.
+    '''
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(SCHEMA)
+        self._lock = threading.Lock()
+
+    def store(self, results):
+        now = time.time()
+        rows = [(result['gid'], effectiveStatus(result), int(result.get('errorCode') or 0) if 'errorCode' in result else None,
+                 result.get('errorMessage'), int(result.get('totalLength', 0)),
+                 int(result.get('completedLength', 0)), result.get('dir'), result.get('infoHash'),
+                 packFiles(result.get('files', [])), now)
+                for result in results]
+        with self._lock:
+            with self._db:
+                self._db.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def lookup(self, gid):
+        '''
+        return: dict like tellStatus, or None for an unknown GID.
+        '''
+        with self._lock:
+            row = self._db.execute('SELECT gid, status, errorCode, errorMessage, totalLength, completedLength, dir, '
+                                   'infoHash, files FROM results WHERE gid = ?', (gid,)).fetchone()
+        if row is None:
+            return None
+        result = {'gid': row[0], 'status': row[1], 'totalLength': str(row[4]), 'completedLength': str(row[5]),
+                  'files': unpackFiles(row[8])}
+        for key, value in (('errorCode', row[2]), ('errorMessage', row[3]), ('dir', row[6]), ('infoHash', row[7])):
+            if value is not None:
+                result[key] = str(value)
+        return result
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+
+class RetentionPolicy(PeriodicTask):
+    '''
+    Keeps at most keep stopped results in the daemon, archiving the oldest.
+    '''
+
+    def __init__(self, client, archive=None, keep=DEFAULT_KEEP, page_size=DEFAULT_PAGE_SIZE,
+                 interval=DEFAULT_INTERVAL):
+        '''
+        :type client: PyAria2
+        :type archive: ResultArchive
+        '''
+        super(RetentionPolicy, self).__init__(interval)
+        self.client = client
+        self.archive = archive or ResultArchive()
+        self.keep = keep
+        self.pageSize = page_size
+
+    def runOnce(self):
+        self.purge()
+
+    def purge(self):
+        '''
+        Archive and remove stopped results beyond keep.
+
+        return: number of results removed from the daemon.
+        '''
+        excess = int(self.client.getGlobalStat()['numStopped']) - self.keep
+        removed = 0
+        while excess > 0:
+            # The least recently stopped results come first, removing them shifts the rest to offset 0
+            page = self.client.tellStopped(0, min(self.pageSize, excess), RESULT_KEYS)
+            if not page:
+                break
+            self.archive.store(page)
+            batch = self.client.batch()
+            for result in page:
+                batch.removeDownloadResult(result['gid'])
+            failed = [result for result in batch.execute() if isinstance(result, xmlrpclib.Fault)]
+            if failed:
+                logger.warning("%d of %d results could not be removed: %s", len(failed), len(page), failed[0])
+            removed += len(page) - len(failed)
+            excess -= len(page)
+            if len(failed) == len(page):
+                break
+        if removed:
+            logger.info("Archived and removed %d download results", removed)
+        return removed
+
+    def statusOf(self, gid, keys=None):
+        '''
+        Status of a download, asked to the daemon first and the archive for purged results.
+
+        return: dict like tellStatus, or None if neither knows the GID.
+        '''
+        try:
+            return self.client.tellStatus(gid, keys)
+        except xmlrpclib.Fault:
+            result = self.archive.lookup(gid)
+            if result is not None and keys:
+                result = dict((key, value) for key, value in result.items() if key in keys)
+            return result
@@ -0,0 +1,313 @@
+'''
+URI deduplication in front of addUri.
+
+aria2 only notices a duplicate (error 11, "downloading same file") after it has
+been submitted. DedupIndex normalizes URIs and remembers what was already
+added: an exact map of URI -> GID covers small jobs, and a Bloom filter, which
+can be persisted to disk, takes over when the number of URIs grows beyond it.
+'''
+
+# -*- coding: utf-8 -*-
+
+import hashlib
+import logging
+import math
+import os
+import re
+import struct
+import threading
+
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORTS = {
+    'http': 80,
+    'https': 443,
+    'ftp': 21,
+    'sftp': 22,
+}
+
+DEFAULT_EXACT_LIMIT = 1000000
+DEFAULT_CAPACITY = 50000000
+DEFAULT_ERROR_RATE = 0.001
+
+BLOOM_MAGIC = b'PAB1'
+BLOOM_HEADER = struct.Struct('<4sIQQ')
+
+# lookup() results
+NEW = 'new'
+EXACT = 'exact'
+PROBABLE = 'probable'
+
+_ESCAPE_RE = re.compile(r'%[0-9a-fA-F]{2}')
+
+
+def normalizeUri(uri):
+    '''
+    Normalize a URI so trivially different spellings of it compare equal.
+
+    Scheme and host are lower-cased, default ports, fragments and empty paths
+    are dropped, and percent escapes are upper-cased. Magnet links are reduced
+    to their BitTorrent info hash.
+    '''
+    uri = uri.strip()
+    parts = urlsplit(uri)
+    scheme = parts.scheme.lower()
+
+    if scheme == 'magnet':
+        for name, value in parse_qsl(parts.query):
+            if name == 'xt' and value.lower().startswith('urn:btih:'):
+                return 'magnet:?xt=urn:btih:' + value[9:].lower()
+        return uri
+
+    if not parts.netloc:
+        return uri
+
+    host = (parts.hostname or '').lower()
+    if ':' in host:
+        host = '[%s]' % host
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        host = '%s:%d' % (host, port)
+    if parts.username is not None:
+        userinfo = parts.username
+        if parts.password is not None:
+            userinfo += ':' + parts.password
+        host = userinfo + '@' + host
+
+    path = _ESCAPE_RE.sub(lambda match: match.group(0).upper(), parts.path) or '/'
+    query = _ESCAPE_RE.sub(lambda match: match.group(0).upper(), parts.query)
+    return urlunsplit((scheme, host, path, query, ''))
+
+
+class BloomFilter(object):
+    '''
+    Fixed-size Bloom filter over strings, sized from capacity and error_rate.
+    '''
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, error_rate=DEFAULT_ERROR_RATE):
+        if capacity <= 0 or not 0 < error_rate < 1:
+            raise ValueError("capacity must be positive and error_rate between 0 and 1")
+        self.numBits = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.numHashes = max(1, int(round(self.numBits / float(capacity) * math.log(2))))
+        self.count = 0
+        self.bits = bytearray((self.numBits + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first, second = struct.unpack('<QQ', digest)
+        second |= 1
+        for i in range(self.numHashes):
+            yield (first + i * second) % self.numBits
+
+    def __contains__(self, key):
+        bits = self.bits
+        for position in self._positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, key):
+        '''
+        return: True if key was (probably) present already.
+        '''
+        bits = self.bits
+        present = True
+        for position in self._positions(key):
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                present = False
+                bits[position >> 3] |= mask
+        if not present:
+            self.count += 1
+        return present
+
+    def falsePositiveRate(self):
+        '''
+        return: estimated probability that an unseen key is reported as present.
+        '''
+        return (1.0 - math.exp(-self.numHashes * self.count / float(self.numBits))) ** self.numHashes
+
+    def save(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as fileobj:
+            fileobj.write(BLOOM_HEADER.pack(BLOOM_MAGIC, self.numHashes, self.numBits, self.count))
+            fileobj.write(self.bits)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as fileobj:
+            magic, num_hashes, num_bits, count = BLOOM_HEADER.unpack(fileobj.read(BLOOM_HEADER.size))
+            if magic != BLOOM_MAGIC:
+                raise ValueError("%s is not a saved Bloom filter" % path)
+            bloom = cls.__new__(cls)
+            bloom.numHashes, bloom.numBits, bloom.count = num_hashes, num_bits, count
+            bloom.bits = bytearray(fileobj.read())
+        if len(bloom.bits) != (num_bits + 7) // 8:
+            raise ValueError("%s is truncated" % path)
+        return bloom
+
+
+class DedupIndex(object):
+    '''
+    Remembers submitted URIs and the GIDs they were given.
+
+    Up to exact_limit URIs are kept in an exact URI -> GID map. Beyond that the
+    map is bounded (least recently used entries are dropped) and a Bloom filter
+    sized for capacity URIs answers for everything seen so far, so an old URI
+    is reported as a PROBABLE duplicate with no GID. Passing path persists the
+    Bloom filter there (see save) and enables it from the start.
+
+    Submitters racing on the same URI use claim: the first one gets NEW and
+    must then add (or abandon) the URIs, the others wait for it and get its GID.
+    '''
+
+    def __init__(self, exact_limit=DEFAULT_EXACT_LIMIT, capacity=DEFAULT_CAPACITY,
+                 error_rate=DEFAULT_ERROR_RATE, path=None):
+        self.exactLimit = exact_limit
+        self.capacity = capacity
+        self.errorRate = error_rate
+        self.path = path
+        self.exact = OrderedDict()
+        self.bloom = None
+        self.lookups = 0
+        self.exactHits = 0
+        self.probableHits = 0
+        self._lock = threading.Lock()
+        # Normalized URI -> threading.Event set once its claim is added or abandoned
+        self._claims = {}
+
+        if path is not None:
+            if os.path.exists(path):
+                self.bloom = BloomFilter.load(path)
+            else:
+                self.bloom = BloomFilter(capacity, error_rate)
+
+    def lookup(self, uris):
+        '''
+        Check whether any of uris was added before.
+
+        uris: list or string
+
+        return: tuple (state, gid), state is NEW, EXACT or PROBABLE; gid is only known for EXACT.
+        '''
+        keys = self._keys(uris)
+        with self._lock:
+            return self._lookup(keys)
+
+    def claim(self, uris):
+        '''
+        Check whether any of uris was added before and, if not, reserve them for the caller.
+
+        Unlike lookup followed by add, two threads claiming the same URI never both get NEW:
+        the later one waits until the first adds the URIs (and then gets EXACT with its GID)
+        or abandons them.
+
+        return: tuple (state, gid) as for lookup. On NEW the caller must call add or abandon.
+        '''
+        keys = self._keys(uris)
+        while True:
+            with self._lock:
+                pending = [self._claims[key] for key in keys if key in self._claims]
+                if not pending:
+                    state, gid = self._lookup(keys)
+                    if state == NEW:
+                        claimed = threading.Event()
+                        for key in keys:
+                            self._claims[key] = claimed
+                    return state, gid
+            for event in pending:
+                event.wait()
+
+    def abandon(self, uris):
+        '''
+        Give up a claim on uris without adding them, e.g. because submitting failed.
+        '''
+        with self._lock:
+            self._settle(self._keys(uris))
+
+    def _lookup(self, keys):
+        self.lookups += 1
+        for key in keys:
+            gid = self.exact.get(key)
+            if gid is not None:
+                self.exact.move_to_end(key)
+                self.exactHits += 1
+                return EXACT, gid
+        if self.bloom is not None:
+            for key in keys:
+                if key in self.bloom:
+                    self.probableHits += 1
+                    return PROBABLE, None
+        return NEW, None
+
+    def _settle(self, keys):
+        for key in keys:
+            event = self._claims.pop(key, None)
+            if event is not None:
+                event.set()
+
+    def add(self, uris, gid):
+        '''
+        Record that uris were submitted as download gid, settling a claim on them.
+        '''
+        keys = self._keys(uris)
+        with self._lock:
+            self._settle(keys)
+            for key in keys:
+                self.exact[key] = gid
+                self.exact.move_to_end(key)
+                if self.bloom is not None:
+                    self.bloom.add(key)
+            if len(self.exact) > self.exactLimit:
+                if self.bloom is None:
+                    logger.info("Dedup index exceeded %d URIs, switching to a Bloom filter", self.exactLimit)
+                    self.bloom = BloomFilter(self.capacity, self.errorRate)
+                    for key in self.exact:
+                        self.bloom.add(key)
+                while len(self.exact) > self.exactLimit:
+                    self.exact.popitem(last=False)
+
+    def discard(self, uris):
+        '''
+        Forget the exact mapping of uris, e.g. after their download was removed.
+        A Bloom filter cannot forget, so they may still be reported as PROBABLE.
+        '''
+        with self._lock:
+            for key in self._keys(uris):
+                self.exact.pop(key, None)
+
+    def falsePositiveRate(self):
+        '''
+        return: estimated probability that a new URI is reported as a PROBABLE duplicate.
+        '''
+        if self.bloom is None:
+            return 0.0
+        return self.bloom.falsePositiveRate()
+
+    def stats(self):
+        return {
+            'lookups': self.lookups,
+            'exactHits': self.exactHits,
+            'probableHits': self.probableHits,
+            'exactEntries': len(self.exact),
+            'bloomEntries': self.bloom.count if self.bloom is not None else 0,
+            'falsePositiveRate': self.falsePositiveRate(),
+        }
+
+    def save(self):
+        if self.path is None:
+            raise ValueError("DedupIndex was created without a path")
+        with self._lock:
+            self.bloom.save(self.path)
+
+    def _keys(self, uris):
+        if isinstance(uris, str):
+            uris = [uris]
+        return [normalizeUri(uri) for uri in uris]
@@ -0,0 +1,240 @@
+'''
+Compiler for aria2's --input-file syntax.
+
+Handing aria2c a pre-built input file at start-up is much faster than pushing
+each download over RPC. Every record is written as one line of TAB separated
+URIs followed by indented "name=value" option lines, and is given a
+deterministic GID so the client knows it before the daemon has even started.
+
+See https://aria2.github.io/manual/en/html/aria2c.html#input-file
+'''
+
+# -*- coding: utf-8 -*-
+
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+GID_LENGTH = 16
+
+# Options aria2 accepts per download in an input file (and via RPC).
+INPUT_FILE_OPTIONS = frozenset([
+    'all-proxy', 'all-proxy-passwd', 'all-proxy-user', 'allow-overwrite',
+    'allow-piece-length-change', 'always-resume', 'async-dns', 'auto-file-renaming',
+    'bt-enable-hook-after-hash-check', 'bt-enable-lpd', 'bt-exclude-tracker',
+    'bt-external-ip', 'bt-force-encryption', 'bt-hash-check-seed', 'bt-load-saved-metadata',
+    'bt-max-peers', 'bt-metadata-only', 'bt-min-crypto-level', 'bt-prioritize-piece',
+    'bt-remove-unselected-file', 'bt-request-peer-speed-limit', 'bt-require-crypto',
+    'bt-save-metadata', 'bt-seed-unverified', 'bt-stop-timeout', 'bt-tracker',
+    'bt-tracker-connect-timeout', 'bt-tracker-interval', 'bt-tracker-timeout',
+    'check-integrity', 'checksum', 'conditional-get', 'connect-timeout',
+    'content-disposition-default-utf8', 'continue', 'dir', 'dry-run',
+    'enable-http-keep-alive', 'enable-http-pipelining', 'enable-mmap', 'enable-peer-exchange',
+    'file-allocation', 'follow-metalink', 'follow-torrent', 'force-save', 'ftp-passwd',
+    'ftp-pasv', 'ftp-proxy', 'ftp-proxy-passwd', 'ftp-proxy-user', 'ftp-reuse-connection',
+    'ftp-type', 'ftp-user', 'gid', 'hash-check-only', 'header', 'http-accept-gzip',
+    'http-auth-challenge', 'http-no-cache', 'http-passwd', 'http-proxy', 'http-proxy-passwd',
+    'http-proxy-user', 'http-user', 'https-proxy', 'https-proxy-passwd', 'https-proxy-user',
+    'index-out', 'lowest-speed-limit', 'max-connection-per-server', 'max-download-limit',
+    'max-file-not-found', 'max-mmap-limit', 'max-resume-failure-tries', 'max-tries',
+    'max-upload-limit', 'metalink-base-uri', 'metalink-enable-unique-protocol',
+    'metalink-language', 'metalink-location', 'metalink-os', 'metalink-preferred-protocol',
+    'metalink-version', 'min-split-size', 'no-file-allocation-limit', 'no-netrc', 'no-proxy',
+    'out', 'parameterized-uri', 'pause', 'pause-metadata', 'piece-length', 'proxy-method',
+    'realtime-chunk-checksum', 'referer', 'remote-time', 'remove-control-file', 'retry-wait',
+    'reuse-uri', 'rpc-save-upload-metadata', 'seed-ratio', 'seed-time', 'select-file',
+    'split', 'ssh-host-key-md', 'stream-piece-selector', 'timeout', 'uri-selector',
+    'use-head', 'user-agent',
+])
+
+# Options that may be given several times, one line per value.
+MULTI_VALUE_OPTIONS = frozenset(['header', 'index-out'])
+
+
+def makeGid(uris, options=None, salt=''):
+    '''
+    Derive a deterministic aria2 GID from a download record.
+
+    uris: list, URIs of the download
+    options: dict, per-download options
+    salt: string, mixed into the hash so identical records can be told apart
+
+    return: 16 character hex string, never all zeros.
+    '''
+    digest = hashlib.sha1()
+    digest.update(salt.encode('utf-8'))
+    for uri in uris:
+        digest.update(b'\0' + uri.encode('utf-8'))
+    for name, value in sorted((options or {}).items()):
+        digest.update(('\1%s=%s' % (name, value)).encode('utf-8'))
+    gid = digest.hexdigest()[:GID_LENGTH]
+    if gid == '0' * GID_LENGTH:
+        gid = gid[:-1] + '1'
+    return gid
+
+
+def isValidGid(gid):
+    if len(gid) != GID_LENGTH or gid == '0' * GID_LENGTH:
+        return False
+    try:
+        int(gid, 16)
+    except ValueError:
+        return False
+    return True
+
+
+def fixRecord(record):
+    '''
+    Accept a plain URI string, a list of URIs or a (uris, options) pair.
+
+    return: tuple (uris, options)
+    '''
+    if isinstance(record, str):
+        return [record], {}
+    if len(record) == 2 and isinstance(record[1], dict):
+        uris, options = record
+        if isinstance(uris, str):
+            uris = [uris]
+        return list(uris), dict(options)
+    return list(record), {}
+
+
+def formatOptionValue(value):
+    if isinstance(value, bool):
+        return str(value).lower()
+    return str(value)
+
+
+def formatRecord(uris, options):
+    '''
+    Render one download in input file syntax.
+
+    uris: list, URIs of the download
+    options: dict, per-download options with either '-' or '_' separated names
+
+    return: string, ending with a newline.
+    '''
+    if not uris:
+        raise ValueError("A download needs at least one URI")
+    lines = []
+    for uri in uris:
+        if '\t' in uri or '\n' in uri:
+            raise ValueError("URI [%s] contains a TAB or newline" % uri)
+    lines.append('\t'.join(uris))
+    for name, value in options.items():
+        name = name.replace('_', '-')
+        if name not in INPUT_FILE_OPTIONS:
+            logger.warning("Option [%s] is not supported in input files", name)
+        values = value if name in MULTI_VALUE_OPTIONS and isinstance(value, (list, tuple)) else [value]
+        for single in values:
+            single = formatOptionValue(single)
+            if '\n' in single:
+                raise ValueError("Value of option [%s] contains a newline" % name)
+            lines.append(' %s=%s' % (name, single))
+    return '\n'.join(lines) + '\n'
+
+
+class InputFileCompiler(object):
+    '''
+    Streams download records into an aria2 input file.
+
+    Records are written as they are added, so arbitrarily large jobs never
+    have to be held in memory. GIDs are derived from the record contents
+    (see makeGid) unless the record carries its own "gid" option.
+    '''
+
+    def __init__(self, fileobj, salt=''):
+        '''
+        fileobj: file-like object opened for writing text
+        salt: string, mixed into generated GIDs
+        '''
+        self.fileobj = fileobj
+        self.salt = salt
+        self.count = 0
+        self._gids = set()
+
+    def add(self, uris, options=None):
+        '''
+        Append one download.
+
+        uris: list, URIs of the download (mirrors of the same file)
+        options: dict, per-download options
+
+        return: GID assigned to the download.
+        '''
+        options = dict(options or {})
+        gid = options.pop('gid', None)
+        if gid is None:
+            gid = makeGid(uris, options, self.salt)
+            # Identical records would collide, aria2 refuses duplicate GIDs.
+            attempt = 0
+            while gid in self._gids:
+                attempt += 1
+                gid = makeGid(uris, options, '%s#%d' % (self.salt, attempt))
+        elif not isValidGid(gid):
+            raise ValueError("GID [%s] is not a 16 character hex string" % gid)
+        elif gid in self._gids:
+            raise ValueError("GID [%s] is used more than once" % gid)
+
+        self._gids.add(gid)
+        options['gid'] = gid
+        self.fileobj.write(formatRecord(uris, options))
+        self.count += 1
+        return gid
+
+    def extend(self, records):
+        '''
+        Append every record of an iterable, see fixRecord for accepted shapes.
+
+        return: generator of assigned GIDs, in record order.
+        '''
+        for record in records:
+            uris, options = fixRecord(record)
+            yield self.add(uris, options)
+
+
+def compileInputFile(records, path, mode='w', salt=''):
+    '''
+    Write records into an aria2 input file.
+
+    records: iterable of URI strings, URI lists or (uris, options) pairs
+    path: string, input file path
+    mode: string, 'w' to replace the file or 'a' to append to it
+    salt: string, mixed into generated GIDs
+
+    return: list of GIDs in record order.
+    '''
+    with open(path, mode) as fileobj:
+        compiler = InputFileCompiler(fileobj, salt)
+        gids = list(compiler.extend(records))
+    logger.info("Compiled %d downloads into %s", len(gids), path)
+    return gids
+
+
+def parseInputFile(path):
+    '''
+    Read an aria2 input file, such as a saved session.
+
+    return: generator of (uris, options) pairs, option names as written in the file.
+    '''
+    uris, options = None, {}
+    with open(path) as fileobj:
+        for line in fileobj:
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+            if line[0] in ' \t':
+                if uris is None:
+                    raise ValueError("Option line [%s] before any URI in %s" % (line.strip(), path))
+                name, _, value = line.strip().partition('=')
+                if name in MULTI_VALUE_OPTIONS:
+                    options.setdefault(name, []).append(value)
+                else:
+                    options[name] = value
+                continue
+            if uris is not None:
+                yield uris, options
+            uris, options = line.split('\t'), {}
+    if uris is not None:
+        yield uris, options
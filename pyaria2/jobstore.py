@@ -0,0 +1,280 @@
+'''
+Local index of downloads by job, tag and owner.
+
+aria2 knows nothing about our job IDs, tags or owners, so finding "every
+download of job 123" means listing the whole queue. JobTracker wraps
+addUri/addTorrent/addMetalink of a client and records each GID with its
+labels, submission options and last known status in a JobStore (SQLite,
+indexed on every label), so group operations only touch the GIDs they need.
+
+Magnet links and URLs of .torrent or metalink files are only the first step
+of a download: once aria2 has the metadata it continues with new GIDs,
+listed in the followedBy of the first one. Status polling records those
+GIDs with the labels of the download that started them.
+'''
+
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from .periodic import PeriodicTask
+from .pyaria2 import effectiveStatus
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 10
+
+POLL_KEYS = ['gid', 'status', 'totalLength', 'completedLength', 'followedBy']
+
+# Status a download is in after a successful group operation
+TARGET_STATUSES = {
+    'pause': 'paused',
+    'forcePause': 'paused',
+    'unpause': 'waiting',
+    'remove': 'removed',
+    'forceRemove': 'removed',
+}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS downloads (
+    gid TEXT PRIMARY KEY,
+    job TEXT,
+    owner TEXT,
+    method TEXT,
+    options TEXT,
+    status TEXT,
+    submitted REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tags (
+    tag TEXT NOT NULL,
+    gid TEXT NOT NULL,
+    PRIMARY KEY (tag, gid)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS downloads_job ON downloads (job, status);
+CREATE INDEX IF NOT EXISTS downloads_owner ON downloads (owner, status);
+CREATE INDEX IF NOT EXISTS downloads_status ON downloads (status);
+CREATE INDEX IF NOT EXISTS tags_gid ON tags (gid);
+'''
+
+COLUMNS = ('gid', 'job', 'owner', 'method', 'options', 'status', 'submitted', 'updated')
+
+
+class JobStore(object):
+    '''
+    SQLite store of GIDs and their labels.
+    '''
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def record(self, gids, job=None, tags=(), owner=None, method=None, options=None, status='waiting',
+               replace=True):
+        '''
+        Add submitted downloads.
+
+        gids: list, GIDs of the downloads
+        tags: list of strings
+        method: string, RPC method the downloads were added with
+        options: dict, submission options
+        replace: bool, replace earlier records of the same GIDs, otherwise they are left alone
+
+        return: number of downloads recorded.
+        '''
+        now = time.time()
+        packed = json.dumps(options or {}, separators=(',', ':'), sort_keys=True)
+        with self._lock:
+            with self._db:
+                if replace:
+                    self._db.executemany('DELETE FROM tags WHERE gid = ?', [(gid,) for gid in gids])
+                else:
+                    gids = [gid for gid in gids
+                            if self._db.execute('SELECT 1 FROM downloads WHERE gid = ?', (gid,)).fetchone() is None]
+                self._db.executemany('INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                     [(gid, job, owner, method, packed, status, now, now) for gid in gids])
+                self._db.executemany('INSERT OR IGNORE INTO tags VALUES (?, ?)',
+                                     [(tag, gid) for gid in gids for tag in tags])
+        return len(gids)
+
+    def get(self, gid):
+        '''
+        return: dict with the download's labels, options and last known status, or None.
+        '''
+        with self._lock:
+            row = self._db.execute('SELECT %s FROM downloads WHERE gid = ?' % ', '.join(COLUMNS), (gid,)).fetchone()
+            if row is None:
+                return None
+            tags = [tag for tag, in self._db.execute('SELECT tag FROM tags WHERE gid = ? ORDER BY tag', (gid,))]
+        download = dict(zip(COLUMNS, row))
+        download['options'] = json.loads(download['options'])
+        download['tags'] = tags
+        return download
+
+    def gids(self, job=None, tag=None, owner=None, statuses=None):
+        '''
+        GIDs matching every given criterion, answered from the indexes.
+
+        statuses: list, last known statuses to match
+
+        return: list of GIDs in submission order.
+        '''
+        query = 'SELECT downloads.gid FROM downloads'
+        conditions, params = [], []
+        if tag is not None:
+            query += ' JOIN tags ON tags.gid = downloads.gid'
+            conditions.append('tags.tag = ?')
+            params.append(tag)
+        if job is not None:
+            conditions.append('downloads.job = ?')
+            params.append(job)
+        if owner is not None:
+            conditions.append('downloads.owner = ?')
+            params.append(owner)
+        if statuses is not None:
+            conditions.append('downloads.status IN (%s)' % ', '.join('?' * len(statuses)))
+            params.extend(statuses)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY downloads.submitted, downloads.rowid'
+        with self._lock:
+            return [gid for gid, in self._db.execute(query, params)]
+
+    def follow(self, followers):
+        '''
+        Record downloads started by recorded ones, with the same labels and options.
+
+        followers: iterable of (GID, GID of the download it follows) pairs
+
+        return: number of downloads recorded, GIDs already in the store are left alone.
+        '''
+        now = time.time()
+        followers = list(followers)
+        with self._lock:
+            with self._db:
+                before = self._db.total_changes
+                self._db.executemany('INSERT OR IGNORE INTO downloads SELECT ?, job, owner, method, options, '
+                                     '\'waiting\', submitted, ? FROM downloads WHERE gid = ?',
+                                     [(gid, now, parent) for gid, parent in followers])
+                added = self._db.total_changes - before
+                self._db.executemany('INSERT OR IGNORE INTO tags SELECT tag, ? FROM tags WHERE gid = ?', followers)
+        return added
+
+    def updateStatuses(self, statuses):
+        '''
+        Store the latest statuses in one transaction, GIDs not in the store are ignored.
+
+        statuses: iterable of dict with gid and status keys, e.g. from tellActive
+
+        return: number of statuses given.
+        '''
+        now = time.time()
+        rows = [(status['status'], now, status['gid']) for status in statuses]
+        with self._lock:
+            with self._db:
+                self._db.executemany('UPDATE downloads SET status = ?, updated = ? WHERE gid = ?', rows)
+        return len(rows)
+
+    def forget(self, gids):
+        with self._lock:
+            with self._db:
+                self._db.executemany('DELETE FROM downloads WHERE gid = ?', [(gid,) for gid in gids])
+                self._db.executemany('DELETE FROM tags WHERE gid = ?', [(gid,) for gid in gids])
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM downloads').fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+
+class JobTracker(PeriodicTask):
+    '''
+    Wraps addUri/addTorrent/addMetalink of a PyAria2 client, recording
+    every new GID in a JobStore together with its job, tags and owner.
+
+    Each run (see PeriodicTask) refreshes the stored statuses with
+    tellAll and records the GIDs aria2 continued tracked downloads with. Group
+    operations select their GIDs from the store and send one multicall.
+    '''
+
+    def __init__(self, client, store=None, interval=DEFAULT_INTERVAL):
+        '''
+        :type client: PyAria2
+        :type store: JobStore
+        '''
+        super(JobTracker, self).__init__(interval)
+        self.client = client
+        self.store = store if store is not None else JobStore()
+
+    def addUri(self, uris, options=None, position=None, job=None, tags=(), owner=None):
+        gid = self.client.addUri(uris, options, position)
+        # None is a probable duplicate the client's dedup index skipped, an exact one
+        # returns the GID of the earlier download, which keeps the labels it was added with
+        if gid is not None:
+            self.store.record([gid], job, tags, owner, 'addUri', options, replace=False)
+        return gid
+
+    def addTorrent(self, torrent, uris=None, options=None, position=None, job=None, tags=(), owner=None):
+        gid = self.client.addTorrent(torrent, uris, options, position)
+        self.store.record([gid], job, tags, owner, 'addTorrent', options, replace=False)
+        return gid
+
+    def addMetalink(self, metalink, options=None, position=None, job=None, tags=(), owner=None):
+        gids = self.client.addMetalink(metalink, options, position)
+        self.store.record(gids, job, tags, owner, 'addMetalink', options, replace=False)
+        return gids
+
+    def runOnce(self):
+        self.refresh()
+
+    def refresh(self):
+        '''
+        Poll every download's status and store it, recording the downloads that follow tracked ones.
+
+        return: number of downloads polled.
+        '''
+        statuses = self.client.tellAll(POLL_KEYS)
+        followers = [(gid, status['gid']) for status in statuses for gid in status.get('followedBy', [])]
+        if followers:
+            added = self.store.follow(followers)
+            if added:
+                logger.debug("Recorded %d downloads following tracked ones", added)
+        return self.store.updateStatuses([{'gid': status['gid'], 'status': effectiveStatus(status)}
+                                          for status in statuses])
+
+    def pauseJob(self, job=None, tag=None, owner=None, force=False):
+        '''
+        Pause the active and waiting downloads matching job, tag and owner in one multicall.
+
+        return: dict, GID -> result of pause (or an xmlrpc Fault).
+        '''
+        return self._apply('forcePause' if force else 'pause', ('active', 'waiting'), job, tag, owner)
+
+    def unpauseJob(self, job=None, tag=None, owner=None):
+        return self._apply('unpause', ('paused',), job, tag, owner)
+
+    def removeJob(self, job=None, tag=None, owner=None, force=False):
+        return self._apply('forceRemove' if force else 'remove', ('active', 'waiting', 'paused'), job, tag, owner)
+
+    def _apply(self, method, statuses, job, tag, owner):
+        if job is None and tag is None and owner is None:
+            raise ValueError("Give a job, tag or owner to %s" % method)
+        gids = self.store.gids(job, tag, owner, statuses)
+        if not gids:
+            return {}
+        logger.info("Sending %s for %d downloads (job %s, tag %s, owner %s)", method, len(gids), job, tag, owner)
+        batch = self.client.batch()
+        for gid in gids:
+            getattr(batch, method)(gid)
+        results = dict(zip(gids, batch.execute()))
+        self.store.updateStatuses([{'gid': gid, 'status': TARGET_STATUSES[method]}
+                                   for gid, result in results.items() if not isinstance(result, Exception)])
+        return results
@@ -0,0 +1,161 @@
+'''
+Adaptive mirror selection for multi-source downloads.
+
+aria2's --uri-selector is fixed for the whole daemon. MirrorOptimizer samples
+the speed of every connected server through getServers, keeps a score per
+host across all active downloads, and uses changeUri to drop mirrors that are
+persistently slow and to move the fastest known ones to the front of each
+file's waiting URIs.
+'''
+
+# -*- coding: utf-8 -*-
+
+import logging
+
+from urllib.parse import urlsplit
+
+from .periodic import PeriodicTask
+from .ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 10
+DEFAULT_RPC_RATE = 5
+DEFAULT_SMOOTHING = 0.3
+DEFAULT_MIN_SAMPLES = 3
+DEFAULT_SLOW_RATIO = 0.25
+
+
+def uriHost(uri):
+    return (urlsplit(uri).hostname or '').lower()
+
+
+class HostScore(object):
+    '''
+    Exponentially weighted moving average of per-connection download speed.
+    '''
+
+    def __init__(self):
+        self.speed = 0.0
+        self.samples = 0
+
+    def update(self, speed, smoothing):
+        if self.samples == 0:
+            self.speed = float(speed)
+        else:
+            self.speed += smoothing * (speed - self.speed)
+        self.samples += 1
+
+    def __repr__(self):
+        return '<HostScore %.0f B/s over %d samples>' % (self.speed, self.samples)
+
+
+class MirrorOptimizer(PeriodicTask):
+    '''
+    Periodically scores mirror hosts and rewrites URI lists with changeUri.
+
+    A host is persistently slow once it has min_samples samples and its score
+    is below slow_ratio times the median score of all known hosts. Its URIs
+    are removed unless they are the only ones left for a file. The remaining
+    waiting URIs are reordered fastest first, unknown hosts counting as
+    median. All RPC calls, reads included, go through a token bucket of
+    rpc_rate calls per second so the optimizer never loads the daemon.
+    '''
+
+    def __init__(self, client, interval=DEFAULT_INTERVAL, rpc_rate=DEFAULT_RPC_RATE,
+                 smoothing=DEFAULT_SMOOTHING, min_samples=DEFAULT_MIN_SAMPLES,
+                 slow_ratio=DEFAULT_SLOW_RATIO, reorder=True):
+        '''
+        :type client: PyAria2
+        '''
+        super(MirrorOptimizer, self).__init__(interval)
+        self.client = client
+        self.limiter = TokenBucket(rpc_rate)
+        self.smoothing = smoothing
+        self.minSamples = min_samples
+        self.slowRatio = slow_ratio
+        self.reorder = reorder
+        self.scores = {}
+
+    def runOnce(self):
+        downloads = self._rpc('tellActive', ['gid', 'files'])
+        for download in downloads:
+            self.sample(download['gid'])
+        for download in downloads:
+            self.optimize(download['gid'], download.get('files', []))
+
+    def sample(self, gid):
+        '''
+        Feed the current speed of every server of download gid into its host score.
+        '''
+        try:
+            files = self._rpc('getServers', gid)
+        except Exception as e:
+            # BitTorrent downloads have no servers, finished ones are gone
+            logger.debug("getServers(%s) failed: %s", gid, e)
+            return
+        for entry in files:
+            for server in entry.get('servers', []):
+                # By the URI plan and changeUri work on, not the one it redirected to
+                host = uriHost(server['uri'])
+                self.scores.setdefault(host, HostScore()).update(int(server['downloadSpeed']), self.smoothing)
+
+    def medianScore(self):
+        speeds = sorted(score.speed for score in self.scores.values() if score.samples >= self.minSamples)
+        if not speeds:
+            return None
+        return speeds[len(speeds) // 2]
+
+    def isSlow(self, host, median):
+        score = self.scores.get(host)
+        return (median is not None and score is not None and score.samples >= self.minSamples
+                and score.speed < self.slowRatio * median)
+
+    def plan(self, uris):
+        '''
+        Decide the changes for one file.
+
+        uris: list of dict, the "uris" of a file as returned by aria2 (uri and status keys)
+
+        return: tuple (URIs to delete, URIs to add at the front), both empty if nothing changes.
+        '''
+        median = self.medianScore()
+        if median is None:
+            return [], []
+
+        slow = [entry['uri'] for entry in uris if self.isSlow(uriHost(entry['uri']), median)]
+        if len(set(slow)) == len(set(entry['uri'] for entry in uris)):
+            # Never leave a file without sources
+            slow = []
+
+        waiting = []
+        for entry in uris:
+            if entry['status'] == 'waiting' and entry['uri'] not in slow and entry['uri'] not in waiting:
+                waiting.append(entry['uri'])
+
+        def speed(uri):
+            score = self.scores.get(uriHost(uri))
+            if score is None or score.samples < self.minSamples:
+                return median
+            return score.speed
+
+        ordered = sorted(waiting, key=speed, reverse=True) if self.reorder else waiting
+        if ordered == waiting:
+            return slow, []
+        moved = [entry['uri'] for entry in uris if entry['status'] == 'waiting' and entry['uri'] in waiting]
+        return slow + moved, ordered
+
+    def optimize(self, gid, files):
+        for entry in files:
+            delete, add = self.plan(entry.get('uris', []))
+            if not delete and not add:
+                continue
+            logger.info("Mirrors of %s file %s: dropping %s, preferring %s", gid, entry['index'], delete, add)
+            try:
+                self._rpc('changeUri', gid, int(entry['index']), delete, add, 0)
+            except Exception as e:
+                logger.debug("changeUri(%s) failed: %s", gid, e)
+
+    def _rpc(self, method, *args):
+        self.limiter.acquire()
+        return getattr(self.client, method)(*args)
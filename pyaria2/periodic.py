@@ -0,0 +1,55 @@
+'''
+Base class for components that poll the aria2 daemon in the background.
+'''
+
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask(object):
+    '''
+    Calls runOnce every interval seconds from a daemon thread.
+
+    runOnce can also be called directly, e.g. from an existing event loop,
+    without ever starting the thread.
+    '''
+
+    def __init__(self, interval):
+        '''
+        interval: float, seconds between two runs
+        '''
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def runOnce(self):
+        raise NotImplementedError
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name=type(self).__name__)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+
+    def isRunning(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.runOnce()
+            except Exception:
+                logger.exception("%s failed", type(self).__name__)
+            self._stopped.wait(self.interval)
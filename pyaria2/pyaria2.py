@@ -28,16 +28,24 @@ Email: killua_hzl@163.com
 # !/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import inspect
 import logging
 import subprocess
+import threading
 
 import xmlrpc.client as xmlrpclib
 import os
+import re
 import time
 
 from string import ascii_letters
 from random import choice
 
+from .dedup import NEW as DEDUP_NEW
+from .inputfile import INPUT_FILE_OPTIONS, compileInputFile
+from .ratelimit import PRIORITY_CONTROL, PRIORITY_READ, PRIORITY_SUBMIT, PriorityTokenBucket
+from .singleflight import SingleFlight
+
 logger = logging.getLogger(__name__)
 
 DEFAULT_HOST = 'localhost'
@@ -89,6 +97,57 @@ SETTING_IGNORE_FIELDS = [
     "host",
 ]
 
+# Global options changeGlobalOption accepts, everything else needs a restart
+RUNTIME_GLOBAL_OPTIONS = (INPUT_FILE_OPTIONS - frozenset([
+    'checksum', 'index-out', 'out', 'pause', 'select-file',
+])) | frozenset([
+    'bt-max-open-files', 'download-result', 'keep-unfinished-download-result', 'log', 'log-level',
+    'max-concurrent-downloads', 'max-download-result', 'max-overall-download-limit',
+    'max-overall-upload-limit', 'optimize-concurrent-downloads', 'save-cookies', 'save-session',
+    'server-stat-of',
+])
+
+# Options getGlobalOption never reports, they can not be compared
+HIDDEN_OPTIONS = frozenset([
+    'rpc-secret',
+])
+
+SIZE_UNITS = {'K': 1024, 'M': 1024 * 1024}
+SIZE_RE = re.compile(r'^(\d+(?:\.\d+)?)([KkMm])$')
+
+
+def normalize_option_value(value):
+    '''
+    Spell an option value the way getGlobalOption reports it: booleans in
+    lower case, sizes like "1M" in bytes, numbers without trailing zeros.
+    '''
+    if isinstance(value, bool):
+        return str(value).lower()
+    value = str(value).strip()
+    match = SIZE_RE.match(value)
+    if match:
+        return str(int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()]))
+    try:
+        number = float(value)
+    except ValueError:
+        return value
+    if number.is_integer() and value.lstrip('-').replace('.', '', 1).isdigit():
+        return str(int(number))
+    return value
+
+
+def effectiveStatus(status):
+    '''
+    Status of a tellStatus result, "complete" also for a download removed once all of
+    its data was in (e.g. a torrent whose seeding SwarmTuner stopped).
+
+    status: dict with at least status, and totalLength and completedLength to detect such removals
+    '''
+    if status['status'] == 'removed' and int(status.get('totalLength', 0)) > 0 and \
+            status.get('completedLength') == status.get('totalLength'):
+        return 'complete'
+    return status['status']
+
 
 class AriaServerSettings(object):
     def __init__(self, **kwargs):
@@ -239,7 +298,10 @@ class AriaServerSettings(object):
     def check_parameters(self):
         pass
 
-    def construct_as_command_line(self):
+    def construct_as_options(self):
+        '''
+        return: dict, aria2 option name -> value of every field that is set.
+        '''
         to_set = {}
         for name, value in self.__dict__.items():
             if value is None:
@@ -259,18 +321,108 @@ class AriaServerSettings(object):
                 value = str(value).lower()
             name = name.replace('_', '-')
             to_set[name] = value
-        command = ' '.join(['--%s=%s' % (param, value) for param, value in to_set.items()])
+        return to_set
+
+    def construct_as_argv(self):
+        '''
+        return: list of aria2c arguments, to be passed without a shell.
+        '''
+        return ['--%s=%s' % (param, value) for param, value in self.construct_as_options().items()]
+
+    def construct_as_command_line(self):
+        command = ' '.join(self.construct_as_argv())
         return command
 
+    def diff_against(self, live_options):
+        '''
+        Compare these settings with the options of a running daemon.
+
+        live_options: dict, as returned by getGlobalOption
+
+        return: dict, option name -> (wanted value, live value or None), for options that differ.
+        '''
+        diff = {}
+        for name, value in self.construct_as_options().items():
+            if name in HIDDEN_OPTIONS:
+                continue
+            wanted = normalize_option_value(value)
+            live = live_options.get(name)
+            if live is None or normalize_option_value(live) != wanted:
+                diff[name] = (wanted, live)
+        return diff
+
+    def apply_to(self, client):
+        '''
+        Bring a running daemon in line with these settings without restarting it.
+
+        Every differing option aria2 accepts at runtime is sent in a single
+        changeGlobalOption call.
+
+        :type client: PyAria2
+        return: tuple (dict of applied options, dict of options that differ but need a restart),
+                both mapping option name -> (wanted value, live value or None).
+        '''
+        diff = self.diff_against(client.getGlobalOption())
+        applied = dict((name, values) for name, values in diff.items() if name in RUNTIME_GLOBAL_OPTIONS)
+        restart = dict((name, values) for name, values in diff.items() if name not in RUNTIME_GLOBAL_OPTIONS)
+        if applied:
+            client.changeGlobalOption(dict((name, wanted) for name, (wanted, live) in applied.items()))
+            logger.info('Changed global options %s', ', '.join(sorted(applied)))
+        if restart:
+            logger.warning('Options %s only take effect after a restart', ', '.join(sorted(restart)))
+        return applied, restart
+
+
+class RPCConnection(object):
+    '''
+    Server proxies with their caches of method proxies, one per thread: an
+    xmlrpc ServerProxy keeps a single HTTP connection, which concurrent calls
+    would interleave on. setServer replaces the whole connection at once, so
+    a call never caches a proxy of the old server in the cache of the new one.
+    '''
+
+    def __init__(self, factory):
+        '''
+        factory: function returning a new server proxy, called once in each thread
+        '''
+        self.factory = factory
+        self._local = threading.local()
+
+    @property
+    def server(self):
+        try:
+            return self._local.server
+        except AttributeError:
+            self._local.server, self._local.proxies = self.factory(), {}
+            return self._local.server
+
+    def proxy(self, method):
+        try:
+            return self._local.proxies[method]
+        except AttributeError:
+            server = self.server
+        except KeyError:
+            server = self._local.server
+        proxy = self._local.proxies[method] = getattr(server, method)
+        return proxy
+
 
 class PyAria2(object):
-    def __init__(self, server_settings=None):
+    def __init__(self, server_settings=None, input_records=None, coalesce=False, rate_limit=None,
+                 rate_burst=None, start_server=True):
         '''
         PyAria2 constructor.
 
         host: string, aria2 rpc host, default is 'localhost'
         port: integer, aria2 rpc port, default is 6800
         session: string, aria2 rpc session saving.
+        input_records: iterable, downloads to preload if a new server is started, see start_aria_server
+        coalesce: bool, identical read calls made concurrently from several threads share one RPC
+        rate_limit: float, maximum RPC calls per second, control calls (pause, remove...) are served
+                    before submissions and status reads when calls queue up
+        rate_burst: float, calls allowed at once above rate_limit, defaults to rate_limit
+        start_server: bool, check that aria2 is installed and start it if no RPC server runs,
+                      False to only connect, e.g. to a remote or supervised daemon
         :type server_settings: AriaServerSettings
         '''
         if server_settings is None:
@@ -285,32 +437,60 @@ class PyAria2(object):
             )
 
         self.useSecret = False
+        self._token = ()
         if server_settings.rpc_secret is not None:
             self.useSecret = True
             self.rpcSecret = server_settings.rpc_secret
+            self._token = ("token:" + self.rpcSecret,)
 
-        if not isAria2Installed():
+        if start_server and not isAria2Installed():
             raise Exception('aria2 is not installed, please install it before.')
 
-        server_uri = SERVER_URI_FORMAT.format(server_settings.host, server_settings.rpc_listen_port)
-        self.server = xmlrpclib.ServerProxy(server_uri, allow_none=True)
-
-        if not isAria2rpcRunning():
-            self.start_aria_server(server_settings)
+        self.serverUri = SERVER_URI_FORMAT.format(server_settings.host, server_settings.rpc_listen_port)
+        serverUri = self.serverUri
+        self._connection = RPCConnection(lambda: xmlrpclib.ServerProxy(serverUri, allow_none=True))
+        self._singleFlight = SingleFlight() if coalesce else None
+        self._limiter = PriorityTokenBucket(rate_limit, rate_burst) if rate_limit else None
+
+        self.preloadedGids = []
+        # Optional dedup.DedupIndex consulted by addUri
+        self.dedupIndex = None
+        # Optional traffic.RPCRecorder logging every call sent, see RPCRecorder.attach
+        self.recorder = None
+        if not start_server:
+            if input_records is not None:
+                logger.warning('aria2 RPC server not started, input_records were not loaded')
+        elif not isAria2rpcRunning():
+            self.start_aria_server(server_settings, input_records)
         else:
             logger.info('aria2 RPC server instance detected')
+            if input_records is not None:
+                logger.warning('aria2 RPC server already running, input_records were not loaded')
 
-    def start_aria_server(self, server_settings):
+    def start_aria_server(self, server_settings, input_records=None):
         '''
+        Start aria2c, optionally pre-loaded with a batch of downloads.
+
+        input_records: iterable of URI strings, URI lists or (uris, options) pairs.
+            They are compiled into server_settings.input_file, which aria2c reads at
+            start-up - much faster than one addUri call per download. When input_file
+            is also the save_session file the records are appended, keeping the session.
+
+        return: list of GIDs assigned to input_records, also kept in self.preloadedGids.
         :type server_settings: AriaServerSettings
         '''
-        command_line_params = server_settings.construct_as_command_line()
-        cmd = 'aria2c --enable-rpc {}'.format(command_line_params)
+        if input_records is not None:
+            if server_settings.input_file is None:
+                raise ValueError("input_file must be set to preload input_records")
+            mode = 'a' if server_settings.input_file == server_settings.save_session else 'w'
+            self.preloadedGids = compileInputFile(input_records, server_settings.input_file, mode)
+
+        cmd = ['aria2c', '--enable-rpc'] + server_settings.construct_as_argv()
 
         if server_settings.save_session is not None:
             self.check_create_file(server_settings.input_file)
 
-        aria_process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        aria_process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
         count = 0
 
@@ -331,6 +511,29 @@ class PyAria2(object):
                 raise Exception('aria2 RPC server started failure.')
 
         logger.info('aria2 RPC server is started.')
+        return self.preloadedGids
+
+    def setServer(self, server_uri):
+        '''
+        Point this client at another aria2 RPC server, e.g. after a failover.
+
+        server_uri: string, e.g. SERVER_URI_FORMAT.format(host, port)
+        '''
+        recorder = self.recorder
+        self.serverUri = server_uri
+        # Each thread gets its own proxy and transport, see RPCConnection
+        self._connection = RPCConnection(lambda: xmlrpclib.ServerProxy(
+            server_uri, transport=recorder.transportFor(server_uri) if recorder is not None else None,
+            allow_none=True))
+
+    @property
+    def server(self):
+        return self._connection.server
+
+    @server.setter
+    def server(self, server):
+        # Shared by every thread, e.g. a stand-in allowing concurrent calls
+        self._connection = RPCConnection(lambda: server)
 
     def check_create_file(self, input_file_path):
         if os.path.exists(input_file_path):
@@ -359,16 +562,241 @@ class PyAria2(object):
         options: dict, additional options
         position: integer, position in download queue
 
-        return: This method returns GID of registered download.
+        If self.dedupIndex is set, URIs that were added before are not submitted again.
+
+        return: This method returns GID of registered download. For a duplicate it is the
+                GID of the earlier download, or None if the index only knows it probably was added.
         '''
         uris, options = self.fixUris(uris), self.fixOptions(options)
-        if self.useSecret:
-            return self.server.aria2.addUri("token:" + self.rpcSecret, uris, options, position)
-        else:
-            return self.server.aria2.addUri(uris, options, position)
+        if self.dedupIndex is None:
+            return self._call('aria2.addUri', (uris, options, position))
+
+        # Claimed, not just looked up, so concurrent adds of the same URI submit it once
+        state, gid = self.dedupIndex.claim(uris)
+        if state != DEDUP_NEW:
+            logger.debug('Skipping %s duplicate %s (GID %s)', state, uris, gid)
+            return gid
+        try:
+            gid = self._call('aria2.addUri', (uris, options, position))
+        except Exception:
+            self.dedupIndex.abandon(uris)
+            raise
+        self.dedupIndex.add(uris, gid)
+        return gid
+
+    def shutdown(self):
+        '''
+        This method shutdowns aria2.
+
+        return: This method returns OK for success.
+        '''
+        logger.info("Calling shutdown of aria2 server.")
+        return self._call('aria2.shutdown', ())
+
+    def forceShutdown(self):
+        '''
+        This method shutdowns aria2.
+
+        return: This method returns OK for success.
+        '''
+        logger.info("Forcing shutdown of aria2 server.")
+        return self._call('aria2.forceShutdown', ())
+
+    def getOptions(self, gids):
+        '''
+        This method returns options of every download in gids, using a single system.multicall.
+
+        gids: list, GIDs.
+
+        return: list of dict, in gids order. A failed lookup is returned as an xmlrpc Fault instead of raised.
+        '''
+        batch = self.batch()
+        for gid in gids:
+            batch.getOption(gid)
+        return batch.execute()
+
+    def tellAll(self, keys=None):
+        '''
+        This method returns the status of every active, waiting and stopped download,
+        using getGlobalStat and a single system.multicall.
+
+        keys: list, keys to return, as for tellStatus.
+
+        return: list of dict, active downloads first, then waiting and stopped ones.
+        '''
+        stat = self.getGlobalStat()
+        batch = self.batch()
+        batch.tellActive(keys)
+        batch.tellWaiting(0, int(stat['numWaiting']), keys)
+        batch.tellStopped(0, int(stat['numStopped']), keys)
+        statuses = []
+        for result in batch.execute():
+            if isinstance(result, Exception):
+                raise result
+            statuses.extend(result)
+        return statuses
+
+    def batch(self):
+        '''
+        Start collecting RPC calls to be sent in one system.multicall.
+
+        return: RPCBatch, offering the same RPC methods as PyAria2.
+        '''
+        return RPCBatch(self)
+
+    def _call(self, method, params):
+        if self._singleFlight is not None and method in READ_METHODS:
+            return self._singleFlight.do((method, repr(params)), self._send, method, params)
+        return self._send(method, params)
+
+    def _send(self, method, params):
+        if self._limiter is not None:
+            if method == 'system.multicall':
+                priority = min([rpcPriority(call['methodName']) for call in params[0]] or [PRIORITY_READ])
+            else:
+                priority = rpcPriority(method)
+            self._limiter.acquire(priority=priority)
+        proxy = self._connection.proxy(method)
+        args = params if method in TOKENLESS_METHODS else self._token + tuple(params)
+        if self.recorder is None:
+            return proxy(*args)
+
+        start = time.time()
+        try:
+            result = proxy(*args)
+        except Exception as e:
+            self.recorder.record(method, params, start, time.time() - start, error=e)
+            raise
+        self.recorder.record(method, params, start, time.time() - start)
+        return result
+
+
+class RPCBatch(object):
+    '''
+    Collects RPC calls and sends them in one system.multicall.
+
+    Every method of the RPC table is available and returns the index of its
+    result. Can be used as a context manager, executing on exit.
+    '''
+
+    def __init__(self, client):
+        '''
+        :type client: PyAria2
+        '''
+        self.client = client
+        self.calls = []
+        self.results = None
 
-    def addTorrent(self, torrent, uris=None, options=None, position=None):
+    def __len__(self):
+        return len(self.calls)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None and self.calls:
+            self.execute()
+
+    def fixOptions(self, options):
+        return self.client.fixOptions(options)
+
+    def fixUris(self, uris):
+        return self.client.fixUris(uris)
+
+    def execute(self):
         '''
+        Send the collected calls.
+
+        return: list of results in call order; a failed call's result is an xmlrpc Fault instead of being raised.
+        '''
+        calls, self.calls = self.calls, []
+        results = []
+        for response in self.client._call('system.multicall', (calls,)):
+            if isinstance(response, dict):
+                results.append(xmlrpclib.Fault(response.get('faultCode'), response.get('faultString')))
+            else:
+                results.append(response[0])
+        self.results = results
+        return results
+
+    def _call(self, method, params):
+        if method in TOKENLESS_METHODS:
+            raise ValueError("%s can not be part of a multicall" % method)
+        self.calls.append({'methodName': method, 'params': list(self.client._token + tuple(params))})
+        return len(self.calls) - 1
+
+
+def _prepareTorrent(self, torrent, uris=None, options=None, position=None):
+    with open(torrent, "rb") as torrentfile:
+        content = torrentfile.read()
+    return xmlrpclib.Binary(content), self.fixUris(uris), self.fixOptions(options), position
+
+
+def _prepareMetalink(self, metalink, options=None, position=None):
+    with open(metalink, "rb") as metalinkfile:
+        content = metalinkfile.read()
+    return xmlrpclib.Binary(content), self.fixOptions(options), position
+
+
+def _prepareUri(self, uris, options=None, position=None):
+    return self.fixUris(uris), self.fixOptions(options), position
+
+
+# Methods which take no secret token
+TOKENLESS_METHODS = frozenset([
+    'system.multicall',
+    'system.listMethods',
+    'system.listNotifications',
+])
+
+# Methods without side effects, safe to coalesce
+READ_METHODS = frozenset([
+    'aria2.tellStatus',
+    'aria2.getUris',
+    'aria2.getFiles',
+    'aria2.getPeers',
+    'aria2.getServers',
+    'aria2.tellActive',
+    'aria2.tellWaiting',
+    'aria2.tellStopped',
+    'aria2.getOption',
+    'aria2.getGlobalOption',
+    'aria2.getGlobalStat',
+    'aria2.getVersion',
+    'aria2.getSessionInfo',
+    'system.listMethods',
+    'system.listNotifications',
+])
+
+SUBMIT_METHODS = frozenset([
+    'aria2.addUri',
+    'aria2.addTorrent',
+    'aria2.addMetalink',
+])
+
+
+def rpcPriority(method):
+    if method in READ_METHODS:
+        return PRIORITY_READ
+    if method in SUBMIT_METHODS:
+        return PRIORITY_SUBMIT
+    return PRIORITY_CONTROL
+
+
+# The aria2 RPC interface: python name, RPC method, parameters, optional parameters (default None),
+# a function turning the python arguments into RPC params (or None to pass them as they are) and docstring.
+# Methods already defined on a class are kept, the others are generated by installRPCMethods.
+RPC_METHODS = (
+    ('addUri', 'aria2.addUri', ('uris',), ('options', 'position'), _prepareUri, '''
+        This method adds new HTTP(S)/FTP/BitTorrent Magnet URI.
+
+        uris: list, list of URIs
+        options: dict, additional options
+        position: integer, position in download queue
+
+        return: This method returns GID of registered download.
+        '''),
+    ('addTorrent', 'aria2.addTorrent', ('torrent',), ('uris', 'options', 'position'), _prepareTorrent, '''
         This method adds BitTorrent download by uploading ".torrent" file.
 
         torrent: string, torrent file path
@@ -377,19 +805,8 @@ class PyAria2(object):
         position: integer, position in download queue
 
         return: This method returns GID of registered download.
-        '''
-        uris, options = self.fixUris(uris), self.fixOptions(options)
-        with open(torrent, "rb") as torrentfile:
-            content = torrentfile.read()
-            binary_content = xmlrpclib.Binary(content)
-            if self.useSecret:
-                fixedsecretphrase = "token:{}".format(self.rpcSecret)
-                return self.server.aria2.addTorrent(fixedsecretphrase, binary_content, uris, options, position)
-            else:
-                return self.server.aria2.addTorrent(binary_content, uris, options, position)
-
-    def addMetalink(self, metalink, options=None, position=None):
-        '''
+        '''),
+    ('addMetalink', 'aria2.addMetalink', ('metalink',), ('options', 'position'), _prepareMetalink, '''
         This method adds Metalink download by uploading ".metalink" file.
 
         metalink: string, metalink file path
@@ -397,207 +814,101 @@ class PyAria2(object):
         position: integer, position in download queue
 
         return: This method returns list of GID of registered download.
-        '''
-        options = self.fixOptions(options)
-        if self.useSecret:
-            return self.server.aria2.addMetalink("token:" + self.rpcSecret,
-                                                 xmlrpclib.Binary(open(metalink, 'rb').read()), options, position)
-        else:
-            return self.server.aria2.addMetalink(xmlrpclib.Binary(open(metalink, 'rb').read()), options, position)
-
-    def remove(self, gid):
-        '''
+        '''),
+    ('remove', 'aria2.remove', ('gid',), (), None, '''
         This method removes the download denoted by gid.
 
         gid: string, GID.
 
         return: This method returns GID of removed download.
-        '''
-
-        if self.useSecret:
-            return self.server.aria2.remove("token:" + self.rpcSecret, gid)
-        else:
-            return self.server.aria2.remove(gid)
-
-    def forceRemove(self, gid):
-        '''
+        '''),
+    ('forceRemove', 'aria2.forceRemove', ('gid',), (), None, '''
         This method removes the download denoted by gid.
 
         gid: string, GID.
 
         return: This method returns GID of removed download.
-        '''
-
-        if self.useSecret:
-            return self.server.aria2.forceRemove("token:" + self.rpcSecret, gid)
-        else:
-            return self.server.aria2.forceRemove(gid)
-
-    def pause(self, gid):
-        '''
+        '''),
+    ('pause', 'aria2.pause', ('gid',), (), None, '''
         This method pauses the download denoted by gid.
 
         gid: string, GID.
 
         return: This method returns GID of paused download.
-        '''
-
-        if self.useSecret:
-            return self.server.aria2.pause("token:" + self.rpcSecret, gid)
-        else:
-            return self.server.aria2.pause(gid)
-
-    def pauseAll(self):
-        '''
+        '''),
+    ('pauseAll', 'aria2.pauseAll', (), (), None, '''
         This method is equal to calling aria2.pause() for every active/waiting download.
 
         return: This method returns OK for success.
-        '''
-
-        if self.useSecret:
-            return self.server.aria2.pauseAll("token:" + self.rpcSecret)
-        else:
-            return self.server.aria2.pauseAll()
-
-    def forcePause(self, gid):
-        '''
+        '''),
+    ('forcePause', 'aria2.forcePause', ('gid',), (), None, '''
         This method pauses the download denoted by gid.
 
         gid: string, GID.
 
         return: This method returns GID of paused download.
-        '''
-
-        if self.useSecret:
-            return self.server.aria2.forcePause("token:" + self.rpcSecret, gid)
-        else:
-            return self.server.aria2.forcePause(gid)
-
-    def forcePauseAll(self):
-        '''
+        '''),
+    ('forcePauseAll', 'aria2.forcePauseAll', (), (), None, '''
         This method is equal to calling aria2.forcePause() for every active/waiting download.
 
         return: This method returns OK for success.
-        '''
-
-        if self.useSecret:
-            return self.server.aria2.forcePauseAll("token:" + self.rpcSecret)
-        else:
-            return self.server.aria2.forcePauseAll()
-
-    def unpause(self, gid):
-        '''
+        '''),
+    ('unpause', 'aria2.unpause', ('gid',), (), None, '''
         This method changes the status of the download denoted by gid from paused to waiting.
 
         gid: string, GID.
 
         return: This method returns GID of unpaused download.
-        '''
-
-        if self.useSecret:
-            return self.server.aria2.unpause("token:" + self.rpcSecret, gid)
-        else:
-            return self.server.aria2.unpause(gid)
-
-    def unpauseAll(self):
-        '''
+        '''),
+    ('unpauseAll', 'aria2.unpauseAll', (), (), None, '''
         This method is equal to calling aria2.unpause() for every active/waiting download.
 
         return: This method returns OK for success.
-        '''
-
-        if self.useSecret:
-            return self.server.aria2.unpauseAll("token:" + self.rpcSecret)
-        else:
-            return self.server.aria2.unpauseAll()
-
-    def tellStatus(self, gid, keys=None):
-        '''
+        '''),
+    ('tellStatus', 'aria2.tellStatus', ('gid',), ('keys',), None, '''
         This method returns download progress of the download denoted by gid.
 
         gid: string, GID.
         keys: list, keys for method response.
 
         return: The method response is of type dict and it contains following keys.
-        '''
-
-        if self.useSecret:
-            return self.server.aria2.tellStatus("token:" + self.rpcSecret, gid, keys)
-        else:
-            return self.server.aria2.tellStatus(gid, keys)
-
-    def getUris(self, gid):
-        '''
+        '''),
+    ('getUris', 'aria2.getUris', ('gid',), (), None, '''
         This method returns URIs used in the download denoted by gid.
 
         gid: string, GID.
 
         return: The method response is of type list and its element is of type dict and it contains following keys.
-        '''
-
-        if self.useSecret:
-            return self.server.aria2.getUris("token:" + self.rpcSecret, gid)
-        else:
-            return self.server.aria2.getUris(gid)
-
-    def getFiles(self, gid):
-        '''
+        '''),
+    ('getFiles', 'aria2.getFiles', ('gid',), (), None, '''
         This method returns file list of the download denoted by gid.
 
         gid: string, GID.
 
         return: The method response is of type list and its element is of type dict and it contains following keys.
-        '''
-
-        if self.useSecret:
-            return self.server.aria2.getFiles("token:" + self.rpcSecret, gid)
-        else:
-            return self.server.aria2.getFiles(gid)
-
-    def getPeers(self, gid):
-        '''
+        '''),
+    ('getPeers', 'aria2.getPeers', ('gid',), (), None, '''
         This method returns peer list of the download denoted by gid.
 
         gid: string, GID.
 
         return: The method response is of type list and its element is of type dict and it contains following keys.
-        '''
-
-        if self.useSecret:
-            return self.server.aria2.getPeers("token:" + self.rpcSecret, gid)
-        else:
-            return self.server.aria2.getPeers(gid)
-
-    def getServers(self, gid):
-        '''
+        '''),
+    ('getServers', 'aria2.getServers', ('gid',), (), None, '''
         This method returns currently connected HTTP(S)/FTP servers of the download denoted by gid.
 
         gid: string, GID.
 
         return: The method response is of type list and its element is of type dict and it contains following keys.
-        '''
-
-        if self.useSecret:
-            return self.server.aria2.getServers("token:" + self.rpcSecret, gid)
-        else:
-            return self.server.aria2.getServers(gid)
-
-    def tellActive(self, keys=None):
-        '''
+        '''),
+    ('tellActive', 'aria2.tellActive', (), ('keys',), None, '''
         This method returns the list of active downloads.
 
         keys: keys for method response.
 
         return: The method response is of type list and its element is of type dict and it contains following keys.
-        '''
-
-        if self.useSecret:
-            return self.server.aria2.tellActive("token:" + self.rpcSecret, keys)
-        else:
-            return self.server.aria2.tellActive(keys)
-
-    def tellWaiting(self, offset, num, keys=None):
-        '''
+        '''),
+    ('tellWaiting', 'aria2.tellWaiting', ('offset', 'num'), ('keys',), None, '''
         This method returns the list of waiting download, including paused downloads.
 
         offset: integer, the offset from the download waiting at the front.
@@ -605,31 +916,17 @@ class PyAria2(object):
         keys: keys for method response.
 
         return: The method response is of type list and its element is of type dict and it contains following keys.
-        '''
-
-        if self.useSecret:
-            return self.server.aria2.tellWaiting("token:" + self.rpcSecret, offset, num, keys)
-        else:
-            return self.server.aria2.tellWaiting(offset, num, keys)
-
-    def tellStopped(self, offset, num, keys=None):
-        '''
+        '''),
+    ('tellStopped', 'aria2.tellStopped', ('offset', 'num'), ('keys',), None, '''
         This method returns the list of stopped download.
 
-        offset: integer, the offset from the download waiting at the front.
+        offset: integer, the offset from the least recently stopped download.
         num: integer, the number of downloads to be returned.
         keys: keys for method response.
 
         return: The method response is of type list and its element is of type dict and it contains following keys.
-        '''
-
-        if self.useSecret:
-            return self.server.aria2.tellStopped("token:" + self.rpcSecret, offset, num, keys)
-        else:
-            return self.server.aria2.tellStopped(offset, num, keys)
-
-    def changePosition(self, gid, pos, how):
-        '''
+        '''),
+    ('changePosition', 'aria2.changePosition', ('gid', 'pos', 'how'), (), None, '''
         This method changes the position of the download denoted by gid.
 
         gid: string, GID.
@@ -640,15 +937,8 @@ class PyAria2(object):
              POS_END, it moves the download to a position relative to the end of the queue.
 
         return: The response is of type integer and it is the destination position.
-        '''
-
-        if self.useSecret:
-            return self.server.aria2.changePosition("token:" + self.rpcSecret, gid, pos, how)
-        else:
-            return self.server.aria2.changePosition(gid, pos, how)
-
-    def changeUri(self, gid, fileIndex, delUris, addUris, position=None):
-        '''
+        '''),
+    ('changeUri', 'aria2.changeUri', ('gid', 'fileIndex', 'delUris', 'addUris'), ('position',), None, '''
         This method removes URIs in delUris from and appends URIs in addUris to download denoted by gid.
 
         gid: string, GID.
@@ -658,151 +948,148 @@ class PyAria2(object):
         position: integer, where URIs are inserted, after URIs have been removed
 
         return: This method returns a list which contains 2 integers. The first integer is the number of URIs deleted. The second integer is the number of URIs added.
-        '''
-
-        if self.useSecret:
-            return self.server.aria2.changeUri("token:" + self.rpcSecret, gid, fileIndex, delUris, addUris, position)
-        else:
-            return self.server.aria2.changeUri(gid, fileIndex, delUris, addUris, position)
-
-    def getOption(self, gid):
-        '''
+        '''),
+    ('getOption', 'aria2.getOption', ('gid',), (), None, '''
         This method returns options of the download denoted by gid.
 
         gid: string, GID.
 
         return: The response is of type dict.
-        '''
-
-        if self.useSecret:
-            return self.server.aria2.getOption("token:" + self.rpcSecret, gid)
-        else:
-            return self.server.aria2.getOption(gid)
-
-    def changeOption(self, gid, options):
-        '''
+        '''),
+    ('changeOption', 'aria2.changeOption', ('gid', 'options'), (), None, '''
         This method changes options of the download denoted by gid dynamically.
 
         gid: string, GID.
         options: dict, the options.
 
         return: This method returns OK for success.
-        '''
-
-        if self.useSecret:
-            return self.server.aria2.changeOption("token:" + self.rpcSecret, gid, options)
-        else:
-            return self.server.aria2.changeOption(gid, options)
-
-    def getGlobalOption(self):
-        '''
+        '''),
+    ('getGlobalOption', 'aria2.getGlobalOption', (), (), None, '''
         This method returns global options.
 
         return: The method response is of type dict.
-        '''
-
-        if self.useSecret:
-            return self.server.aria2.getGlobalOption("token:" + self.rpcSecret)
-        else:
-            return self.server.aria2.getGlobalOption()
-
-    def changeGlobalOption(self, options):
-        '''
+        '''),
+    ('changeGlobalOption', 'aria2.changeGlobalOption', ('options',), (), None, '''
         This method changes global options dynamically.
 
         options: dict, the options.
 
         return: This method returns OK for success.
-        '''
-
-        if self.useSecret:
-            return self.server.aria2.changeGlobalOption("token:" + self.rpcSecret, options)
-        else:
-            return self.server.aria2.changeGlobalOption(options)
-
-    def getGlobalStat(self):
-        '''
+        '''),
+    ('getGlobalStat', 'aria2.getGlobalStat', (), (), None, '''
         This method returns global statistics such as overall download and upload speed.
 
         return: The method response is of type struct and contains following keys.
-        '''
-
-        if self.useSecret:
-            return self.server.aria2.getGlobalStat("token:" + self.rpcSecret)
-        else:
-            return self.server.aria2.getGlobalStat()
-
-    def purgeDownloadResult(self):
-        '''
+        '''),
+    ('purgeDownloadResult', 'aria2.purgeDownloadResult', (), (), None, '''
         This method purges completed/error/removed downloads to free memory.
 
         return: This method returns OK for success.
-        '''
-
-        if self.useSecret:
-            return self.server.aria2.purgeDownloadResult("token:" + self.rpcSecret)
-        else:
-            return self.server.aria2.purgeDownloadResult()
-
-    def removeDownloadResult(self, gid):
-        '''
+        '''),
+    ('removeDownloadResult', 'aria2.removeDownloadResult', ('gid',), (), None, '''
         This method removes completed/error/removed download denoted by gid from memory.
 
         return: This method returns OK for success.
-        '''
-
-        if self.useSecret:
-            return self.server.aria2.removeDownloadResult("token:" + self.rpcSecret, gid)
-        else:
-            return self.server.aria2.removeDownloadResult(gid)
-
-    def getVersion(self):
-        '''
+        '''),
+    ('getVersion', 'aria2.getVersion', (), (), None, '''
         This method returns version of the program and the list of enabled features.
 
         return: The method response is of type dict and contains following keys.
-        '''
-
-        if self.useSecret:
-            return self.server.aria2.getVersion("token:" + self.rpcSecret)
-        else:
-            return self.server.aria2.getVersion()
-
-    def getSessionInfo(self):
-        '''
+        '''),
+    ('getSessionInfo', 'aria2.getSessionInfo', (), (), None, '''
         This method returns session information.
 
         return: The response is of type dict.
-        '''
-
-        if self.useSecret:
-            return self.server.aria2.getSessionInfo("token:" + self.rpcSecret)
-        else:
-            return self.server.aria2.getSessionInfo()
-
-    def shutdown(self):
-        '''
+        '''),
+    ('shutdown', 'aria2.shutdown', (), (), None, '''
         This method shutdowns aria2.
 
         return: This method returns OK for success.
-        '''
-        logger.info("Calling shutdown of aria2 server.")
-        if self.useSecret:
-            return self.server.aria2.shutdown("token:" + self.rpcSecret)
-        else:
-            return self.server.aria2.shutdown()
-
-    def forceShutdown(self):
-        '''
+        '''),
+    ('forceShutdown', 'aria2.forceShutdown', (), (), None, '''
         This method shutdowns aria2.
 
         return: This method returns OK for success.
-        '''
-        logger.info("Forcing shutdown of aria2 server.")
-        if self.useSecret:
-            return self.server.aria2.forceShutdown("token:" + self.rpcSecret)
-        else:
-            return self.server.aria2.forceShutdown()
+        '''),
+    ('saveSession', 'aria2.saveSession', (), (), None, '''
+        This method saves the current session to the file specified by the --save-session option.
+
+        return: This method returns OK for success.
+        '''),
+    ('multicall', 'system.multicall', ('methods',), (), None, '''
+        This method encapsulates multiple method calls in a single request.
+
+        methods: list of dict, each with "methodName" and "params" keys. The secret token must be part of params.
+
+        return: list, one element per call: a one item list holding the result, or a fault dict.
+        '''),
+    ('listMethods', 'system.listMethods', (), (), None, '''
+        This method returns all the available RPC methods.
+
+        return: list of method names.
+        '''),
+    ('listNotifications', 'system.listNotifications', (), (), None, '''
+        This method returns all the available RPC notifications.
+
+        return: list of notification names.
+        '''),
+)
+
+
+def makeRPCMethod(name, method, required, optional, prepare, doc):
+    '''
+    Build the python method calling RPC method through self._call.
+    '''
+    names = required + optional
+    count = len(names)
+    defaults = (None,) * len(optional)
+
+    def rpcMethod(self, *args, **kwargs):
+        if kwargs or len(args) != count:
+            args = bindArguments(name, names, defaults, args, kwargs)
+        if prepare is not None:
+            args = prepare(self, *args)
+        return self._call(method, args)
+
+    rpcMethod.__name__ = rpcMethod.__qualname__ = name
+    rpcMethod.__doc__ = doc
+    rpcMethod.__signature__ = inspect.Signature(
+        [inspect.Parameter('self', inspect.Parameter.POSITIONAL_OR_KEYWORD)] +
+        [inspect.Parameter(param, inspect.Parameter.POSITIONAL_OR_KEYWORD) for param in required] +
+        [inspect.Parameter(param, inspect.Parameter.POSITIONAL_OR_KEYWORD, default=None) for param in optional]
+    )
+    return rpcMethod
+
+
+def bindArguments(name, names, defaults, args, kwargs):
+    required = len(names) - len(defaults)
+    if len(args) > len(names):
+        raise TypeError("%s() takes %d arguments but %d were given" % (name, len(names), len(args)))
+    values = list(args) + [None] * (len(names) - len(args))
+    given = [True] * len(args) + [False] * (len(names) - len(args))
+    for key, value in kwargs.items():
+        try:
+            index = names.index(key)
+        except ValueError:
+            raise TypeError("%s() got an unexpected keyword argument '%s'" % (name, key))
+        if given[index]:
+            raise TypeError("%s() got multiple values for argument '%s'" % (name, key))
+        values[index], given[index] = value, True
+    missing = [param for param, is_given in zip(names[:required], given) if not is_given]
+    if missing:
+        raise TypeError("%s() missing required arguments: %s" % (name, ', '.join(missing)))
+    return tuple(values)
+
+
+def installRPCMethods(cls):
+    for name, method, required, optional, prepare, doc in RPC_METHODS:
+        if name not in cls.__dict__:
+            setattr(cls, name, makeRPCMethod(name, method, required, optional, prepare, doc))
+    return cls
+
+
+installRPCMethods(PyAria2)
+installRPCMethods(RPCBatch)
 
 
 def isAria2Installed():
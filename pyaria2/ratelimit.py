@@ -0,0 +1,105 @@
+'''
+Client-side limits on the rate of RPC calls sent to aria2.
+'''
+
+# -*- coding: utf-8 -*-
+
+import heapq
+import itertools
+import threading
+import time
+
+
+class TokenBucket(object):
+    '''
+    Classic token bucket: rate tokens are added per second, up to burst.
+    '''
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        '''
+        rate: float, tokens added per second
+        burst: float, bucket size, defaults to rate (one second worth of calls)
+        '''
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def tryAcquire(self, tokens=1):
+        '''
+        return: True if tokens were taken, False if the bucket is short of them.
+        '''
+        with self._lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def delay(self, tokens=1):
+        '''
+        return: seconds until tokens will be available.
+        '''
+        with self._lock:
+            self._refill()
+            return max(0.0, (tokens - self.tokens) / self.rate)
+
+    def acquire(self, tokens=1):
+        '''
+        Block until tokens are taken.
+        '''
+        while not self.tryAcquire(tokens):
+            time.sleep(self.delay(tokens))
+
+
+# Priorities of PriorityTokenBucket, lower goes first
+PRIORITY_CONTROL = 0
+PRIORITY_SUBMIT = 1
+PRIORITY_READ = 2
+
+
+class PriorityTokenBucket(TokenBucket):
+    '''
+    Token bucket whose waiters are served by priority, then in arrival order.
+
+    A caller only takes tokens when no waiter of a better priority (or an
+    earlier one of the same priority) is queued, so under load control calls
+    overtake status reads instead of queueing behind them.
+    '''
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        super(PriorityTokenBucket, self).__init__(rate, burst, clock)
+        self._condition = threading.Condition(self._lock)
+        self._waiters = []
+        self._counter = itertools.count()
+
+    def acquire(self, tokens=1, priority=PRIORITY_READ):
+        '''
+        Block until tokens are taken.
+        '''
+        with self._condition:
+            ticket = (priority, next(self._counter))
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    wait = None
+                    if self._waiters[0] == ticket:
+                        self._refill()
+                        if self.tokens >= tokens:
+                            self.tokens -= tokens
+                            return
+                        wait = (tokens - self.tokens) / self.rate
+                    self._condition.wait(wait)
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._condition.notify_all()
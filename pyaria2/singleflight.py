@@ -0,0 +1,62 @@
+'''
+Coalescing of identical concurrent calls.
+'''
+
+# -*- coding: utf-8 -*-
+
+import copy
+import threading
+
+
+class _Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    '''
+    Runs at most one call per key at a time.
+
+    Threads asking for a key while its call is in flight wait for it and get
+    a copy of its result (or its exception) instead of making the call again.
+    Results are copied, so callers may modify what they get.
+    '''
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, func, *args):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.calls += 1
+            else:
+                flight.waiters += 1
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result)
+
+        try:
+            flight.result = func(*args)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                waiters = flight.waiters
+            flight.done.set()
+        # Everybody gets their own copy, the stored result stays pristine for the waiters
+        return copy.deepcopy(flight.result) if waiters else flight.result
@@ -0,0 +1,286 @@
+'''
+Download status shared by all processes of a host.
+
+When many worker processes poll the same aria2c, the RPC load grows with the
+number of workers. With SharedStatusCache one elected process polls the
+daemon and publishes snapshots into a multiprocessing.shared_memory segment;
+the others read from it without any RPC.
+
+Segment layout, all little endian:
+
+    header   magic, layout version, sequence, timestamp, active slot, count, data length
+    slot 0   index and data of one snapshot
+    slot 1   index and data of the other snapshot
+
+where a slot holds
+
+    index    count entries of (8 byte GID, data offset, data length), sorted by GID
+    data     one compact JSON status per download
+
+The publisher writes a new snapshot into the inactive slot, then switches
+the header over to it. Only that header switch is guarded by a seqlock (the
+sequence is odd while it is rewritten), so readers never take a lock and
+only retry in the rare case the sequence was odd or changed while they read,
+e.g. when the slot they were reading got reused. A lookup binary-searches
+the index in place and decodes only the matching record.
+'''
+
+# -*- coding: utf-8 -*-
+
+import errno
+import fcntl
+import json
+import logging
+import os
+import struct
+import sys
+import tempfile
+import time
+
+from multiprocessing import resource_tracker, shared_memory
+
+from .periodic import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PAS1'
+LAYOUT_VERSION = 2
+HEADER = struct.Struct('<4sIQdIII')
+SEQUENCE = struct.Struct('<Q')
+SEQUENCE_OFFSET = 8
+INDEX_ENTRY = struct.Struct('<8sII')
+
+DEFAULT_SIZE = 16 * 1024 * 1024
+DEFAULT_INTERVAL = 1
+# Seconds a reader keeps retrying before giving up on a snapshot that keeps changing
+READ_TIMEOUT = 1.0
+
+# Python 3.13 can attach to a segment without the resource tracker unlinking it at exit
+UNTRACKED_SEGMENTS = sys.version_info >= (3, 13)
+
+STATUS_KEYS = ['gid', 'status', 'totalLength', 'completedLength', 'downloadSpeed', 'uploadSpeed',
+               'errorCode', 'dir']
+
+
+class SnapshotUnavailable(Exception):
+    pass
+
+
+def openSegment(name, size):
+    '''
+    Create the shared memory segment name, or attach to it if it exists.
+
+    The segment is not registered with the multiprocessing resource tracker:
+    it must outlive whichever process happened to create it, see
+    SharedStatusCache.unlink.
+    '''
+    kwargs = {'track': False} if UNTRACKED_SEGMENTS else {}
+    try:
+        segment = shared_memory.SharedMemory(name, create=True, size=size, **kwargs)
+        segment.buf[:HEADER.size] = HEADER.pack(MAGIC, LAYOUT_VERSION, 0, 0.0, 0, 0, 0)
+    except FileExistsError:
+        segment = shared_memory.SharedMemory(name, **kwargs)
+    if not UNTRACKED_SEGMENTS:
+        resource_tracker.unregister(segment._name, 'shared_memory')
+    return segment
+
+
+class SharedStatusCache(PeriodicTask):
+    '''
+    Status snapshots of one daemon, shared through memory between processes.
+
+    Every process creates a SharedStatusCache with the same name. Those given
+    a client take part in the election: each run (see PeriodicTask) the
+    process holding an exclusive lock on lock_path polls the daemon and
+    publishes, the others try to take the lock over, e.g. after the publisher
+    died. Processes without a client only read.
+    '''
+
+    def __init__(self, name, client=None, size=DEFAULT_SIZE, interval=DEFAULT_INTERVAL, keys=None,
+                 lock_path=None):
+        '''
+        name: string, shared memory segment name
+        :type client: PyAria2
+        size: integer, segment size in bytes, used by whichever process creates the segment
+        keys: list, status keys to publish
+        '''
+        super(SharedStatusCache, self).__init__(interval)
+        self.name = name
+        self.client = client
+        self.keys = keys or STATUS_KEYS
+        if 'gid' not in self.keys:
+            self.keys = ['gid'] + list(self.keys)
+        self.lockPath = lock_path or os.path.join(tempfile.gettempdir(), 'pyaria2-%s.lock' % name)
+        self.segment = openSegment(name, size)
+        self.slotSize = (len(self.segment.buf) - HEADER.size) // 2
+        self._lockFile = None
+
+    def slotStart(self, slot):
+        return HEADER.size + slot * self.slotSize
+
+    @property
+    def activeSlot(self):
+        return HEADER.unpack_from(self.segment.buf, 0)[4]
+
+    @property
+    def isLeader(self):
+        return self._lockFile is not None
+
+    def elect(self):
+        '''
+        Try to become the publishing process.
+
+        return: True if this process publishes.
+        '''
+        if self._lockFile is not None:
+            return True
+        lock_file = open(self.lockPath, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            lock_file.close()
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            return False
+        logger.info("Publishing aria2 status into shared memory %s", self.name)
+        self._lockFile = lock_file
+        return True
+
+    def resign(self):
+        if self._lockFile is not None:
+            self._lockFile.close()
+            self._lockFile = None
+
+    def runOnce(self):
+        if self.client is not None and self.elect():
+            self.publish(self.poll())
+
+    def poll(self):
+        '''
+        return: list of the statuses of every active, waiting and stopped download.
+        '''
+        return self.client.tellAll(self.keys)
+
+    def publish(self, statuses):
+        '''
+        Write a snapshot, readers see either the previous one or this one.
+        '''
+        records = sorted((bytes.fromhex(status['gid']), json.dumps(status, separators=(',', ':')).encode('utf-8'))
+                         for status in statuses)
+        buf = self.segment.buf
+        slot = 1 - self.activeSlot
+        data_length = self.writeSlot(slot, records)
+
+        sequence = SEQUENCE.unpack_from(buf, SEQUENCE_OFFSET)[0]
+        if sequence % 2:
+            # A previous publisher died while switching slots
+            sequence += 1
+        SEQUENCE.pack_into(buf, SEQUENCE_OFFSET, sequence + 1)
+        HEADER.pack_into(buf, 0, MAGIC, LAYOUT_VERSION, sequence + 1, time.time(), slot, len(records), data_length)
+        SEQUENCE.pack_into(buf, SEQUENCE_OFFSET, sequence + 2)
+
+    def writeSlot(self, slot, records):
+        '''
+        Write sorted (GID bytes, JSON bytes) records into slot, which readers must not be using.
+
+        return: data length.
+        '''
+        index_start = self.slotStart(slot)
+        data_start = index_start + INDEX_ENTRY.size * len(records)
+        data_length = sum(len(record) for _, record in records)
+        if data_start + data_length > index_start + self.slotSize:
+            raise ValueError("Snapshot of %d bytes does not fit the %d byte slots of %s"
+                             % (data_start + data_length - index_start, self.slotSize, self.name))
+        buf = self.segment.buf
+        offset = data_start
+        for position, (gid, record) in enumerate(records):
+            INDEX_ENTRY.pack_into(buf, index_start + position * INDEX_ENTRY.size, gid, offset, len(record))
+            buf[offset:offset + len(record)] = record
+            offset += len(record)
+        return data_length
+
+    def _consistent(self, read):
+        buf = self.segment.buf
+        deadline = time.monotonic() + READ_TIMEOUT
+        while True:
+            header = HEADER.unpack_from(buf, 0)
+            magic, layout, sequence = header[:3]
+            if magic != MAGIC or layout != LAYOUT_VERSION:
+                raise SnapshotUnavailable("%s does not hold a status snapshot" % self.name)
+            if sequence == 0:
+                raise SnapshotUnavailable("Nothing was published to %s yet" % self.name)
+            if sequence % 2 == 0:
+                error = None
+                try:
+                    value = read(buf, self.slotStart(header[4]), header[5], header[6])
+                except (struct.error, ValueError, IndexError) as e:
+                    # Torn read of a slot being reused, unless the sequence did not move
+                    error = e
+                if SEQUENCE.unpack_from(buf, SEQUENCE_OFFSET)[0] == sequence:
+                    if error is not None:
+                        raise error
+                    return value
+            if time.monotonic() > deadline:
+                raise SnapshotUnavailable("%s kept changing while being read" % self.name)
+            time.sleep(0)
+
+    def get(self, gid):
+        '''
+        return: status dict of download gid, or None if it is not in the snapshot.
+        '''
+        key = bytes.fromhex(gid)
+
+        def read(buf, index_start, count, data_length):
+            low, high = 0, count
+            while low < high:
+                middle = (low + high) // 2
+                entry_gid, offset, length = INDEX_ENTRY.unpack_from(buf, index_start + middle * INDEX_ENTRY.size)
+                if entry_gid < key:
+                    low = middle + 1
+                elif entry_gid > key:
+                    high = middle
+                else:
+                    return bytes(buf[offset:offset + length])
+            return None
+
+        record = self._consistent(read)
+        return json.loads(record.decode('utf-8')) if record is not None else None
+
+    def gids(self):
+        def read(buf, index_start, count, data_length):
+            return [INDEX_ENTRY.unpack_from(buf, index_start + i * INDEX_ENTRY.size)[0].hex() for i in range(count)]
+
+        return self._consistent(read)
+
+    def snapshot(self):
+        '''
+        return: list of every status in the snapshot. This decodes all of it, prefer get for single downloads.
+        '''
+        def read(buf, index_start, count, data_length):
+            start = index_start + INDEX_ENTRY.size * count
+            return start, bytes(buf[start:start + data_length]), [
+                INDEX_ENTRY.unpack_from(buf, index_start + i * INDEX_ENTRY.size)[1:] for i in range(count)]
+
+        start, data, entries = self._consistent(read)
+        return [json.loads(data[offset - start:offset - start + length].decode('utf-8')) for offset, length in entries]
+
+    def age(self):
+        '''
+        return: seconds since the snapshot was published.
+        '''
+        header = self._consistent(lambda buf, index_start, count, data_length: HEADER.unpack_from(buf, 0))
+        return time.time() - header[3]
+
+    def close(self):
+        self.stop()
+        self.resign()
+        self.segment.close()
+
+    def unlink(self):
+        '''
+        Remove the segment from the system once no process needs it anymore.
+        '''
+        if not UNTRACKED_SEGMENTS:
+            # unlink unregisters the segment from the tracker, which openSegment already did
+            resource_tracker.register(self.segment._name, 'shared_memory')
+        self.segment.unlink()
@@ -0,0 +1,331 @@
+'''
+Supervision of aria2c processes.
+
+AriaSupervisor launches aria2c from AriaServerSettings with an argument list
+(no shell), health-checks it over RPC and, when it crashes or stops
+answering, restarts it with --input-file pointing to the saved session. It
+can keep pre-started spare daemons ready: on failure a spare is promoted,
+loaded with the saved session over RPC and attached clients are pointed at
+it, which is much faster than a cold start.
+'''
+
+# -*- coding: utf-8 -*-
+
+import copy
+import logging
+import os
+import subprocess
+import tempfile
+import time
+
+import xmlrpc.client as xmlrpclib
+
+from .inputfile import parseInputFile
+from .periodic import PeriodicTask
+from .pyaria2 import SERVER_URI_FORMAT, PyAria2
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 5
+DEFAULT_HEALTH_TIMEOUT = 5
+DEFAULT_MAX_FAILURES = 3
+DEFAULT_STARTUP_TIMEOUT = 30
+DEFAULT_SHUTDOWN_TIMEOUT = 10
+SESSION_BATCH_SIZE = 1000
+
+# Settings a spare must not share with the primary daemon
+SPARE_RESET_FIELDS = ['save_session', 'input_file', 'listen_port', 'dht_listen_port', 'log']
+
+
+class TimeoutTransport(xmlrpclib.Transport):
+    def __init__(self, timeout):
+        xmlrpclib.Transport.__init__(self)
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        connection = xmlrpclib.Transport.make_connection(self, host)
+        connection.timeout = self.timeout
+        return connection
+
+
+class AriaDaemon(object):
+    '''
+    One aria2c process and the means to check on it.
+    '''
+
+    def __init__(self, settings, health_timeout=DEFAULT_HEALTH_TIMEOUT):
+        '''
+        :type settings: AriaServerSettings
+        '''
+        self.settings = settings
+        self.process = None
+        self.client = None
+        self.failures = 0
+        self._token = ("token:" + settings.rpc_secret,) if settings.rpc_secret is not None else ()
+        self._health = xmlrpclib.ServerProxy(self.serverUri, transport=TimeoutTransport(health_timeout))
+
+    @property
+    def serverUri(self):
+        return SERVER_URI_FORMAT.format(self.settings.host, self.settings.rpc_listen_port)
+
+    def argv(self, input_file=None):
+        settings = self.settings
+        if input_file is not None:
+            settings = copy.copy(settings)
+            settings.input_file = input_file
+        return ['aria2c', '--enable-rpc'] + settings.construct_as_argv()
+
+    def start(self, input_file=None, timeout=DEFAULT_STARTUP_TIMEOUT):
+        '''
+        Launch aria2c and wait until it answers RPC calls.
+
+        input_file: string, downloads to load at start-up instead of settings.input_file
+        '''
+        if self.settings.save_session is not None and not os.path.exists(self.settings.save_session):
+            open(self.settings.save_session, 'a').close()
+        argv = self.argv(input_file)
+        logger.info("Starting %s", ' '.join(argv))
+        # A file rather than a pipe, nobody reads a pipe once the daemon runs
+        with tempfile.TemporaryFile() as errors:
+            self.process = subprocess.Popen(argv, stdout=subprocess.DEVNULL, stderr=errors)
+            self.failures = 0
+            self._waitReady(timeout, errors)
+        if self.client is None:
+            self.client = PyAria2(self.settings)
+        return self
+
+    def _waitReady(self, timeout, errors):
+        deadline = time.time() + timeout
+        while not self.healthy():
+            if not self.isAlive():
+                errors.seek(0)
+                raise Exception("aria2c exited with %s while starting: %s"
+                                % (self.process.returncode, errors.read().decode('utf-8', 'replace')))
+            if time.time() > deadline:
+                self.kill()
+                raise Exception("aria2c did not answer on %s within %ss" % (self.serverUri, timeout))
+            time.sleep(0.1)
+
+    def isAlive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def healthy(self):
+        '''
+        return: True if the daemon answered getVersion within the health timeout.
+        '''
+        try:
+            self._health.aria2.getVersion(*self._token)
+        except (OSError, xmlrpclib.Error) as e:
+            logger.debug("Health check of %s failed: %s", self.serverUri, e)
+            return False
+        return True
+
+    def check(self):
+        '''
+        Run one health check, counting consecutive failures.
+
+        return: True if healthy.
+        '''
+        if self.isAlive() and self.healthy():
+            self.failures = 0
+            return True
+        self.failures += 1
+        return False
+
+    def shutdown(self, force=False, timeout=DEFAULT_SHUTDOWN_TIMEOUT):
+        '''
+        Stop the daemon through shutdown (or forceShutdown), escalating to signals if it does not exit.
+        '''
+        if not self.isAlive():
+            return
+        try:
+            if force:
+                self._health.aria2.forceShutdown(*self._token)
+            else:
+                self._health.aria2.shutdown(*self._token)
+        except (OSError, xmlrpclib.Error) as e:
+            logger.debug("RPC shutdown of %s failed: %s", self.serverUri, e)
+        try:
+            self.process.wait(timeout)
+            return
+        except subprocess.TimeoutExpired:
+            pass
+        if not force:
+            return self.shutdown(force=True, timeout=timeout)
+        self.kill(timeout)
+
+    def kill(self, timeout=DEFAULT_SHUTDOWN_TIMEOUT):
+        if not self.isAlive():
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def loadSession(client, path, batch_size=SESSION_BATCH_SIZE):
+    '''
+    Add the downloads of a saved session (or any input file) over RPC, keeping their GIDs.
+
+    :type client: PyAria2
+    return: number of downloads added, the ones aria2 refused are logged.
+    '''
+    count = 0
+    batch = client.batch()
+    records = []
+    for uris, options in parseInputFile(path):
+        local = uris[0] if len(uris) == 1 and os.path.isfile(uris[0]) else None
+        if local is not None and local.endswith('.torrent'):
+            batch.addTorrent(local, None, options)
+        elif local is not None and local.endswith(('.metalink', '.meta4')):
+            batch.addMetalink(local, options)
+        else:
+            batch.addUri(uris, options)
+        records.append(uris)
+        if len(batch) >= batch_size:
+            count += _addedFromSession(batch, records, path)
+            records = []
+    if len(batch):
+        count += _addedFromSession(batch, records, path)
+    return count
+
+
+def _addedFromSession(batch, records, path):
+    added = 0
+    for uris, result in zip(records, batch.execute()):
+        if isinstance(result, xmlrpclib.Fault):
+            logger.warning("Could not add %s from %s again: %s", ' '.join(uris), path, result.faultString)
+        else:
+            added += 1
+    return added
+
+
+class AriaSupervisor(PeriodicTask):
+    '''
+    Keeps an aria2c daemon running.
+
+    spare_ports: list of RPC ports for pre-started spare daemons. Spares use
+        the same settings but no session or listening ports of their own,
+        and take over the session when promoted. A spare that is used up,
+        or found broken when it should take over, is replaced right away.
+    max_failures: consecutive failed health checks (one per run, see
+        PeriodicTask) before a live but unresponsive daemon is replaced.
+    '''
+
+    # Factory of the managed daemons, given settings and the health timeout
+    daemonClass = AriaDaemon
+
+    def __init__(self, settings, spare_ports=(), interval=DEFAULT_INTERVAL, max_failures=DEFAULT_MAX_FAILURES,
+                 health_timeout=DEFAULT_HEALTH_TIMEOUT, on_failover=None):
+        '''
+        :type settings: AriaServerSettings
+        on_failover: function called with the new primary AriaDaemon
+        '''
+        super(AriaSupervisor, self).__init__(interval)
+        self.settings = settings
+        self.sparePorts = list(spare_ports)
+        self.maxFailures = max_failures
+        self.healthTimeout = health_timeout
+        self.onFailover = on_failover
+        self.primary = None
+        self.spares = []
+        self.clients = []
+        self.restarts = 0
+
+    @property
+    def client(self):
+        '''
+        return: PyAria2 connected to the current primary daemon.
+        '''
+        return self.primary.client
+
+    def attach(self, client):
+        '''
+        Keep client pointed at the primary daemon across failovers.
+
+        :type client: PyAria2
+        '''
+        self.clients.append(client)
+        if self.primary is not None:
+            client.setServer(self.primary.serverUri)
+
+    def launch(self):
+        '''
+        Start the primary daemon and the spares, then start health checking.
+        '''
+        self.primary = self.daemonClass(self.settings, self.healthTimeout).start()
+        for port in self.sparePorts:
+            self.spares.append(self._startSpare(port))
+        self.start()
+        return self
+
+    def runOnce(self):
+        if self.primary.check():
+            for spare in list(self.spares):
+                if not spare.isAlive():
+                    logger.warning("Spare daemon on %s died, replacing it", spare.serverUri)
+                    self.spares.remove(spare)
+                    self.spares.append(self._startSpare(spare.settings.rpc_listen_port))
+            return
+        if self.primary.isAlive() and self.primary.failures < self.maxFailures:
+            return
+        logger.error("aria2c on %s is down (exit code %s, %d failed checks)", self.primary.serverUri,
+                     self.primary.process.poll(), self.primary.failures)
+        self.recover()
+
+    def recover(self):
+        '''
+        Replace the primary daemon, by a spare if one is ready, else by a restart from the saved session.
+        '''
+        failed = self.primary
+        failed.kill()
+        self.restarts += 1
+        session = self.settings.save_session
+        has_session = session is not None and os.path.exists(session)
+
+        spare = self.spares.pop(0) if self.spares else None
+        if spare is not None and spare.check():
+            if session is not None:
+                # Only the primary saves the session
+                spare.client.changeGlobalOption({'save-session': session})
+                if has_session:
+                    loaded = loadSession(spare.client, session)
+                    logger.info("Loaded %d downloads of %s into spare %s", loaded, session, spare.serverUri)
+            # From now on the primary, and its restarts, live on the spare's port
+            self.settings = copy.copy(self.settings)
+            self.settings.rpc_listen_port = spare.settings.rpc_listen_port
+            spare.settings = self.settings
+            self.primary = spare
+            self.spares.append(self._startSpare(failed.settings.rpc_listen_port))
+        else:
+            self.primary = self.daemonClass(self.settings, self.healthTimeout)
+            self.primary.start(input_file=session if has_session else None)
+            if spare is not None:
+                logger.warning("Spare daemon on %s is not healthy, replacing it", spare.serverUri)
+                spare.kill()
+                self.spares.append(self._startSpare(spare.settings.rpc_listen_port))
+
+        logger.info("aria2c primary is now %s", self.primary.serverUri)
+        for client in self.clients:
+            client.setServer(self.primary.serverUri)
+        if self.onFailover is not None:
+            self.onFailover(self.primary)
+
+    def shutdown(self, force=False):
+        '''
+        Stop health checking and shut every daemon down.
+        '''
+        self.stop()
+        for daemon in [self.primary] + self.spares:
+            if daemon is not None:
+                daemon.shutdown(force)
+        self.spares = []
+
+    def _startSpare(self, port):
+        settings = copy.copy(self.settings)
+        settings.rpc_listen_port = port
+        for field in SPARE_RESET_FIELDS:
+            setattr(settings, field, None)
+        return self.daemonClass(settings, self.healthTimeout).start()
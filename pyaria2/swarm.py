@@ -0,0 +1,211 @@
+'''
+BitTorrent swarm tuning from live peer statistics.
+
+bt-max-peers, bt-request-peer-speed-limit, seed-ratio and
+max-overall-upload-limit are daemon-wide start-up settings, which suit
+neither tiny nor huge swarms. SwarmTuner reads getPeers and tellStatus of
+every active torrent and adjusts per-download options with changeOption:
+peer caps follow how useful the connected peers are, the requested peer
+speed follows the achieved speed, an upload budget is split between
+torrents, and seeding is stopped once it has paid back or nobody takes
+the data any more.
+'''
+
+# -*- coding: utf-8 -*-
+
+import logging
+
+from .periodic import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 30
+DEFAULT_MIN_PEERS = 20
+DEFAULT_MAX_PEERS = 250
+DEFAULT_ARIA_MAX_PEERS = 55
+DEFAULT_MIN_REQUEST_SPEED = 50 * 1024
+DEFAULT_SEED_RATIO = 1.0
+DEFAULT_IDLE_RUNS = 4
+
+# Fraction of connected peers which must be sending data before the cap is raised.
+USEFUL_PEERS_RAISE = 0.5
+# Below this fraction of useful peers the cap is lowered.
+USEFUL_PEERS_LOWER = 0.2
+PEER_CAP_FACTOR = 1.5
+REQUEST_SPEED_HEADROOM = 1.25
+# Relative change an option value needs before changeOption is called again.
+CHANGE_THRESHOLD = 0.2
+
+STATUS_KEYS = ['gid', 'status', 'infoHash', 'totalLength', 'completedLength', 'downloadSpeed',
+               'uploadLength', 'uploadSpeed', 'connections', 'seeder']
+
+
+def significantChange(old, new):
+    if old is None:
+        return True
+    if old == 0 or new == 0:
+        return old != new
+    return abs(new - old) >= CHANGE_THRESHOLD * old
+
+
+class SwarmTuner(PeriodicTask):
+    '''
+    Periodically adjusts bt-max-peers, bt-request-peer-speed-limit and
+    max-upload-limit of active torrents.
+
+    upload_budget: integer, bytes/s shared by all torrents, 0 to leave upload limits alone.
+        Downloading torrents get a share proportional to their connected peers
+        (uploading is what buys download slots), seeding ones proportional to
+        their connected peers which still download.
+    seed_ratio: float, upload/download ratio at which a completed torrent stops
+        seeding, None to only stop idle ones.
+    idle_runs: integer, runs in a row a completed torrent may upload nothing
+        before it stops seeding (its swarm has enough seeders), None to keep
+        idle torrents seeding.
+
+    A torrent that stops seeding is removed from aria2, its files stay on disk.
+    aria2 then reports it as "removed" with all of its data, which
+    effectiveStatus (and Verifier, ResultArchive and JobTracker) count as
+    complete.
+
+    Peer caps start from the bt-max-peers each torrent runs with, asked
+    once per download with getOption; 0 means unlimited and is only ever
+    lowered.
+    '''
+
+    def __init__(self, client, upload_budget=0, interval=DEFAULT_INTERVAL, min_peers=DEFAULT_MIN_PEERS,
+                 max_peers=DEFAULT_MAX_PEERS, min_request_speed=DEFAULT_MIN_REQUEST_SPEED,
+                 seed_ratio=DEFAULT_SEED_RATIO, idle_runs=DEFAULT_IDLE_RUNS):
+        '''
+        :type client: PyAria2
+        '''
+        super(SwarmTuner, self).__init__(interval)
+        self.client = client
+        self.uploadBudget = upload_budget
+        self.minPeers = min_peers
+        self.maxPeers = max_peers
+        self.minRequestSpeed = min_request_speed
+        self.seedRatio = seed_ratio
+        self.idleRuns = idle_runs
+        self.applied = {}
+        # GID -> runs in a row a seeding torrent uploaded nothing
+        self.idle = {}
+
+    def runOnce(self):
+        torrents = [status for status in self.client.tellActive(STATUS_KEYS) if status.get('infoHash')]
+        peers = {}
+        for status in torrents:
+            try:
+                peers[status['gid']] = self.client.getPeers(status['gid'])
+            except Exception as e:
+                logger.debug("getPeers(%s) failed: %s", status['gid'], e)
+                peers[status['gid']] = []
+
+        seeding = [status for status in torrents if self.isSeeding(status)]
+        for status in seeding:
+            reason = self.stopSeedingReason(status)
+            if reason is not None:
+                logger.info("Stopping seeding of %s, %s", status['gid'], reason)
+                self.client.remove(status['gid'])
+                torrents.remove(status)
+
+        self.readPeerCaps([status['gid'] for status in torrents if not self.isSeeding(status)])
+        changes = {}
+        for status in torrents:
+            if not self.isSeeding(status):
+                changes[status['gid']] = self.tuneDownload(status, peers[status['gid']])
+        for gid, limit in self.uploadShares(torrents, peers).items():
+            changes.setdefault(gid, {})['max-upload-limit'] = limit
+
+        for gid, options in changes.items():
+            self.apply(gid, options)
+
+        active = set(status['gid'] for status in torrents)
+        for gid in list(self.applied):
+            if gid not in active:
+                del self.applied[gid]
+        for gid in list(self.idle):
+            if gid not in active:
+                del self.idle[gid]
+
+    def isSeeding(self, status):
+        return status.get('seeder') == 'true' or (
+            int(status['totalLength']) > 0 and status['completedLength'] == status['totalLength'])
+
+    def stopSeedingReason(self, status):
+        '''
+        return: string, why a seeding torrent should stop, or None to keep seeding.
+        '''
+        gid = status['gid']
+        if int(status['uploadSpeed']) > 0:
+            self.idle.pop(gid, None)
+        else:
+            self.idle[gid] = self.idle.get(gid, 0) + 1
+        completed = int(status['completedLength'])
+        if self.seedRatio is not None and completed > 0:
+            ratio = float(status['uploadLength']) / completed
+            if ratio >= self.seedRatio:
+                return "seed ratio %.2f reached" % ratio
+        if self.idleRuns is not None and self.idle.get(gid, 0) >= self.idleRuns:
+            return "nothing uploaded in %d runs" % self.idle[gid]
+        return None
+
+    def readPeerCaps(self, gids):
+        '''
+        Remember the bt-max-peers of downloads seen for the first time, in one multicall.
+        '''
+        gids = [gid for gid in gids if 'bt-max-peers' not in self.applied.get(gid, {})]
+        if not gids:
+            return
+        for gid, options in zip(gids, self.client.getOptions(gids)):
+            if isinstance(options, Exception):
+                logger.debug("getOption(%s) failed: %s", gid, options)
+                continue
+            self.applied.setdefault(gid, {})['bt-max-peers'] = int(options.get('bt-max-peers',
+                                                                                DEFAULT_ARIA_MAX_PEERS))
+
+    def tuneDownload(self, status, peers):
+        '''
+        return: dict, bt-max-peers and bt-request-peer-speed-limit for a downloading torrent.
+        '''
+        gid = status['gid']
+        cap = self.applied.get(gid, {}).get('bt-max-peers', DEFAULT_ARIA_MAX_PEERS)
+        useful = sum(1 for peer in peers if int(peer['downloadSpeed']) > 0)
+        if cap and peers and len(peers) >= 0.9 * cap and useful >= USEFUL_PEERS_RAISE * len(peers):
+            # Saturated with peers that deliver, more of them should help
+            cap = max(cap, min(self.maxPeers, int(cap * PEER_CAP_FACTOR)))
+        elif len(peers) >= self.minPeers and useful < USEFUL_PEERS_LOWER * len(peers):
+            # Mostly idle connections, free the slots for other torrents
+            cap = max(self.minPeers, int((cap or len(peers)) / PEER_CAP_FACTOR))
+        request_speed = max(self.minRequestSpeed, int(int(status['downloadSpeed']) * REQUEST_SPEED_HEADROOM))
+        return {'bt-max-peers': cap, 'bt-request-peer-speed-limit': request_speed}
+
+    def uploadShares(self, torrents, peers):
+        '''
+        return: dict, GID -> max-upload-limit, empty without an upload budget.
+        '''
+        if not self.uploadBudget or not torrents:
+            return {}
+        weights = {}
+        for status in torrents:
+            if self.isSeeding(status):
+                # Connected seeders take nothing, leechers are the demand
+                leechers = sum(1 for peer in peers[status['gid']] if peer.get('seeder') != 'true')
+                weights[status['gid']] = float(max(1, leechers))
+            else:
+                weights[status['gid']] = float(max(1, len(peers[status['gid']])))
+        total = sum(weights.values())
+        return dict((gid, max(1024, int(self.uploadBudget * weight / total))) for gid, weight in weights.items())
+
+    def apply(self, gid, options):
+        previous = self.applied.setdefault(gid, {})
+        changed = dict((name, value) for name, value in options.items()
+                       if significantChange(previous.get(name), value))
+        if not changed:
+            return
+        try:
+            self.client.changeOption(gid, dict((name, str(value)) for name, value in changed.items()))
+        except Exception as e:
+            logger.debug("changeOption(%s) failed: %s", gid, e)
+            return
+        previous.update(changed)
@@ -0,0 +1,367 @@
+'''
+Capture and replay of RPC traffic.
+
+RPCRecorder, attached to a PyAria2 client, logs every call it sends
+(method, params, start time, duration, response size as read by the HTTP
+transport) as gzipped JSON lines. Secret tokens, passwords and credential
+headers passed in options are never written, see scrubParams. replay
+drives a daemon, or a local StandInServer, with the recorded call mix at
+the original pace or faster and reports latency percentiles and throughput:
+
+    python -m pyaria2.traffic calls.log.gz --uri http://localhost:6800/rpc --speed 10
+    python -m pyaria2.traffic calls.log.gz --stand-in
+'''
+
+# -*- coding: utf-8 -*-
+
+import argparse
+import base64
+import gzip
+import json
+import logging
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+
+import xmlrpc.client as xmlrpclib
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PREFIX = 'token:'
+REDACTED = '<redacted>'
+# Options carrying credentials besides the *-passwd ones (http-passwd, all-proxy-passwd...)
+SECRET_OPTIONS = frozenset(['rpc-secret'])
+SECRET_HEADERS = frozenset(['authorization', 'proxy-authorization', 'cookie'])
+DEFAULT_WORKERS = 8
+
+
+def encodeValue(value):
+    if isinstance(value, xmlrpclib.Binary):
+        return {'__binary__': base64.b64encode(value.data).decode('ascii')}
+    raise TypeError("%r can not be recorded" % (value,))
+
+
+def decodeValue(value):
+    if '__binary__' in value:
+        return xmlrpclib.Binary(base64.b64decode(value['__binary__']))
+    return value
+
+
+def redactHeader(header):
+    name, separator, _ = header.partition(':')
+    if separator and name.strip().lower() in SECRET_HEADERS:
+        return '%s: %s' % (name, REDACTED)
+    return header
+
+
+def redactOptions(options):
+    '''
+    return: copy of an options dict with passwords and credential headers replaced by REDACTED.
+    '''
+    redacted = {}
+    for name, value in options.items():
+        if name.endswith('passwd') or name in SECRET_OPTIONS:
+            value = REDACTED
+        elif name == 'header':
+            value = [redactHeader(header) for header in value] if isinstance(value, list) else redactHeader(value)
+        redacted[name] = value
+    return redacted
+
+
+def scrubParams(method, params):
+    '''
+    return: params without the secret token and with redacted options (see redactOptions),
+            also inside system.multicall calls.
+    '''
+    params = list(params)
+    if params and isinstance(params[0], str) and params[0].startswith(TOKEN_PREFIX):
+        params = params[1:]
+    if method == 'system.multicall' and params:
+        params[0] = [dict(call, params=scrubParams(call['methodName'], call['params'])) for call in params[0]]
+        return params
+    return [redactOptions(param) if isinstance(param, dict) else param for param in params]
+
+
+def addToken(method, params, token):
+    if not token:
+        return list(params)
+    if method == 'system.multicall':
+        return [[dict(call, params=addToken(call['methodName'], call['params'], token)) for call in params[0]]]
+    if method.startswith('system.'):
+        return list(params)
+    return list(token) + list(params)
+
+
+class _ResponseSize(object):
+    '''
+    Transport mixin storing the size of every response body into sizes.size, a threading.local.
+    '''
+
+    def __init__(self, sizes, *args, **kwargs):
+        super(_ResponseSize, self).__init__(*args, **kwargs)
+        self.sizes = sizes
+
+    def parse_response(self, response):
+        length = response.getheader('Content-Length') if hasattr(response, 'getheader') else None
+        if length is None:
+            response = _CountingResponse(response)
+        try:
+            return super(_ResponseSize, self).parse_response(response)
+        finally:
+            self.sizes.size = int(length) if length is not None else response.size
+
+
+class _CountingResponse(object):
+    def __init__(self, response):
+        self.response = response
+        self.size = 0
+
+    def read(self, amount=None):
+        data = self.response.read(amount)
+        self.size += len(data)
+        return data
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+
+class MeasuringTransport(_ResponseSize, xmlrpclib.Transport):
+    pass
+
+
+class MeasuringSafeTransport(_ResponseSize, xmlrpclib.SafeTransport):
+    pass
+
+
+class RPCRecorder(object):
+    '''
+    Writes one compact JSON line per RPC call into a gzip file.
+
+    Fields: t (start, seconds since the recorder was created), m (method),
+    p (params without token and secrets), d (duration in seconds), s (response size in
+    bytes, as received) and e (error, if the call failed).
+
+    Attach it to clients with attach, which also gives them a transport
+    measuring response sizes.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.started = time.time()
+        self.count = 0
+        self._file = gzip.open(path, 'wt')
+        self._lock = threading.Lock()
+        self._sizes = threading.local()
+
+    def attach(self, client):
+        '''
+        Record every call client sends from now on.
+
+        :type client: PyAria2
+        '''
+        client.recorder = self
+        client.setServer(client.serverUri)
+        return client
+
+    def transportFor(self, server_uri):
+        '''
+        return: transport for server_uri storing response sizes where record finds them.
+        '''
+        if server_uri.startswith('https:'):
+            return MeasuringSafeTransport(self._sizes)
+        return MeasuringTransport(self._sizes)
+
+    def record(self, method, params, start, duration, error=None):
+        # Sizes are per thread, as is the transport call that stored it
+        size, self._sizes.size = getattr(self._sizes, 'size', None), None
+        entry = {
+            't': round(start - self.started, 6),
+            'm': method,
+            'p': scrubParams(method, params),
+            'd': round(duration, 6),
+        }
+        if error is not None:
+            entry['e'] = error.faultString if isinstance(error, xmlrpclib.Fault) else type(error).__name__
+        elif size is not None:
+            entry['s'] = size
+        line = json.dumps(entry, separators=(',', ':'), default=encodeValue)
+        with self._lock:
+            self._file.write(line + '\n')
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def loadRecording(path):
+    '''
+    return: list of recorded calls, as dicts, in start order.
+    '''
+    with gzip.open(path, 'rt') as fileobj:
+        calls = [json.loads(line, object_hook=decodeValue) for line in fileobj if line.strip()]
+    calls.sort(key=lambda call: call['t'])
+    return calls
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+class ReplayReport(object):
+    def __init__(self, latencies, errors, elapsed, methods):
+        self.latencies = sorted(latencies)
+        self.errors = errors
+        self.elapsed = elapsed
+        self.methods = methods
+
+    @property
+    def calls(self):
+        return len(self.latencies)
+
+    @property
+    def throughput(self):
+        return self.calls / self.elapsed if self.elapsed else 0.0
+
+    def percentile(self, fraction):
+        return percentile(self.latencies, fraction)
+
+    def __str__(self):
+        lines = ['%d calls in %.2fs, %.1f calls/s, %d errors' % (self.calls, self.elapsed, self.throughput,
+                                                                  self.errors)]
+        lines.append('latency ms: p50 %.2f  p90 %.2f  p99 %.2f  max %.2f' % tuple(
+            1000 * self.percentile(fraction) for fraction in (0.5, 0.9, 0.99, 1.0)))
+        for method, count in sorted(self.methods.items(), key=lambda item: -item[1]):
+            lines.append('  %-28s %d' % (method, count))
+        return '\n'.join(lines)
+
+
+def replay(calls, server_uri, speed=1.0, workers=DEFAULT_WORKERS, secret=None):
+    '''
+    Send recorded calls to server_uri.
+
+    calls: list, as returned by loadRecording
+    speed: float, 1 keeps the recorded pace, 10 is ten times faster, 0 sends as fast as possible
+    secret: string, RPC secret of the target daemon
+
+    Latencies are measured from the time each call was due, so they include
+    the time it waited for a free worker.
+
+    return: ReplayReport
+    '''
+    token = (TOKEN_PREFIX + secret,) if secret is not None else ()
+    local = threading.local()
+    latencies, methods = [], {}
+    errors = [0]
+    lock = threading.Lock()
+
+    def send(call, scheduled):
+        if not hasattr(local, 'server'):
+            # ServerProxy is not thread safe, one per worker
+            local.server = xmlrpclib.ServerProxy(server_uri, allow_none=True)
+        try:
+            getattr(local.server, call['m'])(*addToken(call['m'], call['p'], token))
+            failed = False
+        except (OSError, xmlrpclib.Error):
+            failed = True
+        # From when the call was due, time spent queued behind busy workers included
+        latency = time.time() - scheduled
+        with lock:
+            latencies.append(latency)
+            methods[call['m']] = methods.get(call['m'], 0) + 1
+            errors[0] += failed
+
+    started = time.time()
+    with ThreadPoolExecutor(workers) as pool:
+        for call in calls:
+            scheduled = time.time()
+            if speed:
+                scheduled = started + call['t'] / speed
+                if scheduled > time.time():
+                    time.sleep(scheduled - time.time())
+            pool.submit(send, call, scheduled)
+    return ReplayReport(latencies, errors[0], time.time() - started, methods)
+
+
+class _ThreadingServer(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+class _QuietHandler(SimpleXMLRPCRequestHandler):
+    rpc_paths = ('/rpc',)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(object):
+    '''
+    Local XML-RPC server answering any aria2 method with a response as large
+    as the recorded ones, to exercise the client side without a daemon.
+    '''
+
+    def __init__(self, calls=(), host='localhost', port=0):
+        sizes = {}
+        for call in calls:
+            if 's' in call:
+                sizes.setdefault(call['m'], []).append(call['s'])
+        self.sizes = dict((method, sum(values) // len(values)) for method, values in sizes.items())
+        self.server = _ThreadingServer((host, port), requestHandler=_QuietHandler, allow_none=True,
+                                       logRequests=False)
+        self.server.register_instance(self)
+        self._thread = None
+
+    @property
+    def uri(self):
+        host, port = self.server.server_address[:2]
+        return 'http://%s:%d/rpc' % (host, port)
+
+    def _dispatch(self, method, params):
+        if method == 'system.multicall':
+            return [[self._dispatch(call['methodName'], call['params'])] for call in params[0]]
+        # Roughly the recorded size, the XML-RPC envelope takes about 100 bytes
+        return 'x' * max(0, self.sizes.get(method, 0) - 100)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='StandInServer')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay RPC traffic recorded by RPCRecorder.")
+    parser.add_argument("recording")
+    parser.add_argument("--uri", dest="uri", default="http://localhost:6800/rpc")
+    parser.add_argument("--stand-in", dest="stand_in", action="store_true",
+                        help="replay against a local stand-in server instead of --uri")
+    parser.add_argument("--speed", dest="speed", default=1.0, type=float)
+    parser.add_argument("--workers", dest="workers", default=DEFAULT_WORKERS, type=int)
+    parser.add_argument("--secret", dest="secret", default=None)
+    args = parser.parse_args(argv)
+
+    calls = loadRecording(args.recording)
+    stand_in = None
+    uri = args.uri
+    if args.stand_in:
+        stand_in = StandInServer(calls).start()
+        uri = stand_in.uri
+    try:
+        print(replay(calls, uri, args.speed, args.workers, args.secret))
+    finally:
+        if stand_in is not None:
+            stand_in.stop()
+
+
+if __name__ == '__main__':
+    main()
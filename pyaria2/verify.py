@@ -0,0 +1,222 @@
+'''
+Post-download verification against our own checksum manifests.
+
+aria2 only checks the checksums carried by the download itself (error 32).
+Verifier takes completed results, from tellStopped or handed over by the
+caller, hashes their files in a process pool with memory-mapped, chunked
+reads (several algorithms in one pass) and reports mismatches, optionally
+adding the download again.
+'''
+
+# -*- coding: utf-8 -*-
+
+import hashlib
+import logging
+import mmap
+import os
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from .periodic import PeriodicTask
+from .pyaria2 import effectiveStatus
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_INTERVAL = 10
+DEFAULT_PAGE_SIZE = 100
+# GIDs remembered as verified, in pages: the newest ones and room for results fed to verify between runs
+SEEN_PAGES = 2
+
+RESULT_KEYS = ['gid', 'status', 'totalLength', 'completedLength', 'dir', 'files']
+
+
+def hashFile(path, algorithms=('sha256',), chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    Hash a file with every algorithm of algorithms in a single pass.
+
+    The file is memory-mapped and fed to the hashes chunk by chunk, without
+    copying it into Python objects.
+
+    return: dict, algorithm -> hex digest.
+    '''
+    hashers = [(algorithm, hashlib.new(algorithm)) for algorithm in algorithms]
+    with open(path, 'rb') as fileobj:
+        size = os.fstat(fileobj.fileno()).st_size
+        if size:
+            with mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if hasattr(mapped, 'madvise'):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                view = memoryview(mapped)
+                try:
+                    for offset in range(0, size, chunk_size):
+                        chunk = view[offset:offset + chunk_size]
+                        for _, hasher in hashers:
+                            hasher.update(chunk)
+                        chunk.release()
+                finally:
+                    view.release()
+    return dict((algorithm, hasher.hexdigest()) for algorithm, hasher in hashers)
+
+
+class VerificationResult(object):
+    def __init__(self, gid, path, expected, actual=None, error=None):
+        self.gid = gid
+        self.path = path
+        self.expected = expected
+        self.actual = actual or {}
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None and all(self.actual.get(algorithm) == digest.lower()
+                                           for algorithm, digest in self.expected.items())
+
+    def __repr__(self):
+        return '<VerificationResult %s %s %s>' % (self.gid, self.path, 'ok' if self.ok else 'MISMATCH')
+
+
+class Verifier(PeriodicTask):
+    '''
+    Verifies completed downloads against a manifest.
+
+    manifest: dict mapping a file path to {algorithm: hex digest}, or a
+        function taking the path and returning such a dict (None or empty
+        for files that are not to be verified).
+    on_result: function called with every VerificationResult.
+    requeue: bool, add downloads with mismatching files again (over the
+        same URIs, overwriting the bad files).
+
+    Each run (see PeriodicTask) pages backwards through the stopped
+    downloads, page_size at a time, until it reaches the newest ones of the
+    previous run (or the oldest one), and verifies the completed ones not seen
+    before; verify can be fed results directly instead, e.g. from completion
+    notifications. Only the most recently seen GIDs are remembered (SEEN_PAGES
+    pages), older ones are behind the point runs stop at.
+    '''
+
+    def __init__(self, manifest, client=None, on_result=None, requeue=False, workers=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE, interval=DEFAULT_INTERVAL, page_size=DEFAULT_PAGE_SIZE):
+        '''
+        :type client: PyAria2
+        workers: integer, hashing processes, defaults to the number of CPUs
+        '''
+        super(Verifier, self).__init__(interval)
+        self.manifest = manifest
+        self.client = client
+        self.onResult = on_result
+        self.requeue = requeue
+        self.chunkSize = chunk_size
+        self.pageSize = page_size
+        self.pool = ProcessPoolExecutor(workers)
+        self.seen = OrderedDict()
+        # GIDs of the newest page of the previous run, paging stops there
+        self.marks = set()
+
+    def expected(self, path):
+        if callable(self.manifest):
+            return self.manifest(path)
+        return self.manifest.get(path)
+
+    def runOnce(self):
+        fresh, marks, stopped = OrderedDict(), None, None
+        # A negative offset counts back from the most recently stopped download
+        offset = -1
+        while True:
+            page = self.client.tellStopped(offset, self.pageSize, RESULT_KEYS)
+            if marks is None:
+                marks = set(result['gid'] for result in page)
+            reached = False
+            for result in page:
+                if result['gid'] in self.marks:
+                    reached = True
+                    break
+                if result['gid'] not in self.seen:
+                    fresh.setdefault(result['gid'], result)
+            if reached or len(page) < self.pageSize:
+                break
+            if stopped is None:
+                stopped = int(self.client.getGlobalStat()['numStopped'])
+            offset -= self.pageSize
+            if -offset > stopped:
+                break
+        self.marks = marks
+        # Oldest first, so the newest are the last forgotten
+        self.verify(list(fresh.values())[::-1])
+
+    def verify(self, results):
+        '''
+        Hash the files of completed results that the manifest knows about.
+
+        results: list of dict, as returned by tellStatus/tellStopped with at least gid, status and files
+                 (and totalLength and completedLength for torrents removed after seeding)
+
+        return: list of VerificationResult.
+        '''
+        jobs = []
+        for result in results:
+            self.seen[result['gid']] = True
+            self.seen.move_to_end(result['gid'])
+            if effectiveStatus(result) != 'complete':
+                continue
+            for entry in result.get('files', []):
+                if entry.get('selected', 'true') != 'true':
+                    continue
+                expected = self.expected(entry['path'])
+                if not expected:
+                    continue
+                future = self.pool.submit(hashFile, entry['path'], tuple(expected), self.chunkSize)
+                jobs.append((result, entry, expected, future))
+        while len(self.seen) > SEEN_PAGES * self.pageSize:
+            self.seen.popitem(last=False)
+
+        verified = []
+        mismatched = []
+        for result, entry, expected, future in jobs:
+            try:
+                outcome = VerificationResult(result['gid'], entry['path'], expected, actual=future.result())
+            except Exception as e:
+                outcome = VerificationResult(result['gid'], entry['path'], expected, error=e)
+            if not outcome.ok:
+                logger.warning("Verification of %s (%s) failed: %s", entry['path'], result['gid'],
+                               outcome.error or outcome.actual)
+                mismatched.append(entry)
+            if self.onResult is not None:
+                self.onResult(outcome)
+            verified.append(outcome)
+
+        if self.requeue and self.client is not None and mismatched:
+            self.requeueFiles(mismatched)
+        return verified
+
+    def requeueFiles(self, entries):
+        '''
+        Add files again, over the URIs aria2 reported for them, in one multicall.
+        Going through a batch also bypasses the client's dedup index, which knows these URIs.
+
+        entries: list of dict, file entries as found in the "files" of tellStatus
+
+        return: list of new GIDs (or xmlrpc Faults).
+        '''
+        batch = self.client.batch()
+        for entry in entries:
+            uris = []
+            for uri in entry.get('uris', []):
+                if uri['uri'] not in uris:
+                    uris.append(uri['uri'])
+            if not uris:
+                logger.warning("Can not requeue %s, aria2 reported no URIs for it", entry['path'])
+                continue
+            batch.addUri(uris, {
+                'dir': os.path.dirname(entry['path']),
+                'out': os.path.basename(entry['path']),
+                'allow-overwrite': 'true',
+            })
+        if not len(batch):
+            return []
+        return batch.execute()
+
+    def close(self):
+        self.stop()
+        self.pool.shutdown()
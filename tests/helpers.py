@@ -0,0 +1,163 @@
+'''
+Fakes shared by the tests of the client and of the modules built on it.
+'''
+
+import tempfile
+
+from collections import OrderedDict
+
+import xmlrpc.client as xmlrpclib
+
+from pyaria2.pyaria2 import AriaServerSettings, PyAria2
+
+STOPPED_STATUSES = ('complete', 'error', 'removed')
+
+
+class FakeMethod(object):
+    def __init__(self, server, name):
+        self.server, self.name = server, name
+
+    def __call__(self, *params):
+        self.server.calls.append((self.name, params))
+        return self.server.dispatch(self.name, params)
+
+
+class FakeServer(object):
+    '''
+    Answers XML-RPC calls from handlers, a dict mapping the RPC method name
+    to a function taking the params without token. Handlers raise
+    xmlrpclib.Fault to fail a call, also inside a system.multicall. Methods
+    without handler answer OK, or fail when their last param is 'bad'.
+    '''
+
+    def __init__(self, handlers=None):
+        self.calls = []
+        self.handlers = dict(handlers or {})
+
+    def __getattr__(self, name):
+        return FakeMethod(self, name)
+
+    def dispatch(self, name, params, default='OK'):
+        if name == 'system.multicall':
+            responses = []
+            for call in params[0]:
+                try:
+                    responses.append([self.dispatch(call['methodName'], call['params'], 'ok')])
+                except xmlrpclib.Fault as e:
+                    responses.append({'faultCode': e.faultCode, 'faultString': e.faultString})
+            return responses
+        if params and isinstance(params[0], str) and params[0].startswith('token:'):
+            params = params[1:]
+        if name in self.handlers:
+            return self.handlers[name](*params)
+        if params and params[-1] == 'bad':
+            raise xmlrpclib.Fault(1, 'boom')
+        return default
+
+    def multicalls(self, name=None):
+        '''
+        return: list of the method names sent in each system.multicall, or of their params for method name.
+        '''
+        sent = [call[1][0] for call in self.calls if call[0] == 'system.multicall']
+        if name is None:
+            return [[call['methodName'] for call in calls] for calls in sent]
+        return [[call['params'] for call in calls if call['methodName'] == name] for calls in sent]
+
+
+def makeClient(secret=None, handlers=None, **kwargs):
+    '''
+    return: PyAria2 client sending its calls to a FakeServer, which is client.server.
+    '''
+    client = PyAria2(AriaServerSettings(rpc_secret=secret), start_server=False, **kwargs)
+    client.server = FakeServer(handlers)
+    return client
+
+
+class FakeDaemon(object):
+    '''
+    Downloads behind the FakeServer of a makeClient client.
+
+    downloads maps each GID, in the order they were added, to its status
+    dict. Downloads added with addUri (also recorded in added) and
+    addMetalink start active with nothing known about them; tests change
+    their status dicts to move them on. stopped results are created
+    complete and error in turn. GIDs in stuck can not be removed from the
+    results. handlers are added to, or replace, those of the daemon.
+    '''
+
+    TRANSITIONS = {'aria2.pause': 'paused', 'aria2.unpause': 'waiting', 'aria2.remove': 'removed'}
+
+    def __init__(self, stopped=0, handlers=None):
+        self.downloads = OrderedDict()
+        self.added = []
+        self.stuck = set()
+        for i in range(stopped):
+            gid = self.add()
+            self.downloads[gid].update(status='error' if i % 2 else 'complete', errorCode=str(i % 2),
+                                       totalLength='10', completedLength='10',
+                                       files=[{'path': '/tmp/f%d' % i, 'length': '10', 'completedLength': '10'}])
+        daemonHandlers = {
+            'aria2.getGlobalOption': lambda: {'dir': tempfile.gettempdir()},
+            'aria2.getGlobalStat': self.getGlobalStat,
+            'aria2.addUri': self.addUri,
+            'aria2.addMetalink': lambda metalink, options=None, position=None: [self.add(), self.add()],
+            'aria2.tellStatus': self.tellStatus,
+            'aria2.tellActive': lambda keys=None: self.select(('active',)),
+            'aria2.tellWaiting': lambda offset, num, keys=None: self.page(('waiting', 'paused'), offset, num),
+            'aria2.tellStopped': lambda offset, num, keys=None: self.page(STOPPED_STATUSES, offset, num),
+            'aria2.removeDownloadResult': self.removeDownloadResult,
+        }
+        for method in self.TRANSITIONS:
+            daemonHandlers[method] = lambda gid, method=method: self.change(method, gid)
+        daemonHandlers.update(handlers or {})
+        self.client = makeClient(handlers=daemonHandlers)
+
+    @property
+    def stopped(self):
+        return self.select(STOPPED_STATUSES)
+
+    def add(self):
+        gid = 'gid%d' % len(self.downloads)
+        self.downloads[gid] = {'gid': gid, 'status': 'active', 'totalLength': '0', 'completedLength': '0',
+                               'files': []}
+        return gid
+
+    def addUri(self, uris, options=None, position=None):
+        if 'bad' in uris:
+            raise xmlrpclib.Fault(1, 'boom')
+        self.added.append(uris)
+        return self.add()
+
+    def select(self, statuses):
+        return [dict(status) for status in self.downloads.values() if status['status'] in statuses]
+
+    def page(self, statuses, offset, num):
+        selected = self.select(statuses)
+        if offset < 0:
+            # Counted back from the last one, in reverse order
+            start = len(selected) + offset
+            return [selected[i] for i in range(start, max(start - num, -1), -1)]
+        return selected[offset:offset + num]
+
+    def getGlobalStat(self):
+        return {'numActive': str(len(self.select(('active',)))),
+                'numWaiting': str(len(self.select(('waiting', 'paused')))),
+                'numStopped': str(len(self.stopped))}
+
+    def tellStatus(self, gid, keys=None):
+        if gid not in self.downloads:
+            raise xmlrpclib.Fault(1, 'GID %s is not found' % gid)
+        status = self.downloads[gid]
+        return dict((key, status[key]) for key in keys if key in status) if keys else dict(status)
+
+    def change(self, method, gid):
+        if self.downloads[gid]['status'] == 'complete':
+            raise xmlrpclib.Fault(1, 'GID %s is complete' % gid)
+        self.downloads[gid]['status'] = self.TRANSITIONS[method]
+        return gid
+
+    def removeDownloadResult(self, gid):
+        if gid in self.stuck or self.downloads.get(gid, {}).get('status') not in STOPPED_STATUSES:
+            raise xmlrpclib.Fault(1, 'Could not remove download result of GID#%s' % gid)
+        del self.downloads[gid]
+        return 'OK'
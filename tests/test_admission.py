@@ -0,0 +1,113 @@
+import os
+import tempfile
+import unittest
+
+import xmlrpc.client as xmlrpclib
+
+from pyaria2.admission import AdmissionController, DiskSpaceLedger, bdecode, torrentLength
+from tests.helpers import FakeDaemon
+
+
+class FixedLedger(DiskSpaceLedger):
+    def __init__(self, free):
+        super(FixedLedger, self).__init__()
+        self.freeBytes = free
+
+    def free(self, path):
+        return self.freeBytes
+
+
+class TestBencode(unittest.TestCase):
+    def test_decode(self):
+        self.assertEqual(bdecode(b'd1:ai42e1:bl2:xyee')[0], {b'a': 42, b'b': [b'xy']})
+
+    def test_torrentLength(self):
+        self.assertGreater(torrentLength("tests/with_torrents/nisemono.torrent"), 0)
+
+
+class TestAdmissionController(unittest.TestCase):
+    def test_holdAndRelease(self):
+        daemon = FakeDaemon()
+        controller = AdmissionController(daemon.client, FixedLedger(100))
+        first = controller.addUri(["http://a/1"], size=80)
+        second = controller.addUri(["http://a/2"], size=50)
+        self.assertEqual(first.gid, 'gid0')
+        self.assertTrue(second.held)
+        self.assertEqual(len(controller.pending), 1)
+
+        daemon.downloads['gid0']['status'] = 'complete'
+        controller.poll()
+        self.assertEqual(second.gid, 'gid1')
+        self.assertEqual(daemon.added, [["http://a/1"], ["http://a/2"]])
+
+    def test_failedHeldSubmission(self):
+        daemon = FakeDaemon()
+        controller = AdmissionController(daemon.client, FixedLedger(100))
+        controller.addUri(["http://a/1"], size=80)
+        second = controller.addUri(["http://a/2", "bad"], size=50)
+        self.assertTrue(second.held)
+
+        daemon.downloads['gid0']['status'] = 'complete'
+        controller.poll()
+        self.assertFalse(second.held)
+        self.assertIsNone(second.gid)
+        self.assertIsInstance(second.error, xmlrpclib.Fault)
+        self.assertEqual(len(controller.pending), 0)
+
+    def test_reservationShrinksToRemaining(self):
+        daemon = FakeDaemon()
+        ledger = FixedLedger(100)
+        controller = AdmissionController(daemon.client, ledger)
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, "file")
+            with open(path, "wb") as fileobj:
+                fileobj.write(b"x" * 4096)
+            controller.addUri(["http://a/1"], options={'dir': workdir}, size=90)
+            daemon.downloads['gid0'].update(totalLength='10000', files=[
+                {'path': path, 'length': '10000', 'selected': 'true'}])
+            ledger.freeBytes = 10 ** 9
+            controller.poll()
+            device, _ = ledger.filesystem(workdir)
+            self.assertEqual(ledger.reserved(device), 10000 - os.stat(path).st_blocks * 512)
+
+    def test_tooLarge(self):
+        controller = AdmissionController(FakeDaemon().client, FixedLedger(100))
+        self.assertRaises(ValueError, controller.addUri, ["http://a/1"], size=2 ** 70)
+
+    def test_unknownSizeNeedsFreeSpace(self):
+        daemon = FakeDaemon()
+        ledger = FixedLedger(100)
+        controller = AdmissionController(daemon.client, ledger)
+        self.assertFalse(controller.addUri(["http://a/1"], size=100).held)
+        self.assertTrue(controller.addUri(["http://a/2"]).held)
+        ledger.freeBytes = 0
+        controller.release('gid0')
+        self.assertTrue(controller.pending[0].held)
+        ledger.freeBytes = 100
+        controller.poll()
+        self.assertEqual(daemon.added, [["http://a/1"], ["http://a/2"]])
+
+    def test_reservationMovesToFollowers(self):
+        daemon = FakeDaemon()
+        ledger = FixedLedger(100)
+        controller = AdmissionController(daemon.client, ledger)
+        magnet = controller.addUri(["magnet:?xt=urn:btih:0"], size=80)
+        self.assertTrue(magnet.awaitsFollowers)
+        self.assertTrue(controller.addUri(["http://a/x.torrent?y=1"], size=10).awaitsFollowers)
+
+        # Metadata downloads keep their reservation while aria2 reports their small totalLength
+        daemon.downloads['gid0'].update(totalLength='2000')
+        controller.poll()
+        self.assertEqual(ledger.reserved(ledger.filesystem(tempfile.gettempdir())[0]), 90)
+
+        daemon.downloads['gid0'].update(status='complete', followedBy=['gid9'])
+        daemon.downloads['gid9'] = {'gid': 'gid9', 'status': 'active', 'totalLength': '0', 'files': []}
+        controller.poll()
+        self.assertEqual(magnet.gids, ['gid9'])
+        self.assertIs(controller.admitted['gid9'], magnet)
+        self.assertNotIn('gid0', controller.admitted)
+        self.assertEqual(ledger.reserved(ledger.filesystem(tempfile.gettempdir())[0]), 90)
+
+        daemon.downloads['gid9']['status'] = 'complete'
+        controller.poll()
+        self.assertNotIn(magnet, controller.admitted.values())
@@ -0,0 +1,48 @@
+import unittest
+
+from pyaria2.archive import ResultArchive, RetentionPolicy
+from tests.helpers import FakeDaemon
+
+
+class TestRetentionPolicy(unittest.TestCase):
+    def test_purgeKeepsNewest(self):
+        daemon = FakeDaemon(stopped=12)
+        policy = RetentionPolicy(daemon.client, keep=5, page_size=3)
+        self.assertEqual(policy.purge(), 7)
+        self.assertEqual([result['gid'] for result in daemon.stopped], ['gid%d' % i for i in range(7, 12)])
+        self.assertEqual(len(policy.archive), 7)
+        self.assertEqual([len(calls) for calls in daemon.client.server.multicalls()], [3, 3, 1])
+
+    def test_failedRemovalsAreNotCounted(self):
+        daemon = FakeDaemon(stopped=2)
+        daemon.stuck.add('gid0')
+        policy = RetentionPolicy(daemon.client, keep=0)
+        with self.assertLogs('pyaria2.archive', 'WARNING'):
+            self.assertEqual(policy.purge(), 1)
+        self.assertEqual([result['gid'] for result in daemon.stopped], ['gid0'])
+
+    def test_statusOfPurgedResult(self):
+        policy = RetentionPolicy(FakeDaemon(stopped=2).client, keep=0)
+        policy.purge()
+        status = policy.statusOf('gid1')
+        self.assertEqual((status['status'], status['errorCode']), ('error', '1'))
+        self.assertEqual(status['files'][0]['path'], '/tmp/f1')
+        self.assertEqual(policy.statusOf('gid1', ['status']), {'status': 'error'})
+        self.assertIsNone(policy.statusOf('unknown'))
+
+
+class TestResultArchive(unittest.TestCase):
+    def test_storeReplaces(self):
+        archive = ResultArchive()
+        archive.store([{'gid': 'a', 'status': 'removed'}])
+        archive.store([{'gid': 'a', 'status': 'complete'}])
+        self.assertEqual(len(archive), 1)
+        self.assertEqual(archive.lookup('a')['status'], 'complete')
+        self.assertNotIn('errorCode', archive.lookup('a'))
+
+    def test_removedAfterSeedingCountsAsComplete(self):
+        archive = ResultArchive()
+        archive.store([{'gid': 'a', 'status': 'removed', 'totalLength': '10', 'completedLength': '10'},
+                       {'gid': 'b', 'status': 'removed', 'totalLength': '10', 'completedLength': '4'}])
+        self.assertEqual(archive.lookup('a')['status'], 'complete')
+        self.assertEqual(archive.lookup('b')['status'], 'removed')
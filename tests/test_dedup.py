@@ -0,0 +1,112 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import xmlrpc.client as xmlrpclib
+
+from pyaria2.dedup import BloomFilter, DedupIndex, EXACT, NEW, PROBABLE, normalizeUri
+from tests.helpers import makeClient
+
+
+class TestNormalizeUri(unittest.TestCase):
+    def test_equivalentSpellings(self):
+        self.assertEqual(normalizeUri("HTTP://Example.COM:80/a%2fb#frag"), "http://example.com/a%2Fb")
+        self.assertEqual(normalizeUri("https://example.com"), "https://example.com/")
+        self.assertEqual(normalizeUri("http://example.com:8080/x?b=1&a=2"), "http://example.com:8080/x?b=1&a=2")
+
+    def test_magnet(self):
+        self.assertEqual(normalizeUri("magnet:?dn=x&xt=urn:btih:ABCDEF"), "magnet:?xt=urn:btih:abcdef")
+
+
+class TestBloomFilter(unittest.TestCase):
+    def test_addAndContains(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        self.assertFalse(bloom.add("a"))
+        self.assertTrue(bloom.add("a"))
+        self.assertIn("a", bloom)
+        self.assertNotIn("b", bloom)
+        self.assertEqual(bloom.count, 1)
+
+    def test_falsePositiveRate(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(str(i))
+        self.assertLess(bloom.falsePositiveRate(), 0.02)
+        false_positives = sum(1 for i in range(1000, 11000) if str(i) in bloom)
+        self.assertLess(false_positives / 10000.0, 0.03)
+
+    def test_saveLoad(self):
+        bloom = BloomFilter(capacity=100, error_rate=0.01)
+        bloom.add("a")
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, "bloom")
+            bloom.save(path)
+            loaded = BloomFilter.load(path)
+        self.assertIn("a", loaded)
+        self.assertEqual((loaded.numBits, loaded.numHashes, loaded.count), (bloom.numBits, bloom.numHashes, 1))
+
+
+class TestDedupIndex(unittest.TestCase):
+    def test_exactHit(self):
+        index = DedupIndex()
+        self.assertEqual(index.lookup(["http://a/1"]), (NEW, None))
+        index.add(["http://a/1", "http://b/1"], "gid1")
+        self.assertEqual(index.lookup(["http://B/1"]), (EXACT, "gid1"))
+        self.assertEqual(index.falsePositiveRate(), 0.0)
+
+    def test_overflowToBloom(self):
+        index = DedupIndex(exact_limit=2, capacity=100)
+        for i in range(3):
+            index.add("http://a/%d" % i, "gid%d" % i)
+        self.assertIsNotNone(index.bloom)
+        self.assertEqual(index.lookup("http://a/0"), (PROBABLE, None))
+        self.assertEqual(index.lookup("http://a/2"), (EXACT, "gid2"))
+        self.assertEqual(index.stats()["probableHits"], 1)
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, "seen")
+            index = DedupIndex(capacity=100, path=path)
+            index.add("http://a/1", "gid1")
+            index.save()
+            self.assertEqual(DedupIndex(path=path).lookup("http://a/1"), (PROBABLE, None))
+
+    def test_claim(self):
+        index = DedupIndex()
+        self.assertEqual(index.claim(["http://a/1"]), (NEW, None))
+        index.abandon(["http://a/1"])
+        self.assertEqual(index.claim(["http://a/1"]), (NEW, None))
+        index.add(["http://a/1"], "gid1")
+        self.assertEqual(index.claim(["http://a/1"]), (EXACT, "gid1"))
+
+
+class TestDedupAddUri(unittest.TestCase):
+    def test_concurrentAddsSubmitOnce(self):
+        submitted = []
+
+        def addUri(uris, options=None, position=None):
+            submitted.append(uris)
+            time.sleep(0.05)
+            return "gid%d" % len(submitted)
+
+        client = makeClient(handlers={'aria2.addUri': addUri})
+        client.dedupIndex = DedupIndex()
+        gids = []
+        threads = [threading.Thread(target=lambda: gids.append(client.addUri(["http://a/1"]))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(submitted, [["http://a/1"]])
+        self.assertEqual(gids, ["gid1"] * 4)
+
+    def test_failedSubmitReleasesTheClaim(self):
+        def addUri(uris, options=None, position=None):
+            raise xmlrpclib.Fault(1, 'No URI to download')
+
+        client = makeClient(handlers={'aria2.addUri': addUri})
+        client.dedupIndex = DedupIndex()
+        self.assertRaises(xmlrpclib.Fault, client.addUri, ["http://a/1"])
+        self.assertEqual(client.dedupIndex.claim(["http://a/1"]), (NEW, None))
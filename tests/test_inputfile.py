@@ -0,0 +1,64 @@
+import io
+import os
+import tempfile
+import unittest
+
+from pyaria2.inputfile import InputFileCompiler, compileInputFile, fixRecord, isValidGid, makeGid, parseInputFile
+
+
+class TestInputFile(unittest.TestCase):
+    def test_gidIsDeterministic(self):
+        gid = makeGid(["http://a/1"], {"dir": "/tmp"})
+        self.assertTrue(isValidGid(gid))
+        self.assertEqual(gid, makeGid(["http://a/1"], {"dir": "/tmp"}))
+        self.assertNotEqual(gid, makeGid(["http://a/2"], {"dir": "/tmp"}))
+
+    def test_recordSyntax(self):
+        out = io.StringIO()
+        compiler = InputFileCompiler(out)
+        gid = compiler.add(["http://a/1", "http://b/1"], {"max_tries": 3, "pause": True})
+        self.assertEqual(out.getvalue(),
+                         "http://a/1\thttp://b/1\n max-tries=3\n pause=true\n gid=%s\n" % gid)
+
+    def test_duplicateRecordsGetDistinctGids(self):
+        compiler = InputFileCompiler(io.StringIO())
+        gids = list(compiler.extend(["http://a/1", "http://a/1"]))
+        self.assertNotEqual(gids[0], gids[1])
+
+    def test_explicitGid(self):
+        compiler = InputFileCompiler(io.StringIO())
+        self.assertEqual(compiler.add(["http://a/1"], {"gid": "00000000000000ab"}), "00000000000000ab")
+        self.assertRaises(ValueError, compiler.add, ["http://a/2"], {"gid": "00000000000000ab"})
+        self.assertRaises(ValueError, compiler.add, ["http://a/3"], {"gid": "xyz"})
+
+    def test_rejectsNewlines(self):
+        compiler = InputFileCompiler(io.StringIO())
+        self.assertRaises(ValueError, compiler.add, ["http://a/1\n"])
+        self.assertRaises(ValueError, compiler.add, ["http://a/1"], {"out": "a\nb"})
+
+    def test_fixRecord(self):
+        self.assertEqual(fixRecord("http://a"), (["http://a"], {}))
+        self.assertEqual(fixRecord(["http://a", "http://b"]), (["http://a", "http://b"], {}))
+        self.assertEqual(fixRecord(("http://a", {"dir": "x"})), (["http://a"], {"dir": "x"}))
+
+    def test_compileInputFile(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, "input.txt")
+            gids = compileInputFile(("http://a/%d" % i for i in range(3)), path)
+            with open(path) as fileobj:
+                content = fileobj.read()
+        self.assertEqual(len(gids), 3)
+        for gid in gids:
+            self.assertIn(" gid=%s\n" % gid, content)
+
+    def test_parseRoundTrip(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, "input.txt")
+            records = [(["http://a/1", "http://b/1"], {"dir": "/x", "header": ["A: 1", "B: 2"]}),
+                       (["http://a/2"], {})]
+            gids = compileInputFile(records, path)
+            parsed = list(parseInputFile(path))
+        self.assertEqual(parsed, [
+            (["http://a/1", "http://b/1"], {"dir": "/x", "header": ["A: 1", "B: 2"], "gid": gids[0]}),
+            (["http://a/2"], {"gid": gids[1]}),
+        ])
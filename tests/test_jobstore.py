@@ -0,0 +1,96 @@
+import tempfile
+import unittest
+
+import xmlrpc.client as xmlrpclib
+
+from pyaria2.dedup import DedupIndex
+from pyaria2.jobstore import JobStore, JobTracker
+from tests.helpers import FakeDaemon
+
+
+class TestJobStore(unittest.TestCase):
+    def test_queries(self):
+        store = JobStore()
+        store.record(['a', 'b'], job='1', tags=['nightly', 'video'], owner='ann', options={'dir': '/d'})
+        store.record(['c'], job='2', tags=['video'], owner='bob')
+        self.assertEqual(store.gids(job='1'), ['a', 'b'])
+        self.assertEqual(store.gids(tag='video'), ['a', 'b', 'c'])
+        self.assertEqual(store.gids(tag='video', owner='bob'), ['c'])
+        self.assertEqual(store.gids(statuses=['active']), [])
+        download = store.get('a')
+        self.assertEqual((download['job'], download['options'], download['tags']),
+                         ('1', {'dir': '/d'}, ['nightly', 'video']))
+        store.updateStatuses([{'gid': 'a', 'status': 'active'}, {'gid': 'unknown', 'status': 'active'}])
+        self.assertEqual(store.gids(job='1', statuses=['active']), ['a'])
+        store.forget(['a'])
+        self.assertIsNone(store.get('a'))
+        self.assertEqual(store.gids(tag='nightly'), ['b'])
+        self.assertEqual(len(store), 2)
+
+    def test_follow(self):
+        store = JobStore()
+        store.record(['a'], job='1', tags=['video'], owner='ann', method='addUri', options={'dir': '/d'})
+        self.assertEqual(store.follow([('b', 'a'), ('c', 'unknown')]), 1)
+        self.assertEqual(store.follow([('b', 'a')]), 0)
+        follower = store.get('b')
+        self.assertEqual((follower['job'], follower['owner'], follower['tags'], follower['options']),
+                         ('1', 'ann', ['video'], {'dir': '/d'}))
+        self.assertIsNone(store.get('c'))
+
+
+class TestJobTracker(unittest.TestCase):
+    def test_groupOperations(self):
+        daemon = FakeDaemon()
+        tracker = JobTracker(daemon.client)
+        first = tracker.addUri(['http://a/1'], job='1', owner='ann')
+        second = tracker.addUri(['http://a/2'], job='1')
+        with tempfile.NamedTemporaryFile(suffix='.meta4') as metalink:
+            others = tracker.addMetalink(metalink.name, job='2', tags=['big'])
+        self.assertEqual(tracker.store.gids(job='2'), others)
+
+        daemon.downloads[second]['status'] = 'complete'
+        self.assertEqual(tracker.refresh(), 4)
+        results = tracker.pauseJob(job='1')
+        self.assertEqual(results, {first: first})
+        self.assertEqual(daemon.client.server.multicalls('aria2.pause')[-1], [[first]])
+        self.assertEqual(tracker.store.get(first)['status'], 'paused')
+
+        self.assertEqual(tracker.unpauseJob(owner='ann'), {first: first})
+        self.assertEqual(sorted(tracker.removeJob(tag='big')), sorted(others))
+        self.assertEqual([daemon.downloads[gid]['status'] for gid in others], ['removed', 'removed'])
+        self.assertEqual(tracker.removeJob(tag='big'), {})
+        self.assertRaises(ValueError, tracker.pauseJob)
+
+    def test_duplicateKeepsLabels(self):
+        daemon = FakeDaemon()
+        daemon.client.dedupIndex = DedupIndex()
+        tracker = JobTracker(daemon.client)
+        gid = tracker.addUri(['http://a/1'], job='1', tags=['video'], owner='ann')
+        self.assertEqual(tracker.addUri(['http://a/1'], job='2', tags=['other'], owner='bob'), gid)
+        self.assertEqual(len(daemon.downloads), 1)
+        download = tracker.store.get(gid)
+        self.assertEqual((download['job'], download['tags'], download['owner']), ('1', ['video'], 'ann'))
+        self.assertEqual(tracker.store.gids(job='2'), [])
+
+    def test_faultsAreReturned(self):
+        daemon = FakeDaemon()
+        tracker = JobTracker(daemon.client)
+        gids = [tracker.addUri(['http://a/%d' % i], job='1') for i in range(2)]
+        daemon.downloads[gids[1]]['status'] = 'complete'
+        results = tracker.removeJob(job='1')
+        self.assertEqual(results[gids[0]], gids[0])
+        self.assertIsInstance(results[gids[1]], xmlrpclib.Fault)
+        self.assertEqual(tracker.store.get(gids[1])['status'], 'waiting')
+
+    def test_followersGetTheLabels(self):
+        daemon = FakeDaemon()
+        tracker = JobTracker(daemon.client)
+        magnet = tracker.addUri(['magnet:?xt=urn:btih:0'], job='1', tags=['big'])
+        payload = daemon.add()
+        daemon.downloads[magnet].update(status='complete', followedBy=[payload])
+        daemon.downloads[payload]['status'] = 'active'
+        tracker.refresh()
+        self.assertEqual(tracker.store.gids(job='1', statuses=['active']), [payload])
+        self.assertEqual(tracker.store.get(payload)['tags'], ['big'])
+        self.assertEqual(tracker.pauseJob(tag='big'), {payload: payload})
+        self.assertEqual(daemon.downloads[payload]['status'], 'paused')
@@ -0,0 +1,57 @@
+import unittest
+
+from pyaria2.mirrors import HostScore, MirrorOptimizer
+from pyaria2.ratelimit import TokenBucket
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.changes = []
+
+    def tellActive(self, keys=None):
+        return [{'gid': 'gid1', 'files': [{'index': '1', 'uris': [
+            {'uri': 'http://slow/f', 'status': 'used'},
+            {'uri': 'http://mid/f', 'status': 'waiting'},
+            {'uri': 'http://fast/f', 'status': 'waiting'},
+        ]}]}]
+
+    def getServers(self, gid):
+        return [{'index': '1', 'servers': [
+            {'uri': 'http://slow/f', 'currentUri': 'http://cdn/f', 'downloadSpeed': '10'},
+            {'uri': 'http://mid/f', 'currentUri': 'http://mid/f', 'downloadSpeed': '1000'},
+            {'uri': 'http://fast/f', 'currentUri': 'http://fast/f', 'downloadSpeed': '5000'},
+        ]}]
+
+    def changeUri(self, gid, fileIndex, delUris, addUris, position=None):
+        self.changes.append((gid, fileIndex, delUris, addUris, position))
+        return [len(delUris), len(addUris)]
+
+
+class TestMirrorOptimizer(unittest.TestCase):
+    def test_dropsSlowAndReorders(self):
+        client = FakeClient()
+        optimizer = MirrorOptimizer(client, rpc_rate=1000, min_samples=2)
+        optimizer.runOnce()
+        self.assertEqual(client.changes, [])
+        optimizer.runOnce()
+        self.assertEqual(client.changes, [
+            ('gid1', 1, ['http://slow/f', 'http://mid/f', 'http://fast/f'], ['http://fast/f', 'http://mid/f'], 0)])
+
+    def test_keepsLastSource(self):
+        optimizer = MirrorOptimizer(FakeClient(), min_samples=1)
+        optimizer.scores.clear()
+        for host, speed in (('a', 10), ('b', 1000), ('c', 1000)):
+            optimizer.scores.setdefault(host, HostScore()).update(speed, 1)
+        self.assertEqual(optimizer.plan([{'uri': 'http://a/f', 'status': 'used'}]), ([], []))
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_refill(self):
+        now = [0.0]
+        bucket = TokenBucket(2, burst=2, clock=lambda: now[0])
+        self.assertTrue(bucket.tryAcquire())
+        self.assertTrue(bucket.tryAcquire())
+        self.assertFalse(bucket.tryAcquire())
+        self.assertAlmostEqual(bucket.delay(), 0.5)
+        now[0] = 0.5
+        self.assertTrue(bucket.tryAcquire())
@@ -0,0 +1,64 @@
+import inspect
+import unittest
+
+import xmlrpc.client as xmlrpclib
+
+from pyaria2.pyaria2 import PyAria2, RPC_METHODS
+from tests.helpers import FakeServer, makeClient
+
+
+class TestRPCMethods(unittest.TestCase):
+    def test_everyMethodIsDefined(self):
+        for name, method, required, optional, prepare, doc in RPC_METHODS:
+            self.assertTrue(callable(getattr(PyAria2, name)), name)
+
+    def test_tokenIsPrepended(self):
+        client = makeClient("s3cret")
+        client.tellStatus("gid1", keys=["status"])
+        client.unpauseAll()
+        self.assertEqual(client.server.calls, [
+            ('aria2.tellStatus', ("token:s3cret", "gid1", ["status"])),
+            ('aria2.unpauseAll', ("token:s3cret",)),
+        ])
+
+    def test_withoutSecret(self):
+        client = makeClient()
+        client.changeUri("gid1", 1, [], ["http://a"])
+        self.assertEqual(client.server.calls, [('aria2.changeUri', ("gid1", 1, [], ["http://a"], None))])
+
+    def test_systemMethodsTakeNoToken(self):
+        client = makeClient("s3cret")
+        client.listMethods()
+        self.assertEqual(client.server.calls, [('system.listMethods', ())])
+
+    def test_argumentErrors(self):
+        client = makeClient()
+        self.assertRaises(TypeError, client.tellStatus)
+        self.assertRaises(TypeError, client.tellStatus, "gid1", gid="gid2")
+        self.assertRaises(TypeError, client.tellStatus, "gid1", nope=1)
+        self.assertEqual(str(inspect.signature(PyAria2.tellWaiting)), "(self, offset, num, keys=None)")
+
+    def test_batch(self):
+        client = makeClient("s3cret")
+        with client.batch() as batch:
+            self.assertEqual(batch.pause("gid1"), 0)
+            self.assertEqual(batch.remove("bad"), 1)
+        self.assertEqual(client.server.calls, [('system.multicall', ([
+            {'methodName': 'aria2.pause', 'params': ["token:s3cret", "gid1"]},
+            {'methodName': 'aria2.remove', 'params': ["token:s3cret", "bad"]},
+        ],))])
+        self.assertEqual(batch.results[0], 'ok')
+        self.assertIsInstance(batch.results[1], xmlrpclib.Fault)
+
+    def test_getOptions(self):
+        client = makeClient()
+        self.assertEqual(client.getOptions(["gid1", "gid2"]), ['ok', 'ok'])
+
+    def test_setServerDropsCachedProxies(self):
+        client = makeClient()
+        old = client.server
+        client.tellStatus("gid1")
+        client.server = FakeServer()
+        client.tellStatus("gid1")
+        self.assertEqual(len(old.calls), 1)
+        self.assertEqual(len(client.server.calls), 1)
@@ -0,0 +1,46 @@
+import unittest
+
+from pyaria2.pyaria2 import AriaServerSettings, normalize_option_value
+
+
+class FakeClient(object):
+    def __init__(self, live):
+        self.live = live
+        self.changes = []
+
+    def getGlobalOption(self):
+        return self.live
+
+    def changeGlobalOption(self, options):
+        self.changes.append(options)
+
+
+class TestSettingsDiff(unittest.TestCase):
+    def test_normalize(self):
+        self.assertEqual(normalize_option_value(True), 'true')
+        self.assertEqual(normalize_option_value('1M'), '1048576')
+        self.assertEqual(normalize_option_value('1.5K'), '1536')
+        self.assertEqual(normalize_option_value(2.0), '2')
+        self.assertEqual(normalize_option_value('1.5'), '1.5')
+        self.assertEqual(normalize_option_value('/tmp/x'), '/tmp/x')
+
+    def test_argvMatchesCommandLine(self):
+        settings = AriaServerSettings(dir='/tmp', continue_flag=True)
+        self.assertEqual(settings.construct_as_command_line(), ' '.join(settings.construct_as_argv()))
+        self.assertEqual(settings.construct_as_options()['continue'], 'true')
+
+    def test_applyTo(self):
+        settings = AriaServerSettings(max_overall_download_limit='1M', max_concurrent_downloads=5,
+                                      seed_ratio=1.0, rpc_secret='s', rpc_listen_port=6800, dir='/data')
+        client = FakeClient({'max-overall-download-limit': '0', 'max-concurrent-downloads': '5',
+                             'seed-ratio': '1.0', 'rpc-listen-port': '6801', 'dir': '/data',
+                             'save-session-interval': '60'})
+        applied, restart = settings.apply_to(client)
+        self.assertEqual(client.changes, [{'max-overall-download-limit': '1048576'}])
+        self.assertEqual(applied, {'max-overall-download-limit': ('1048576', '0')})
+        self.assertEqual(restart, {'rpc-listen-port': ('6800', '6801')})
+
+    def test_nothingToApply(self):
+        client = FakeClient({'rpc-listen-port': '6800', 'save-session-interval': '60'})
+        self.assertEqual(AriaServerSettings().apply_to(client), ({}, {}))
+        self.assertEqual(client.changes, [])
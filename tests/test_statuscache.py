@@ -0,0 +1,78 @@
+import multiprocessing
+import os
+import tempfile
+import unittest
+
+from pyaria2.statuscache import SharedStatusCache, SnapshotUnavailable
+from tests.helpers import makeClient
+
+
+ACTIVE = [{'gid': '00000000000000a1', 'status': 'active'}]
+STOPPED = [{'gid': '00000000000000b2', 'status': 'complete'}]
+
+
+def makeStatusClient(stopped=STOPPED):
+    return makeClient(handlers={
+        'aria2.getGlobalStat': lambda: {'numWaiting': '0', 'numStopped': str(len(stopped))},
+        'aria2.tellActive': lambda keys: ACTIVE,
+        'aria2.tellWaiting': lambda offset, num, keys: [],
+        'aria2.tellStopped': lambda offset, num, keys: stopped[offset:offset + num],
+    })
+
+
+def readFromOtherProcess(name, lock_path, queue):
+    cache = SharedStatusCache(name, lock_path=lock_path)
+    queue.put((cache.get('00000000000000b2'), cache.elect()))
+    cache.close()
+
+
+class TestSharedStatusCache(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.name = 'pyaria2-test-%d' % os.getpid()
+        self.lockPath = os.path.join(self.workdir.name, 'lock')
+        self.cache = SharedStatusCache(self.name, makeStatusClient(), size=64 * 1024, lock_path=self.lockPath)
+
+    def tearDown(self):
+        self.cache.close()
+        self.cache.unlink()
+        self.workdir.cleanup()
+
+    def test_nothingPublished(self):
+        self.assertRaises(SnapshotUnavailable, self.cache.get, '00000000000000a1')
+
+    def test_publishAndRead(self):
+        self.cache.runOnce()
+        self.assertTrue(self.cache.isLeader)
+        self.assertEqual(self.cache.get('00000000000000a1'), {'gid': '00000000000000a1', 'status': 'active'})
+        self.assertIsNone(self.cache.get('00000000000000ff'))
+        self.assertEqual(self.cache.gids(), ['00000000000000a1', '00000000000000b2'])
+        self.assertEqual(len(self.cache.snapshot()), 2)
+        self.assertLess(self.cache.age(), 60)
+
+    def test_otherProcessReadsWithoutBecomingLeader(self):
+        self.cache.runOnce()
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=readFromOtherProcess, args=(self.name, self.lockPath, queue))
+        process.start()
+        status, elected = queue.get(timeout=10)
+        process.join()
+        self.assertEqual(status['status'], 'complete')
+        self.assertFalse(elected)
+
+    def test_tooLarge(self):
+        self.cache.client = makeStatusClient([{'gid': '%016x' % (i + 1), 'status': 'complete', 'pad': 'x' * 100}
+                                              for i in range(1000)])
+        self.assertRaises(ValueError, self.cache.runOnce)
+
+    def test_readersIgnoreTheSlotBeingWritten(self):
+        self.cache.runOnce()
+        self.assertEqual(self.cache.client.server.multicalls(),
+                         [['aria2.tellActive', 'aria2.tellWaiting', 'aria2.tellStopped']])
+        # A publish in progress only touches the inactive slot
+        self.cache.writeSlot(1 - self.cache.activeSlot, [(bytes.fromhex('00000000000000c3'), b'{"gid":"00000000000000c3"}')])
+        self.assertEqual(self.cache.gids(), ['00000000000000a1', '00000000000000b2'])
+        self.cache.publish([{'gid': '00000000000000c3', 'status': 'waiting'}])
+        self.assertEqual(self.cache.gids(), ['00000000000000c3'])
+        self.cache.publish(STOPPED)
+        self.assertEqual(self.cache.snapshot(), STOPPED)
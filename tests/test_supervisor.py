@@ -0,0 +1,229 @@
+import os
+import subprocess
+import tempfile
+import unittest
+
+import xmlrpc.client as xmlrpclib
+
+from pyaria2.inputfile import compileInputFile
+from pyaria2.pyaria2 import AriaServerSettings
+from pyaria2.supervisor import AriaDaemon, AriaSupervisor, loadSession
+from tests.helpers import makeClient
+
+
+def refuseSecondUri(uris, options=None, position=None):
+    if uris == ["http://a/2"]:
+        raise xmlrpclib.Fault(1, 'GID %s is not unique' % options['gid'])
+    return options['gid']
+
+
+class FakeProcess(object):
+    def __init__(self, exits_on=()):
+        self.returncode = None
+        self.exitsOn = list(exits_on)
+        self.signals = []
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        if self.returncode is None:
+            raise subprocess.TimeoutExpired('aria2c', timeout)
+        return self.returncode
+
+    def terminate(self):
+        self.signals.append('terminate')
+        if 'terminate' in self.exitsOn:
+            self.returncode = -15
+
+    def kill(self):
+        self.signals.append('kill')
+        self.returncode = -9
+
+
+class FakeHealth(object):
+    '''
+    Stands in for the ServerProxy of an AriaDaemon.
+    '''
+
+    def __init__(self, process, exits_on=()):
+        self.process, self.exitsOn, self.calls = process, exits_on, []
+
+    @property
+    def aria2(self):
+        return self
+
+    def __getattr__(self, name):
+        def call(*params):
+            self.calls.append(name)
+            if name in self.exitsOn:
+                self.process.returncode = 0
+            return 'OK'
+        return call
+
+
+class FakeDaemon(object):
+    def __init__(self, settings, health_timeout=None):
+        self.settings = settings
+        self.process = FakeProcess()
+        self.client = makeClient(handlers={'aria2.addUri': refuseSecondUri})
+        self.failures = 0
+        self.responding = True
+        self.inputFile = None
+
+    @property
+    def serverUri(self):
+        return 'http://localhost:%d/rpc' % self.settings.rpc_listen_port
+
+    def start(self, input_file=None):
+        self.inputFile = input_file
+        return self
+
+    def isAlive(self):
+        return self.process.returncode is None
+
+    def check(self):
+        if self.isAlive() and self.responding:
+            self.failures = 0
+            return True
+        self.failures += 1
+        return False
+
+    def kill(self):
+        self.process.returncode = -9
+
+    def shutdown(self, force=False):
+        self.process.returncode = 0
+
+
+class FakeSupervisor(AriaSupervisor):
+    daemonClass = FakeDaemon
+
+
+class TestSupervisor(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.session = os.path.join(self.workdir.name, "session")
+        self.settings = AriaServerSettings(rpc_listen_port=6801, save_session=self.session)
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def launch(self, spare_ports=()):
+        supervisor = FakeSupervisor(self.settings, spare_ports, max_failures=2)
+        supervisor.launch()
+        supervisor.stop()
+        return supervisor
+
+    def test_argvNeedsNoShell(self):
+        settings = AriaServerSettings(rpc_listen_port=6801, dir="/tmp/with space", continue_flag=True)
+        argv = AriaDaemon(settings).argv(input_file="/tmp/session")
+        self.assertEqual(argv[:2], ['aria2c', '--enable-rpc'])
+        self.assertIn('--dir=/tmp/with space', argv)
+        self.assertIn('--continue=true', argv)
+        self.assertIn('--input-file=/tmp/session', argv)
+        self.assertIsNone(settings.input_file)
+
+    def test_loadSession(self):
+        torrent = os.path.join(self.workdir.name, "a.torrent")
+        open(torrent, "wb").close()
+        gids = compileInputFile([(["http://a/1"], {"dir": "/x"}), torrent, "http://a/2"], self.session)
+        client = makeClient(handlers={'aria2.addUri': refuseSecondUri})
+        with self.assertLogs('pyaria2.supervisor', 'WARNING') as logs:
+            self.assertEqual(loadSession(client, self.session, batch_size=2), 2)
+        self.assertIn('http://a/2', logs.output[0])
+        self.assertEqual(client.server.multicalls(), [['aria2.addUri', 'aria2.addTorrent'], ['aria2.addUri']])
+        self.assertEqual(client.server.multicalls('aria2.addUri')[0], [[["http://a/1"], {"dir": "/x", "gid": gids[0]},
+                                                                         None]])
+
+    def test_unresponsiveDaemonIsReplacedAfterMaxFailures(self):
+        supervisor = self.launch()
+        failed = supervisor.primary
+        failed.responding = False
+        supervisor.runOnce()
+        self.assertIs(supervisor.primary, failed)
+        supervisor.runOnce()
+        self.assertIsNot(supervisor.primary, failed)
+        self.assertFalse(failed.isAlive())
+        self.assertEqual(supervisor.restarts, 1)
+
+    def test_coldRestartFromSession(self):
+        compileInputFile(["http://a/1"], self.session)
+        supervisor = self.launch()
+        client = makeClient()
+        supervisor.attach(client)
+        supervisor.primary.kill()
+        supervisor.runOnce()
+        self.assertEqual(supervisor.primary.inputFile, self.session)
+        self.assertEqual(supervisor.primary.settings.rpc_listen_port, 6801)
+        self.assertIn('localhost:6801/rpc', repr(client.server))
+
+    def test_spareIsPromoted(self):
+        compileInputFile(["http://a/1", "http://a/2"], self.session)
+        failovers = []
+        supervisor = self.launch([6802])
+        supervisor.onFailover = failovers.append
+        client = makeClient()
+        supervisor.attach(client)
+        spare = supervisor.spares[0]
+        supervisor.primary.kill()
+        supervisor.runOnce()
+        self.assertIs(supervisor.primary, spare)
+        self.assertEqual(failovers, [spare])
+        self.assertIn('localhost:6802/rpc', repr(client.server))
+        calls = spare.client.server.calls
+        self.assertEqual(calls[0], ('aria2.changeGlobalOption', ({'save-session': self.session},)))
+        self.assertEqual(supervisor.settings.rpc_listen_port, 6802)
+        # The failed primary's port hosts the new spare
+        self.assertEqual([daemon.settings.rpc_listen_port for daemon in supervisor.spares], [6801])
+        self.assertIsNone(supervisor.spares[0].settings.save_session)
+
+    def test_brokenSpareIsReplaced(self):
+        supervisor = self.launch([6802])
+        broken = supervisor.spares[0]
+        broken.responding = False
+        supervisor.primary.kill()
+        supervisor.runOnce()
+        self.assertFalse(broken.isAlive())
+        self.assertEqual(supervisor.primary.settings.rpc_listen_port, 6801)
+        self.assertEqual(len(supervisor.spares), 1)
+        self.assertIsNot(supervisor.spares[0], broken)
+        self.assertEqual(supervisor.spares[0].settings.rpc_listen_port, 6802)
+
+    def test_deadSpareIsReplaced(self):
+        supervisor = self.launch([6802])
+        dead = supervisor.spares[0]
+        dead.kill()
+        supervisor.runOnce()
+        self.assertEqual(len(supervisor.spares), 1)
+        self.assertIsNot(supervisor.spares[0], dead)
+
+
+class TestDaemonShutdown(unittest.TestCase):
+    def makeDaemon(self, process_exits_on=(), rpc_exits_on=()):
+        daemon = AriaDaemon(AriaServerSettings(rpc_listen_port=6801))
+        daemon.process = FakeProcess(process_exits_on)
+        daemon._health = FakeHealth(daemon.process, rpc_exits_on)
+        return daemon
+
+    def test_gracefulShutdown(self):
+        daemon = self.makeDaemon(rpc_exits_on=('shutdown',))
+        daemon.shutdown(timeout=0)
+        self.assertEqual(daemon._health.calls, ['shutdown'])
+        self.assertEqual(daemon.process.signals, [])
+
+    def test_escalatesToForceShutdown(self):
+        daemon = self.makeDaemon(rpc_exits_on=('forceShutdown',))
+        daemon.shutdown(timeout=0)
+        self.assertEqual(daemon._health.calls, ['shutdown', 'forceShutdown'])
+        self.assertEqual(daemon.process.signals, [])
+
+    def test_escalatesToSignals(self):
+        daemon = self.makeDaemon()
+        daemon.shutdown(timeout=0)
+        self.assertEqual(daemon._health.calls, ['shutdown', 'forceShutdown'])
+        self.assertEqual(daemon.process.signals, ['terminate', 'kill'])
+
+        daemon = self.makeDaemon(process_exits_on=('terminate',))
+        daemon.shutdown(timeout=0)
+        self.assertEqual(daemon.process.signals, ['terminate'])
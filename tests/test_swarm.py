@@ -0,0 +1,80 @@
+import unittest
+
+from pyaria2.swarm import SwarmTuner
+from tests.helpers import makeClient
+
+
+def torrent(gid, completed, total=100, speed=0, uploaded=0, upload_speed=0):
+    return {'gid': gid, 'status': 'active', 'infoHash': 'h' + gid, 'totalLength': str(total),
+            'completedLength': str(completed), 'downloadSpeed': str(speed), 'uploadLength': str(uploaded),
+            'uploadSpeed': str(upload_speed), 'connections': '0',
+            'seeder': 'true' if completed == total else 'false'}
+
+
+def makeSwarmClient(torrents, peers, max_peers='55'):
+    client = makeClient(handlers={
+        'aria2.tellActive': lambda keys: list(torrents),
+        'aria2.getPeers': lambda gid: peers.get(gid, []),
+        'aria2.getOption': lambda gid: {'bt-max-peers': max_peers},
+        'aria2.changeOption': lambda gid, options: client.changes.append((gid, options)) or 'OK',
+        'aria2.remove': lambda gid: client.removed.append(gid) or gid,
+    })
+    client.changes, client.removed = [], []
+    return client
+
+
+class TestSwarmTuner(unittest.TestCase):
+    def test_raisesCapOfSaturatedUsefulSwarm(self):
+        peers = {'a': [{'downloadSpeed': '1000'}] * 55}
+        client = makeSwarmClient([torrent('a', 10, speed=200000)], peers)
+        SwarmTuner(client).runOnce()
+        self.assertEqual(client.changes, [('a', {'bt-max-peers': '82', 'bt-request-peer-speed-limit': '250000'})])
+
+    def test_startsFromTheDaemonsPeerCap(self):
+        peers = {'a': [{'downloadSpeed': '1000'}] * 150}
+        client = makeSwarmClient([torrent('a', 10, speed=40000)], peers, max_peers='200')
+        tuner = SwarmTuner(client)
+        tuner.runOnce()
+        tuner.runOnce()
+        self.assertEqual(client.changes, [('a', {'bt-request-peer-speed-limit': '51200'})])
+        self.assertEqual(client.server.multicalls(), [['aria2.getOption']])
+
+    def test_unlimitedCapIsOnlyLowered(self):
+        client = makeSwarmClient([torrent('a', 10), torrent('b', 10)],
+                                 {'a': [{'downloadSpeed': '1000'}] * 300, 'b': [{'downloadSpeed': '0'}] * 90},
+                                 max_peers='0')
+        SwarmTuner(client).runOnce()
+        caps = dict((gid, options.get('bt-max-peers')) for gid, options in client.changes)
+        self.assertEqual(caps, {'a': None, 'b': '60'})
+
+    def test_onlySignificantChangesAreApplied(self):
+        client = makeSwarmClient([torrent('a', 10)], {'a': []})
+        tuner = SwarmTuner(client)
+        tuner.runOnce()
+        tuner.runOnce()
+        self.assertEqual(len(client.changes), 1)
+
+    def test_stopsAtSeedRatioAndSharesUpload(self):
+        client = makeSwarmClient([torrent('a', 100, uploaded=150, upload_speed=500),
+                                  torrent('b', 100, uploaded=20, upload_speed=500), torrent('c', 10)],
+                                 {'b': [{'downloadSpeed': '0', 'seeder': 'false'}] * 2
+                                  + [{'downloadSpeed': '0', 'seeder': 'true'}] * 5,
+                                  'c': [{'downloadSpeed': '0', 'seeder': 'false'}] * 4})
+        SwarmTuner(client, upload_budget=100000).runOnce()
+        self.assertEqual(client.removed, ['a'])
+        limits = dict((gid, int(options['max-upload-limit'])) for gid, options in client.changes)
+        self.assertEqual(limits, {'b': 33333, 'c': 66666})
+
+    def test_stopsIdleSeeding(self):
+        torrents = [torrent('a', 100, uploaded=10, upload_speed=0), torrent('b', 100, uploaded=10, upload_speed=100)]
+        client = makeSwarmClient(torrents, {})
+        tuner = SwarmTuner(client, idle_runs=3)
+        tuner.runOnce()
+        torrents[0]['uploadSpeed'] = '100'
+        tuner.runOnce()
+        torrents[0]['uploadSpeed'] = '0'
+        for _ in range(2):
+            tuner.runOnce()
+        self.assertEqual(client.removed, [])
+        tuner.runOnce()
+        self.assertEqual(client.removed, ['a'])
@@ -0,0 +1,76 @@
+import threading
+import time
+import unittest
+
+from pyaria2.pyaria2 import rpcPriority
+from pyaria2.ratelimit import PRIORITY_CONTROL, PRIORITY_READ, PRIORITY_SUBMIT, PriorityTokenBucket
+from pyaria2.singleflight import SingleFlight
+
+from tests.helpers import makeClient
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrentCallsAreCoalesced(self):
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {'status': 'active'}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('key', slow))) for i in range(5)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        while flight.coalesced < 4:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'status': 'active'}] * 5)
+        self.assertEqual(len(set(id(result) for result in results)), 5)
+
+    def test_errorIsShared(self):
+        flight = SingleFlight()
+        self.assertRaises(ZeroDivisionError, flight.do, 'key', lambda: 1 / 0)
+        self.assertEqual(flight.do('key', lambda: 2), 2)
+
+
+class TestPriorityTokenBucket(unittest.TestCase):
+    def test_controlGoesFirst(self):
+        bucket = PriorityTokenBucket(20, burst=1)
+        bucket.acquire()
+        order = []
+
+        def take(priority, name):
+            bucket.acquire(priority=priority)
+            order.append(name)
+
+        threads = [threading.Thread(target=take, args=(PRIORITY_READ, 'read%d' % i)) for i in range(3)]
+        threads.append(threading.Thread(target=take, args=(PRIORITY_CONTROL, 'control')))
+        for thread in threads:
+            thread.start()
+            time.sleep(0.005)
+        for thread in threads:
+            thread.join()
+        self.assertLess(order.index('control'), 2)
+
+    def test_rpcPriority(self):
+        self.assertEqual(rpcPriority('aria2.tellStatus'), PRIORITY_READ)
+        self.assertEqual(rpcPriority('aria2.addUri'), PRIORITY_SUBMIT)
+        self.assertEqual(rpcPriority('aria2.forcePause'), PRIORITY_CONTROL)
+
+
+class TestClientThrottling(unittest.TestCase):
+    def test_writesAreNotCoalesced(self):
+        client = makeClient(coalesce=True, rate_limit=1000)
+        client.tellStatus("gid1")
+        client.pause("gid1")
+        self.assertEqual(client._singleFlight.calls, 1)
+        self.assertEqual(len(client.server.calls), 2)
@@ -0,0 +1,120 @@
+import gzip
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import xmlrpc.client as xmlrpclib
+
+from pyaria2.traffic import RPCRecorder, StandInServer, loadRecording, main, replay
+
+from tests.helpers import makeClient
+
+
+class TestTraffic(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.workdir.name, 'calls.log.gz')
+        self.server = StandInServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+        self.workdir.cleanup()
+
+    def record(self):
+        client = makeClient("s3cret")
+        client.serverUri = self.server.uri
+        RPCRecorder(self.path).attach(client)
+        client.tellStatus("gid1", ["status"])
+        client._call('aria2.addTorrent', (xmlrpclib.Binary(b'd4:infoe'), [], {}, None))
+        with client.batch() as batch:
+            batch.pause("gid1")
+        client.recorder.close()
+
+    def test_recordWithoutSecret(self):
+        self.record()
+        calls = loadRecording(self.path)
+        self.assertEqual([call['m'] for call in calls], ['aria2.tellStatus', 'aria2.addTorrent', 'system.multicall'])
+        self.assertEqual(calls[0]['p'], ["gid1", ["status"]])
+        self.assertEqual(calls[1]['p'][0].data, b'd4:infoe')
+        self.assertEqual(calls[2]['p'], [[{'methodName': 'aria2.pause', 'params': ["gid1"]}]])
+        # Sizes as received, the stand-in answers the unknown methods with an empty string
+        self.assertTrue(all(call['s'] > 0 for call in calls))
+        self.assertEqual(calls[0]['s'], len(xmlrpclib.dumps(('',), methodresponse=True, allow_none=True)))
+        with open(self.path, 'rb') as fileobj:
+            self.assertNotIn(b's3cret', fileobj.read())
+
+    def test_credentialsAreRedacted(self):
+        client = makeClient("s3cret")
+        client.serverUri = self.server.uri
+        RPCRecorder(self.path).attach(client)
+        options = {'http-passwd': 'pw1', 'all-proxy-passwd': 'pw2', 'http-user': 'ann',
+                   'header': ['Authorization: Bearer tok3n', 'Accept: */*']}
+        client.addUri(['http://a/1'], options)
+        with client.batch() as batch:
+            batch.changeOption("gid1", {'ftp-passwd': 'pw4', 'header': 'Cookie: sid=c00kie'})
+        client.recorder.close()
+        calls = loadRecording(self.path)
+        self.assertEqual(calls[0]['p'][1], {'http-passwd': '<redacted>', 'all-proxy-passwd': '<redacted>',
+                                            'http-user': 'ann',
+                                            'header': ['Authorization: <redacted>', 'Accept: */*']})
+        self.assertEqual(calls[1]['p'][0][0]['params'][1], {'ftp-passwd': '<redacted>',
+                                                            'header': 'Cookie: <redacted>'})
+        with open(self.path, 'rb') as fileobj:
+            data = gzip.decompress(fileobj.read())
+        for secret in (b'pw1', b'pw2', b'tok3n', b'pw4', b'c00kie'):
+            self.assertNotIn(secret, data)
+
+    def test_replay(self):
+        self.record()
+        report = replay(loadRecording(self.path), self.server.uri, speed=0, workers=2, secret="other")
+        self.assertEqual((report.calls, report.errors), (3, 0))
+        self.assertEqual(report.methods['system.multicall'], 1)
+        self.assertGreater(report.percentile(0.99), 0)
+        self.assertIn('p99', str(report))
+
+    def test_concurrentCalls(self):
+        client = makeClient("s3cret")
+        client.serverUri = self.server.uri
+        RPCRecorder(self.path).attach(client)
+        errors = []
+
+        def work():
+            for _ in range(20):
+                try:
+                    client.tellStatus("gid1", ["status"])
+                except Exception as e:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=work) for _ in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        client.recorder.close()
+        self.assertEqual(errors, [])
+        calls = loadRecording(self.path)
+        self.assertEqual(len(calls), 320)
+        self.assertTrue(all(call['s'] > 0 for call in calls))
+
+    def test_cli(self):
+        self.record()
+        main([self.path, '--stand-in', '--speed', '0'])
+
+    def test_latencyIncludesQueueing(self):
+        calls = [{'t': 0, 'm': 'aria2.getVersion', 'p': []} for _ in range(20)]
+        server = StandInServer(calls).start()
+        slow = server.server.instance._dispatch
+
+        def dispatch(method, params):
+            time.sleep(0.02)
+            return slow(method, params)
+
+        server.server.instance._dispatch = dispatch
+        try:
+            report = replay(calls, server.uri, speed=1, workers=1)
+        finally:
+            server.stop()
+        # With one worker, the last call waited for the 19 before it
+        self.assertGreater(report.percentile(1.0), 19 * 0.02)
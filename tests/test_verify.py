@@ -0,0 +1,81 @@
+import hashlib
+import os
+import tempfile
+import unittest
+
+from pyaria2.verify import Verifier, hashFile
+from tests.helpers import makeClient
+
+
+class TestVerify(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.good = os.path.join(self.workdir.name, 'good')
+        self.bad = os.path.join(self.workdir.name, 'bad')
+        for path in (self.good, self.bad):
+            with open(path, 'wb') as fileobj:
+                fileobj.write(b'x' * 100000)
+        self.digest = hashlib.sha256(b'x' * 100000).hexdigest()
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def test_hashFileMultipleAlgorithms(self):
+        digests = hashFile(self.good, ('md5', 'sha256'), chunk_size=4096)
+        self.assertEqual(digests, {'md5': hashlib.md5(b'x' * 100000).hexdigest(), 'sha256': self.digest})
+        empty = os.path.join(self.workdir.name, 'empty')
+        open(empty, 'wb').close()
+        self.assertEqual(hashFile(empty), {'sha256': hashlib.sha256(b'').hexdigest()})
+
+    def test_verifyAndRequeue(self):
+        client = makeClient(handlers={'aria2.addUri': lambda uris, options=None, position=None: 'gid0'})
+        manifest = {self.good: {'sha256': self.digest}, self.bad: {'sha256': '0' * 64}}
+        verifier = Verifier(manifest, client, requeue=True, workers=2)
+        try:
+            results = verifier.verify([
+                {'gid': 'a', 'status': 'complete', 'files': [
+                    {'path': self.good, 'selected': 'true', 'uris': []},
+                    {'path': self.bad, 'selected': 'true', 'uris': [{'uri': 'http://m/bad', 'status': 'used'}]}]},
+                {'gid': 'b', 'status': 'error', 'files': [{'path': self.bad}]},
+            ])
+        finally:
+            verifier.close()
+        self.assertEqual([result.ok for result in results], [True, False])
+        self.assertEqual(client.server.multicalls('aria2.addUri'), [[[['http://m/bad'], {
+            'dir': self.workdir.name, 'out': 'bad', 'allow-overwrite': 'true'}, None]]])
+        self.assertEqual(list(verifier.seen), ['a', 'b'])
+
+    def test_removedAfterSeedingIsVerified(self):
+        verifier = Verifier({self.bad: {'sha256': '0' * 64}}, workers=1)
+        try:
+            results = verifier.verify([{'gid': 'a', 'status': 'removed', 'totalLength': '10',
+                                        'completedLength': '10', 'files': [{'path': self.bad}]}])
+        finally:
+            verifier.close()
+        self.assertEqual([result.ok for result in results], [False])
+
+    def test_pagesBackToThePreviousRun(self):
+        stopped = [{'gid': 'gid%d' % i, 'status': 'error', 'files': []} for i in range(7)]
+        requested = []
+
+        def tellStopped(offset, num, keys=None):
+            requested.append(offset)
+            start = len(stopped) + offset
+            return [stopped[i] for i in range(start, max(start - num, -1), -1)]
+
+        client = makeClient(handlers={'aria2.tellStopped': tellStopped,
+                                      'aria2.getGlobalStat': lambda: {'numStopped': str(len(stopped))}})
+        verifier = Verifier({}, client, workers=1, page_size=3)
+        try:
+            verifier.runOnce()
+            self.assertEqual(requested, [-1, -4, -7])
+            self.assertEqual(list(verifier.seen), ['gid1', 'gid2', 'gid3', 'gid4', 'gid5', 'gid6'])
+            verifier.verify([{'gid': 'x0', 'status': 'error'}])
+            del requested[:]
+            stopped.extend({'gid': 'gid%d' % i, 'status': 'error', 'files': []} for i in range(7, 12))
+            verifier.runOnce()
+        finally:
+            verifier.close()
+        self.assertEqual(requested, [-1, -4])
+        self.assertEqual(list(verifier.seen), ['x0', 'gid7', 'gid8', 'gid9', 'gid10', 'gid11'])
+        self.assertEqual(verifier.marks, set(['gid11', 'gid10', 'gid9']))